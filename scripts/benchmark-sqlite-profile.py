@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark concurrent report ingest and dashboard reads on SQLite under the default and the
+tuned connection profile (TRIKUSEC_SQLITE_PROFILE).
+
+Writer processes play the Lynis API (a report upload is one write transaction: store the
+report, update the device, log an event, prune old reports). Reader processes play the admin
+UI (a dashboard render is one read transaction of a few aggregate queries plus template
+rendering time). Both share one database file, as the two services do.
+
+Usage: python scripts/benchmark-sqlite-profile.py [--devices 2000] [--writers 4] [--readers 4] [--seconds 10]
+Uses only the standard library; the tuned profile mirrors trikusec.settings.base.sqlite_tuned_options.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+TUNED_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'cache_size=-65536',
+    'mmap_size=268435456',
+    'temp_store=MEMORY',
+]
+PROFILES = {
+    # Django's SQLite defaults: rollback journal, 5 s timeout, deferred transactions, no retries
+    'default': {'timeout': 5.0, 'pragmas': [], 'begin': 'BEGIN', 'retries': 0},
+    'tuned': {'timeout': 20.0, 'pragmas': TUNED_PRAGMAS, 'begin': 'BEGIN IMMEDIATE', 'retries': 5},
+}
+RETRY_DELAY = 0.05
+REPORT_SIZE = 50 * 1024
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None)
+    for pragma in profile['pragmas']:
+        conn.execute(f'PRAGMA {pragma}')
+    return conn
+
+
+def setup(path, devices):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript('''
+        CREATE TABLE device (id INTEGER PRIMARY KEY, hostname TEXT, compliant INTEGER, warnings INTEGER, last_update REAL);
+        CREATE TABLE fullreport (id INTEGER PRIMARY KEY, device_id INTEGER, full_report TEXT, created_at REAL);
+        CREATE INDEX fullreport_device ON fullreport (device_id, created_at);
+        CREATE TABLE deviceevent (id INTEGER PRIMARY KEY, device_id INTEGER, event_type TEXT, created_at REAL);
+        CREATE INDEX deviceevent_created ON deviceevent (created_at);
+    ''')
+    body = 'x' * REPORT_SIZE
+    now = time.time()
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO device VALUES (?, ?, ?, ?, ?)',
+        [(i, f'host-{i}', i % 3 != 0, i % 40, now) for i in range(1, devices + 1)],
+    )
+    conn.executemany(
+        'INSERT INTO fullreport (device_id, full_report, created_at) VALUES (?, ?, ?)',
+        [(i, body, now) for i in range(1, devices + 1)],
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def run_transaction(conn, profile, statements):
+    """Run statements in one transaction; returns the number of lock errors that were retried."""
+    for attempt in range(profile['retries'] + 1):
+        try:
+            conn.execute(profile['begin'])
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params).fetchall()
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            return attempt
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == profile['retries']:
+                raise
+            time.sleep(random.uniform(0, RETRY_DELAY * 2 ** attempt))
+
+
+def writer(path, profile_name, devices, deadline, results):
+    profile = PROFILES[profile_name]
+    conn = connect(path, profile)
+    body = 'y' * REPORT_SIZE
+    latencies, errors, retries = [], 0, 0
+    while time.time() < deadline:
+        device_id = random.randint(1, devices)
+        now = time.time()
+        statements = [
+            ('SELECT id FROM fullreport WHERE device_id = ? ORDER BY created_at DESC LIMIT 1', (device_id,)),
+            ('INSERT INTO fullreport (device_id, full_report, created_at) VALUES (?, ?, ?)', (device_id, body, now)),
+            ('UPDATE device SET last_update = ?, warnings = ? WHERE id = ?', (now, random.randint(0, 40), device_id)),
+            ('INSERT INTO deviceevent (device_id, event_type, created_at) VALUES (?, ?, ?)', (device_id, 'report', now)),
+            ('DELETE FROM fullreport WHERE device_id = ? AND id NOT IN '
+             '(SELECT id FROM fullreport WHERE device_id = ? ORDER BY created_at DESC LIMIT 2)', (device_id, device_id)),
+        ]
+        started = time.perf_counter()
+        try:
+            retries += run_transaction(conn, profile, statements)
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(('write', latencies, errors, retries))
+
+
+def reader(path, profile_name, deadline, results):
+    profile = PROFILES[profile_name]
+    conn = connect(path, profile)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN')
+            conn.execute('SELECT compliant, COUNT(*), AVG(warnings) FROM device GROUP BY compliant').fetchall()
+            conn.execute('SELECT hostname FROM device ORDER BY last_update DESC LIMIT 25').fetchall()
+            conn.execute(
+                'SELECT d.id, MAX(r.created_at) FROM device d JOIN fullreport r ON r.device_id = d.id GROUP BY d.id'
+            ).fetchall()
+            conn.execute('SELECT * FROM deviceevent ORDER BY created_at DESC LIMIT 50').fetchall()
+            time.sleep(0.02)  # Template rendering while the read transaction is open
+            conn.execute('COMMIT')
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    results.put(('read', latencies, errors, 0))
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark(profile_name, args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.sqlite3')
+        setup(path, args.devices)
+        # Initialize WAL mode (persistent) before the workers start, as the first connection would
+        connect(path, PROFILES[profile_name]).close()
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + args.seconds
+        processes = [
+            multiprocessing.Process(target=writer, args=(path, profile_name, args.devices, deadline, results))
+            for _ in range(args.writers)
+        ] + [
+            multiprocessing.Process(target=reader, args=(path, profile_name, deadline, results))
+            for _ in range(args.readers)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    writes = [latency for kind, latencies, _, _ in collected if kind == 'write' for latency in latencies]
+    reads = [latency for kind, latencies, _, _ in collected if kind == 'read' for latency in latencies]
+    write_errors = sum(errors for kind, _, errors, _ in collected if kind == 'write')
+    read_errors = sum(errors for kind, _, errors, _ in collected if kind == 'read')
+    retries = sum(retried for _, _, _, retried in collected)
+    print(
+        f'{profile_name:8} ingest {len(writes) / args.seconds:7.1f}/s '
+        f'p50 {statistics.median(writes) * 1000 if writes else float("nan"):7.1f} ms '
+        f'p95 {percentile(writes, 0.95) * 1000:7.1f} ms  locked {write_errors:4} (retried {retries:4}) | '
+        f'dashboard {len(reads) / args.seconds:7.1f}/s '
+        f'p50 {statistics.median(reads) * 1000 if reads else float("nan"):7.1f} ms '
+        f'p95 {percentile(reads, 0.95) * 1000:7.1f} ms  locked {read_errors:4}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    for profile_name in PROFILES:
+        benchmark(profile_name, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 import json
-from .models import LicenseKey, Device, FullReport, DiffReport, PolicyRule, PolicyRuleset, Organization, ActivityIgnorePattern, Label
+from .models import LicenseKey, Device, FullReport, DiffReport, PolicyRule, PolicyRuleset, Organization, ActivityIgnorePattern, Label, ComplianceResult, ReportFinding, ComplianceJob, ComplianceSnapshot, PolicyRuleStats
 
 @admin.register(Organization)
 class OrganizationAdmin(admin.ModelAdmin):
@@ -41,7 +41,7 @@ class DeviceAdmin(admin.ModelAdmin):
     list_display = ('hostname', 'hostid', 'os_display', 'lynis_version', 'warnings', 'labels_display', 'compliance_status', 'last_update')
     list_filter = ('compliant', 'os', 'labels', 'created_at', 'last_update', 'licensekey')
     search_fields = ('hostname', 'hostid', 'hostid2', 'os', 'distro', 'labels__name')
-    readonly_fields = ('created_at', 'updated_at', 'hostid', 'hostid2')
+    readonly_fields = ('created_at', 'updated_at', 'hostid', 'hostid2', 'non_compliant_since')
     date_hierarchy = 'last_update'
     filter_horizontal = ('rulesets', 'labels')
     
@@ -56,7 +56,7 @@ class DeviceAdmin(admin.ModelAdmin):
             'fields': ('labels',)
         }),
         ('Compliance', {
-            'fields': ('warnings', 'compliant', 'rulesets')
+            'fields': ('warnings', 'compliant', 'non_compliant_since', 'rulesets')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at', 'last_update'),
@@ -122,6 +122,37 @@ class DiffReportAdmin(admin.ModelAdmin):
             preview = str(obj.diff_report)[:100] + '...' if len(str(obj.diff_report)) > 100 else str(obj.diff_report)
         return format_html('<pre style="white-space: pre-wrap;">{}</pre>', preview)
 
+@admin.register(ComplianceResult)
+class ComplianceResultAdmin(admin.ModelAdmin):
+    list_display = ('device', 'rule', 'passed', 'evaluated_at')
+    list_filter = ('passed', 'rule')
+    search_fields = ('device__hostname', 'device__hostid', 'rule__name')
+    readonly_fields = ('device', 'rule', 'report', 'passed', 'error', 'evaluated_at')
+
+@admin.register(ReportFinding)
+class ReportFindingAdmin(admin.ModelAdmin):
+    list_display = ('device', 'finding_type', 'test_id', 'description')
+    list_filter = ('finding_type',)
+    search_fields = ('device__hostname', 'test_id', 'description')
+    readonly_fields = ('device', 'report', 'finding_type', 'test_id', 'description')
+
+@admin.register(ComplianceJob)
+class ComplianceJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'scope', 'scope_id', 'status', 'cursor', 'refreshed', 'skipped', 'created_at', 'finished_at')
+    list_filter = ('status', 'scope')
+    readonly_fields = ('device_ids', 'cursor', 'refreshed', 'skipped', 'error', 'created_at', 'started_at', 'finished_at', 'updated_at')
+
+@admin.register(ComplianceSnapshot)
+class ComplianceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('date', 'scope', 'scope_id', 'total', 'compliant', 'non_compliant', 'unknown', 'avg_hardening_index')
+    list_filter = ('scope',)
+    date_hierarchy = 'date'
+
+@admin.register(PolicyRuleStats)
+class PolicyRuleStatsAdmin(admin.ModelAdmin):
+    list_display = ('rule', 'evaluations', 'errors', 'avg_ms', 'p95_ms', 'is_slow', 'updated_at')
+    readonly_fields = ('rule', 'evaluations', 'errors', 'total_time', 'histogram', 'updated_at')
+
 @admin.register(PolicyRule)
 class PolicyRuleAdmin(admin.ModelAdmin):
     list_display = ('name', 'rule_query', 'enabled', 'alert', 'rule_status', 'created_by', 'is_system', 'created_at', 'updated_at')
@@ -1,6 +1,8 @@
 from django.http import JsonResponse
 from django.db import connection
 from django.core.cache import cache
+from api.utils.view_cache import fragment_cache_stats
+from api.utils.ingest_funnel import ingest_mode, spool_stats
 import logging
 
 def health_check(request):
@@ -32,5 +34,26 @@ def health_check(request):
         if status_code == 200:
             status_code = 200  # Cache failure is not critical
     
+    # Connection pool of this worker (PostgreSQL with TRIKUSEC_DB_POOL)
+    try:
+        pool = getattr(connection, 'pool', None)
+        if pool is not None:
+            health_status['database_pool'] = pool.get_stats()
+    except Exception as e:
+        health_status['database_pool'] = {'error': str(e)}
+    
+    # Dashboard and device list fragment cache (shared by all workers)
+    try:
+        health_status['view_cache'] = fragment_cache_stats()
+    except Exception as e:
+        health_status['view_cache'] = {'error': str(e)}
+    
+    # Reports waiting for the ingest writer (funnel mode); a growing backlog means it is down
+    try:
+        if ingest_mode() == 'funnel':
+            health_status['ingest_spool'] = spool_stats()
+    except Exception as e:
+        health_status['ingest_spool'] = {'error': str(e)}
+    
     return JsonResponse(health_status, status=status_code)
 
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.models import FullReport
+from api.utils.lynis_report import LynisReport
+
+
+class Command(BaseCommand):
+    help = 'Store the parsed form of reports uploaded before parsed reports were kept at ingest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Reports updated per batch')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        # Collect ids first: the rows being updated are the rows being selected
+        report_ids = list(FullReport.objects.filter(parsed_report__isnull=True).values_list('id', flat=True))
+        updated = 0
+
+        for start in range(0, len(report_ids), batch_size):
+            batch = []
+            for report in FullReport.objects.filter(id__in=report_ids[start:start + batch_size]).only('id', 'full_report', 'body_format'):
+                parsed_report = LynisReport(report.full_report).get_parsed_report()
+                if isinstance(parsed_report, dict) and parsed_report:
+                    report.parsed_report = parsed_report
+                    batch.append(report)
+            FullReport.objects.bulk_update(batch, ['parsed_report'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Stored parsed reports for {updated} of {len(report_ids)} reports'))
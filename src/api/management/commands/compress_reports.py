@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import FullReport
+from api.utils.report_compression import ZLIB_MAX_DICTIONARY_SIZE, compression_method, train_dictionary
+from api.utils.report_storage import BLOB_FORMAT, load_report_body, store_report_body, target_body_format
+
+
+class Command(BaseCommand):
+    help = (
+        'Store existing reports with the configured storage and compression (TRIKUSEC_REPORT_STORAGE, '
+        'TRIKUSEC_REPORT_COMPRESSION), or train a compression dictionary from recent reports'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Reports rewritten per transaction')
+        parser.add_argument(
+            '--train-dictionary', metavar='PATH',
+            help='Write a dictionary trained on recent reports to PATH instead of converting reports',
+        )
+        parser.add_argument('--dictionary-size', type=int, default=ZLIB_MAX_DICTIONARY_SIZE, help='Dictionary size in bytes')
+        parser.add_argument('--samples', type=int, default=500, help='Reports used to train the dictionary')
+
+    def handle(self, *args, **options):
+        if options['train_dictionary']:
+            return self._train_dictionary(options['train_dictionary'], options['dictionary_size'], options['samples'])
+
+        batch_size = max(1, options['batch_size'])
+        target = target_body_format()
+        # e.g. 'zlib' for 'zlib:<dictionary id>'
+        target_method = target.partition(':')[0]
+        report_ids = list(FullReport.objects.order_by('id').values_list('id', flat=True))
+        converted = 0
+        original_bytes = stored_bytes = 0
+        decode_seconds = 0.0
+
+        for start in range(0, len(report_ids), batch_size):
+            # values_list() returns the stored bytes, which are only decoded for the rows to convert
+            rows = FullReport.objects.filter(id__in=report_ids[start:start + batch_size]).values_list(
+                'id', 'body_format', 'full_report',
+            )
+            with transaction.atomic():
+                for report_id, body_format, stored in rows:
+                    if body_format == target:
+                        continue
+                    text = load_report_body(body_format, stored)
+                    new_format, new_stored = store_report_body(text)
+                    FullReport.objects.filter(id=report_id).update(full_report=new_stored, body_format=new_format)
+                    converted += 1
+                    original_bytes += len(text.encode('utf-8'))
+                    # Blobs are stored uncompressed, outside the database
+                    stored_bytes += len(text.encode('utf-8')) if new_format == BLOB_FORMAT else len(new_stored)
+
+                    # Added read cost: decoding the stored form on access (parsing is unchanged)
+                    started = time.perf_counter()
+                    load_report_body(new_format, new_stored)
+                    decode_seconds += time.perf_counter() - started
+
+        if not converted:
+            self.stdout.write(self.style.SUCCESS(f'All {len(report_ids)} reports are already stored as {target_method}'))
+            return
+
+        ratio = original_bytes / stored_bytes if stored_bytes else 0
+        decode_ms = decode_seconds / converted * 1000
+        self.stdout.write(self.style.SUCCESS(
+            f'Rewrote {converted} of {len(report_ids)} reports as {target_method}: '
+            f'{original_bytes / 1024:.0f} KB -> {stored_bytes / 1024:.0f} KB (ratio {ratio:.1f}:1), '
+            f'decoding on read takes {decode_ms:.2f} ms per report'
+        ))
+        if target_method == 'none':
+            return
+        # Bodies moved out of the database (or shrunk) leave free pages behind
+        self.stdout.write(
+            'Run VACUUM (SQLite) or VACUUM FULL (PostgreSQL) to return the freed space to the filesystem'
+        )
+
+    def _train_dictionary(self, path, size, samples):
+        method = compression_method()
+        if method == 'none':
+            raise CommandError('Set TRIKUSEC_REPORT_COMPRESSION to zlib or zstd to train a dictionary for it')
+        reports = [report.full_report for report in FullReport.objects.order_by('-created_at').only('full_report', 'body_format')[:samples]]
+        if len(reports) < 2:
+            raise CommandError('At least 2 reports are needed to train a dictionary')
+
+        dictionary = train_dictionary(reports, size, method)
+        with open(path, 'wb') as f:
+            f.write(dictionary)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote a {len(dictionary)} byte {method} dictionary trained on {len(reports)} reports to {path}. '
+            'Set TRIKUSEC_REPORT_COMPRESSION_DICTIONARY to this path and run compress_reports.'
+        ))
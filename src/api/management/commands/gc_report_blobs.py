@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils.report_storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete report files of the blob store that no report references anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int, default=settings.REPORT_BLOB_GC_GRACE_SECONDS,
+            help='Keep unreferenced files modified more recently than this',
+        )
+
+    def handle(self, *args, **options):
+        deleted, kept = collect_garbage(options['grace_seconds'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced report files, kept {kept}'))
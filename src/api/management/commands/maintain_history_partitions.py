@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils.history_partitions import drop_expired_partitions, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the upcoming monthly partitions of the history tables (DiffReport, DeviceEvent) '
+        'and drop those older than TRIKUSEC_HISTORY_RETENTION_MONTHS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-months', type=int, default=None,
+            help='Months of history kept before the current one (default: TRIKUSEC_HISTORY_RETENTION_MONTHS, 0 keeps all)',
+        )
+
+    def handle(self, *args, **options):
+        created = ensure_partitions()
+        retention_months = options['retention_months']
+        if retention_months is None:
+            retention_months = settings.HISTORY_RETENTION_MONTHS
+        dropped = drop_expired_partitions(retention_months)
+        for name in created:
+            self.stdout.write(f'Created partition {name}')
+        for name in dropped:
+            self.stdout.write(f'Dropped partition {name}')
+        retention = f'{retention_months} months' if retention_months > 0 else 'all history'
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created)} partitions and dropped {len(dropped)} (keeping {retention})'
+        ))
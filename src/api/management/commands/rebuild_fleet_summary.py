@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.fleet_summary import rebuild_fleet_summary
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard fleet summary from all devices and their latest reports'
+
+    def handle(self, *args, **options):
+        summary = rebuild_fleet_summary()
+        self.stdout.write(self.style.SUCCESS(
+            f'Fleet summary rebuilt: {summary.total_devices} devices '
+            f'({summary.compliant} compliant, {summary.non_compliant} non-compliant, {summary.unknown} unknown)'
+        ))
@@ -0,0 +1,176 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.models import Device, DeviceEvent, FullReport, Label, PolicyRuleset
+from api.utils.compliance import (
+    annotate_latest_report_id,
+    bulk_store_compliance_results,
+    compliance_change_event,
+    evaluate_rulesets,
+    prefetch_compliance_rulesets,
+    set_device_compliance,
+)
+from api.utils.fleet_summary import sync_device_summary
+from api.utils.lynis_report import LynisReport
+from api.utils.policy_query import run_query
+from api.utils.rule_stats import flush_rule_stats, record_rule_evaluation
+from api.utils.view_cache import bump_fleet_data_version
+
+
+def _init_worker():
+    # Workers only parse reports and run JMESPath queries; they never use the database.
+    # With the "spawn" start method Django needs to be set up again in each worker.
+    import django
+    django.setup()
+
+
+def _evaluate_device(task):
+    """
+    Parse a raw report and evaluate rule queries against it (runs in a worker process).
+
+    Returns (device_id, {rule_id: (result, error)}, {rule_id: seconds}), with None results
+    if the report can't be parsed.
+    """
+    device_id, report_text, rule_queries = task
+    parsed_report = LynisReport(report_text).get_parsed_report()
+    if not isinstance(parsed_report, dict) or not parsed_report:
+        return device_id, None, {}
+    results = {}
+    timings = {}
+    for rule_id, query in rule_queries.items():
+        started = time.perf_counter()
+        results[rule_id] = run_query(parsed_report, query)
+        timings[rule_id] = time.perf_counter() - started
+    return device_id, results, timings
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Recompute the compliance of devices from their latest report, in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', help='Only recompute devices with this label (name)')
+        parser.add_argument('--ruleset', help='Only recompute devices assigned to this ruleset (id or name)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (default: number of CPUs; 1 runs in-process)',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Devices loaded and written per batch')
+
+    def _devices_queryset(self, options):
+        devices = Device.objects.all()
+        if options['label']:
+            if not Label.objects.filter(name=options['label']).exists():
+                raise CommandError(f'Label "{options["label"]}" not found')
+            devices = devices.filter(labels__name=options['label'])
+        if options['ruleset']:
+            ruleset_filter = {'id': options['ruleset']} if options['ruleset'].isdigit() else {'name': options['ruleset']}
+            ruleset = PolicyRuleset.objects.filter(**ruleset_filter).first()
+            if ruleset is None:
+                raise CommandError(f'Ruleset "{options["ruleset"]}" not found')
+            devices = devices.filter(rulesets=ruleset)
+        return devices.distinct().order_by('id')
+
+    def _process_batch(self, device_ids, evaluate):
+        """Evaluate and persist one batch of devices; returns (refreshed, skipped, changed)."""
+        devices = list(prefetch_compliance_rulesets(
+            annotate_latest_report_id(Device.objects.filter(id__in=device_ids).order_by('id'))
+        ))
+        reports = FullReport.objects.in_bulk([d.latest_report_id for d in devices if d.latest_report_id])
+
+        tasks = []
+        for device in devices:
+            report = reports.get(device.latest_report_id)
+            if report is None:
+                continue
+            rule_queries = {
+                rule.id: rule.rule_query
+                for ruleset in device.rulesets.all()
+                for rule in ruleset.rules.all()
+            }
+            tasks.append((device.id, report.full_report, rule_queries))
+
+        results = {}
+        for device_id, rule_results, timings in evaluate(tasks):
+            results[device_id] = rule_results
+            # Workers can't reach the parent's statistics collector: record their timings here
+            for rule_id, duration in timings.items():
+                record_rule_evaluation(rule_id, duration, failed=rule_results[rule_id][1] is not None)
+
+        entries = []
+        changed_devices = []
+        events = []
+        for device in devices:
+            rule_results = results.get(device.id)
+            if rule_results is None:
+                continue
+            compliant, evaluated_rulesets = evaluate_rulesets(
+                device.rulesets.all(), lambda rule: rule_results[rule.id]
+            )
+            entries.append((device, evaluated_rulesets, reports[device.latest_report_id]))
+            if device.compliant != compliant:
+                events.append(compliance_change_event(device, compliant))
+                set_device_compliance(device, compliant)
+                changed_devices.append(device)
+
+        bulk_store_compliance_results(entries)
+        if changed_devices:
+            Device.objects.bulk_update(changed_devices, ['compliant', 'non_compliant_since'])
+            DeviceEvent.objects.bulk_create(events)
+            # bulk_update() sends no post_save signals
+            for device in changed_devices:
+                sync_device_summary(device)
+            bump_fleet_data_version()
+
+        return len(entries), len(devices) - len(entries), len(changed_devices)
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        device_ids = self._devices_queryset(options).values_list('id', flat=True).iterator(chunk_size=batch_size)
+
+        executor = None
+        if workers > 1:
+            # Don't share open database connections with the forked workers
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+            def evaluate(tasks):
+                return executor.map(_evaluate_device, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        else:
+            def evaluate(tasks):
+                return map(_evaluate_device, tasks)
+
+        refreshed = skipped = changed = 0
+        started = time.monotonic()
+        try:
+            for batch in _batched(device_ids, batch_size):
+                batch_refreshed, batch_skipped, batch_changed = self._process_batch(batch, evaluate)
+                refreshed += batch_refreshed
+                skipped += batch_skipped
+                changed += batch_changed
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{refreshed + skipped} devices processed ({(refreshed + skipped) / elapsed:.1f} devices/s)'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            flush_rule_stats()
+
+        elapsed = time.monotonic() - started
+        rate = (refreshed + skipped) / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed compliance for {refreshed} devices ({skipped} skipped, {changed} changed status) '
+            f'in {elapsed:.1f}s with {workers} worker(s): {rate:.1f} devices/s'
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Device, FullReport
+from api.utils.compliance import annotate_latest_report_id
+from api.utils.device_report_summary import REPORT_SUMMARY_FIELDS, apply_report_summary
+from api.utils.findings import store_report_findings
+from api.utils.report_index import index_report_facts
+from api.utils.view_cache import bump_fleet_data_version
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the report fact index used to evaluate simple rules in SQL, the warnings '
+        'and suggestions findings and the device list report columns from the latest '
+        'report of each device'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Reports loaded per batch')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        report_ids = list(
+            annotate_latest_report_id(Device.objects.all())
+            .filter(latest_report_id__isnull=False)
+            .values_list('latest_report_id', flat=True)
+        )
+        indexed = 0
+        facts = 0
+        findings = 0
+
+        for start in range(0, len(report_ids), batch_size):
+            reports = FullReport.objects.filter(id__in=report_ids[start:start + batch_size]).select_related('device')
+            devices = []
+            for report in reports:
+                parsed_report = report.get_parsed_report()
+                if isinstance(parsed_report, dict) and parsed_report:
+                    facts += index_report_facts(report.device, parsed_report)
+                    findings += store_report_findings(report)
+                    apply_report_summary(report.device, parsed_report)
+                    devices.append(report.device)
+                    indexed += 1
+            Device.objects.bulk_update(devices, REPORT_SUMMARY_FIELDS)
+
+        # bulk_update() sends no post_save signals
+        bump_fleet_data_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {facts} facts and {findings} findings from the latest report of '
+            f'{indexed} of {len(report_ids)} devices'
+        ))
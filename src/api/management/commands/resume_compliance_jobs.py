@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.utils.compliance_jobs import resumable_compliance_jobs, run_compliance_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Resume compliance recompute jobs that were never started or were interrupted (e.g. by a restart); '
+        'with --watch, keep running them as a service (TRIKUSEC_COMPLIANCE_JOBS_WORKER)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='Keep polling for jobs instead of exiting')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between polls with --watch')
+
+    def handle(self, *args, **options):
+        if not options['watch']:
+            if not self._run_jobs():
+                self.stdout.write('No compliance jobs to resume')
+            return
+
+        while True:
+            close_old_connections()
+            self._run_jobs()
+            time.sleep(options['poll_interval'])
+
+    def _run_jobs(self):
+        jobs = list(resumable_compliance_jobs())
+        for job in jobs:
+            self.stdout.write(f'Resuming compliance job {job.id} ({job.scope} {job.scope_id}) at {job.cursor}/{job.total}')
+            if not run_compliance_job(job.id):
+                self.stdout.write(self.style.WARNING(f'Job {job.id} was claimed by another worker'))
+                continue
+            job.refresh_from_db()
+            style = self.style.SUCCESS if job.status == 'completed' else self.style.ERROR
+            self.stdout.write(style(f'Job {job.id} {job.status}: {job.refreshed} refreshed, {job.skipped} skipped'))
+        return jobs
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.utils.ingest_funnel import WriterBusy, pending_reports, process_batch, writer_lock
+
+
+class Command(BaseCommand):
+    help = (
+        'Store reports spooled by the API in funnel mode (TRIKUSEC_INGEST_MODE=funnel), '
+        'batching them into transactions from a single writer process'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Reports stored per transaction')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds to wait when the spool is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the spool and exit')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        try:
+            with writer_lock():
+                self._run(batch_size, options['poll_interval'], options['once'])
+        except WriterBusy as e:
+            raise CommandError(str(e))
+
+    def _run(self, batch_size, poll_interval, once):
+        totals = [0, 0]
+        while True:
+            close_old_connections()
+            stored, rejected, retried = process_batch(batch_size)
+            totals[0] += stored
+            totals[1] += rejected
+            if stored or rejected or retried:
+                self.stdout.write(f'Stored {stored} reports, rejected {rejected}, {retried} left for retry')
+            # A batch with only retries is not progress: wait before trying again
+            if (stored or rejected) and pending_reports(1):
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+        self.stdout.write(self.style.SUCCESS(f'Ingest writer stored {totals[0]} reports, rejected {totals[1]}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.utils.compliance_snapshots import take_compliance_snapshots
+
+
+class Command(BaseCommand):
+    help = "Store today's compliance snapshot of the fleet and of every label, ruleset and license (run daily)"
+
+    def handle(self, *args, **options):
+        stored = take_compliance_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} compliance snapshots'))
@@ -1,9 +1,13 @@
 import logging
 from django.utils.deprecation import MiddlewareMixin
 from django.contrib.auth.models import AnonymousUser
+from trikusec.db.replica import stick_to_primary
 
 logger = logging.getLogger('audit')
 
+# Requests with any other method are treated as writes
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
 class AuditLoggingMiddleware(MiddlewareMixin):
     """Middleware to log sensitive operations for audit trail."""
     
@@ -51,3 +55,11 @@ class AuditLoggingMiddleware(MiddlewareMixin):
             ip = request.META.get('REMOTE_ADDR')
         return ip
 
+
+class ReplicaStickinessMiddleware(MiddlewareMixin):
+    """Send the reads of a session that just wrote to the primary (read-your-writes with a read replica)."""
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and hasattr(request, 'session'):
+            stick_to_primary(request.session)
+        return response
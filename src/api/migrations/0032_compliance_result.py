@@ -0,0 +1,31 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_label_device_labels_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComplianceResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('passed', models.BooleanField(null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('evaluated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compliance_results', to='api.device')),
+                ('report', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.fullreport')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compliance_results', to='api.policyrule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['rule', 'passed'], name='api_complia_rule_id_e84c3d_idx'), models.Index(fields=['device', 'passed'], name='api_complia_device__7d20be_idx')],
+                'unique_together': {('device', 'rule')},
+            },
+        ),
+    ]
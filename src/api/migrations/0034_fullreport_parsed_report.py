@@ -0,0 +1,38 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:29
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+from api.utils.lynis_report import LynisReport
+
+BATCH_SIZE = 200
+
+
+def backfill_parsed_reports(apps, schema_editor):
+    FullReport = apps.get_model('api', 'FullReport')
+
+    report_ids = list(FullReport.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        batch = []
+        for report in FullReport.objects.filter(id__in=report_ids[start:start + BATCH_SIZE]).only('id', 'full_report'):
+            parsed_report = LynisReport(report.full_report).get_parsed_report()
+            if isinstance(parsed_report, dict) and parsed_report:
+                report.parsed_report = parsed_report
+                batch.append(report)
+        FullReport.objects.bulk_update(batch, ['parsed_report'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_compliance_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fullreport',
+            name='parsed_report',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.RunPython(backfill_parsed_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_fullreport_parsed_report'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('value_num', models.BigIntegerField(blank=True, null=True)),
+                ('value_str', models.CharField(blank=True, max_length=255, null=True)),
+                ('is_list', models.BooleanField(default=False)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_facts', to='api.device')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'value_num'], name='api_reportf_key_681931_idx'), models.Index(fields=['key', 'value_str'], name='api_reportf_key_43e15f_idx'), models.Index(fields=['device', 'key'], name='api_reportf_device__f67798_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_report_fact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComplianceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('scope', models.CharField(choices=[('fleet', 'Fleet'), ('label', 'Label'), ('ruleset', 'Ruleset'), ('license', 'License')], max_length=16)),
+                ('scope_id', models.IntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('compliant', models.PositiveIntegerField(default=0)),
+                ('non_compliant', models.PositiveIntegerField(default=0)),
+                ('unknown', models.PositiveIntegerField(default=0)),
+                ('avg_hardening_index', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['scope', 'scope_id', 'date'],
+                'unique_together': {('scope', 'scope_id', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0036_compliance_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyRuleStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('evaluations', models.BigIntegerField(default=0)),
+                ('errors', models.BigIntegerField(default=0)),
+                ('total_time', models.FloatField(default=0)),
+                ('histogram', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='api.policyrule')),
+            ],
+            options={
+                'verbose_name_plural': 'Policy rule stats',
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_policy_rule_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_devices', models.PositiveIntegerField(default=0)),
+                ('compliant', models.PositiveIntegerField(default=0)),
+                ('non_compliant', models.PositiveIntegerField(default=0)),
+                ('unknown', models.PositiveIntegerField(default=0)),
+                ('hardening_sum', models.BigIntegerField(default=0)),
+                ('hardening_count', models.PositiveIntegerField(default=0)),
+                ('warnings_total', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Fleet summary',
+            },
+        ),
+        migrations.CreateModel(
+            name='FleetOsCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distro', models.CharField(max_length=255)),
+                ('distro_version', models.CharField(blank=True, default='', max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('distro', 'distro_version')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FleetSummaryDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('compliant', 'Compliant'), ('non_compliant', 'Non-Compliant'), ('unknown', 'Unknown')], max_length=16)),
+                ('hardening_index', models.IntegerField(blank=True, null=True)),
+                ('distro', models.CharField(blank=True, default='', max_length=255)),
+                ('distro_version', models.CharField(blank=True, default='', max_length=255)),
+                ('warnings', models.IntegerField(default=0)),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fleet_summary_entry', to='api.device')),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+from api.utils.findings import extract_findings
+from api.utils.lynis_report import LynisReport
+
+BATCH_SIZE = 200
+
+
+def backfill_findings(apps, schema_editor):
+    Device = apps.get_model('api', 'Device')
+    FullReport = apps.get_model('api', 'FullReport')
+    ReportFinding = apps.get_model('api', 'ReportFinding')
+
+    latest_report_id = FullReport.objects.filter(device=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+    report_ids = list(
+        Device.objects.annotate(latest_report_id=Subquery(latest_report_id))
+        .filter(latest_report_id__isnull=False)
+        .values_list('latest_report_id', flat=True)
+    )
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        findings = []
+        for report in FullReport.objects.filter(id__in=report_ids[start:start + BATCH_SIZE]):
+            parsed_report = report.parsed_report or LynisReport(report.full_report).get_parsed_report()
+            findings += [
+                ReportFinding(
+                    device_id=report.device_id,
+                    report=report,
+                    finding_type=finding_type,
+                    test_id=test_id[:64],
+                    description=description,
+                )
+                for finding_type, test_id, description in extract_findings(parsed_report if isinstance(parsed_report, dict) else {})
+            ]
+        ReportFinding.objects.bulk_create(findings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_fleet_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportFinding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finding_type', models.CharField(choices=[('warning', 'Warning'), ('suggestion', 'Suggestion')], max_length=16)),
+                ('test_id', models.CharField(max_length=64)),
+                ('description', models.TextField(blank=True, default='')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='findings', to='api.device')),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='findings', to='api.fullreport')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['finding_type', 'test_id'], name='api_reportf_finding_f37e90_idx'), models.Index(fields=['device', 'finding_type'], name='api_reportf_device__e6bd66_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_findings, migrations.RunPython.noop),
+    ]
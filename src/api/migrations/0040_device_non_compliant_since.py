@@ -0,0 +1,50 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:52
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_non_compliant_since(apps, schema_editor):
+    Device = apps.get_model('api', 'Device')
+    DeviceEvent = apps.get_model('api', 'DeviceEvent')
+
+    latest_event_id = (
+        DeviceEvent.objects
+        .filter(device=OuterRef('pk'), event_type='compliance_changed')
+        .order_by('-created_at')
+        .values('id')[:1]
+    )
+    devices = list(
+        Device.objects.filter(compliant=False)
+        .annotate(latest_event_id=Subquery(latest_event_id))
+        .only('id', 'created_at', 'last_update')
+    )
+    events = DeviceEvent.objects.in_bulk([d.latest_event_id for d in devices if d.latest_event_id])
+    for device in devices:
+        event = events.get(device.latest_event_id)
+        if event and (event.metadata or {}).get('new_status') == 'Non-Compliant':
+            device.non_compliant_since = event.created_at
+        else:
+            # Same fallback the dashboard used before the field existed
+            device.non_compliant_since = device.last_update or device.created_at
+    Device.objects.bulk_update(devices, ['non_compliant_since'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_report_finding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='non_compliant_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['non_compliant_since'], name='api_device_non_com_226558_idx'),
+        ),
+        migrations.RunPython(backfill_non_compliant_since, migrations.RunPython.noop),
+    ]
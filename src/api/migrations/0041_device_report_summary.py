@@ -0,0 +1,79 @@
+# Generated by Django 5.2.11 on 2026-10-18 22:58
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+from api.utils.device_report_summary import REPORT_SUMMARY_FIELDS, report_summary
+from api.utils.lynis_report import LynisReport
+
+BATCH_SIZE = 200
+
+
+def backfill_report_summary(apps, schema_editor):
+    Device = apps.get_model('api', 'Device')
+    FullReport = apps.get_model('api', 'FullReport')
+
+    latest_report_id = FullReport.objects.filter(device=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+    latest_report_ids = dict(
+        Device.objects.annotate(latest_report_id=Subquery(latest_report_id))
+        .filter(latest_report_id__isnull=False)
+        .values_list('id', 'latest_report_id')
+    )
+    device_ids = list(latest_report_ids)
+    for start in range(0, len(device_ids), BATCH_SIZE):
+        devices = list(Device.objects.filter(id__in=device_ids[start:start + BATCH_SIZE]).only('id'))
+        reports = FullReport.objects.in_bulk([latest_report_ids[device.id] for device in devices])
+        for device in devices:
+            report = reports[latest_report_ids[device.id]]
+            parsed_report = report.parsed_report or LynisReport(report.full_report).get_parsed_report()
+            for field, value in report_summary(parsed_report).items():
+                setattr(device, field, value)
+        Device.objects.bulk_update(devices, list(REPORT_SUMMARY_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_device_non_compliant_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='antivirus_installed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='hardening_index',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='trikusec_plugin_installed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='uptime_in_days',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='vulnerable_packages_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['hardening_index'], name='api_device_hardeni_465c10_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['uptime_in_days'], name='api_device_uptime__4de97d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['vulnerable_packages_count'], name='api_device_vulnera_c34c7a_idx'),
+        ),
+        migrations.RunPython(backfill_report_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_device_report_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='device',
+            name='api_device_non_com_226558_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='api_device_hardeni_465c10_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='api_device_uptime__4de97d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='device',
+            name='api_device_vulnera_c34c7a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['last_update', 'id'], name='api_device_last_up_a9fd71_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['hostname', 'id'], name='api_device_hostnam_399579_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['warnings', 'id'], name='api_device_warning_0d4361_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['compliant', 'id'], name='api_device_complia_0117ba_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['non_compliant_since', 'id'], name='api_device_non_com_46e99c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['hardening_index', 'id'], name='api_device_hardeni_44b66e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['uptime_in_days', 'id'], name='api_device_uptime__8b97b4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['vulnerable_packages_count', 'id'], name='api_device_vulnera_a021a5_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:06
+
+from django.db import migrations, models
+
+from api.utils.device_search import drop_search_index
+
+
+SEARCH_SOURCE_FIELDS = ('distro', 'distro_version', 'hostid', 'hostid2', 'hostname', 'ip_address', 'mac_address', 'os')
+
+
+def backfill_search_text(apps, schema_editor):
+    Device = apps.get_model('api', 'Device')
+
+    devices = list(Device.objects.prefetch_related('labels'))
+    for device in devices:
+        values = [getattr(device, field) for field in SEARCH_SOURCE_FIELDS]
+        values += [label.name for label in device.labels.all()]
+        device.search_text = ' '.join(str(value) for value in values if value).lower()
+    Device.objects.bulk_update(devices, ['search_text'], batch_size=500)
+
+
+def remove_search_index(apps, schema_editor):
+    # Its SQLite triggers read the column removed next
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_device_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='search_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        # The search index itself (FTS5 table or trigram index) is created after migrate
+        # by api.signals.create_device_search_index
+        migrations.RunPython(backfill_search_text, remove_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_device_search_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='compliancejob',
+            name='scope',
+            field=models.CharField(choices=[('ruleset', 'Ruleset'), ('rule', 'Rule'), ('devices', 'Devices')], max_length=16),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:11
+
+from django.db import migrations, models
+from django.db.models import BinaryField, Func, TextField
+
+from api.utils.report_storage import load_report_body
+
+BATCH_SIZE = 1000
+
+
+class _EncodeUTF8(Func):
+    """Text column as UTF-8 bytes."""
+
+    output_field = BinaryField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(%(expressions)s AS BLOB)', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="convert_to(%(expressions)s, 'UTF8')", **extra_context)
+
+
+class _DecodeUTF8(Func):
+    """UTF-8 bytes column as text."""
+
+    output_field = TextField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(%(expressions)s AS TEXT)', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="convert_from(%(expressions)s, 'UTF8')", **extra_context)
+
+
+def _id_ranges(FullReport):
+    """Yield (first id, last id) of consecutive batches of BATCH_SIZE reports."""
+    report_ids = list(FullReport.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        batch = report_ids[start:start + BATCH_SIZE]
+        yield batch[0], batch[-1]
+
+
+def text_to_bytes(apps, schema_editor):
+    FullReport = apps.get_model('api', 'FullReport')
+    for first_id, last_id in _id_ranges(FullReport):
+        FullReport.objects.filter(id__range=(first_id, last_id)).update(
+            full_report=_EncodeUTF8('full_report_text'), body_format='none',
+        )
+
+
+def bytes_to_text(apps, schema_editor):
+    FullReport = apps.get_model('api', 'FullReport')
+    for first_id, last_id in _id_ranges(FullReport):
+        batch = FullReport.objects.filter(id__range=(first_id, last_id))
+        batch.filter(body_format='none').update(full_report_text=_DecodeUTF8('full_report'))
+        # Compressed or blob store bodies are decoded with the current settings
+        reports = list(batch.exclude(body_format='none').only('id', 'body_format', 'full_report'))
+        for report in reports:
+            report.full_report_text = load_report_body(report.body_format, report.full_report)
+        FullReport.objects.bulk_update(reports, ['full_report_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_compliance_job_devices_scope'),
+    ]
+
+    operations = [
+        # Report bodies become bytes (so that they can be stored compressed), with their format
+        # in a column of its own
+        migrations.RenameField(
+            model_name='fullreport',
+            old_name='full_report',
+            new_name='full_report_text',
+        ),
+        migrations.AddField(
+            model_name='fullreport',
+            name='body_format',
+            field=models.CharField(default='none', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='fullreport',
+            name='full_report',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(text_to_bytes, bytes_to_text),
+        # Only lets the column be added back (empty) when migrating backwards
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='fullreport',
+                    name='full_report_text',
+                    field=models.TextField(default=''),
+                ),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='fullreport',
+            name='full_report_text',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:20
+
+import api.utils.report_storage
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_compressed_full_report'),
+    ]
+
+    operations = [
+        # Same bytes column: only the model field changes, don't rebuild the (large) table
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='fullreport',
+                    name='full_report',
+                    field=api.utils.report_storage.ReportBodyField(null=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0046_report_body_storage'),
+    ]
+
+    operations = [
+        # Range of rows deleted by history expiry (see api.utils.history_retention)
+        migrations.AddIndex(
+            model_name='deviceevent',
+            index=models.Index(fields=['-created_at'], name='api_devicee_created_a56cca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diffreport',
+            index=models.Index(fields=['-created_at'], name='api_diffrep_created_2eb884_idx'),
+        ),
+    ]
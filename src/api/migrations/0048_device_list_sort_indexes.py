@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0047_history_partitions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['distro', 'id'], name='api_device_distro_cbd48b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['lynis_version', 'id'], name='api_device_lynis_v_b22819_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['trikusec_plugin_installed', 'id'], name='api_device_trikuse_7eebb4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['antivirus_installed', 'id'], name='api_device_antivir_f46ad1_idx'),
+        ),
+    ]
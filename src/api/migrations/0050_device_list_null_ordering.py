@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# (field, id) indexes of the nullable device list sort fields, see api.utils.device_listing
+NULLABLE_SORT_INDEXES = {
+    'api_device_hostnam_399579_idx': 'hostname',
+    'api_device_distro_cbd48b_idx': 'distro',
+    'api_device_hardeni_44b66e_idx': 'hardening_index',
+    'api_device_lynis_v_b22819_idx': 'lynis_version',
+    'api_device_uptime__8b97b4_idx': 'uptime_in_days',
+    'api_device_non_com_46e99c_idx': 'non_compliant_since',
+    'api_device_warning_0d4361_idx': 'warnings',
+    'api_device_last_up_a9fd71_idx': 'last_update',
+}
+
+
+def _recreate_indexes(schema_editor, nulls):
+    # The device list sorts missing values first (ascending) and last (descending), which is
+    # the order of SQLite indexes. PostgreSQL sorts them the other way round, so its indexes
+    # would not serve the list without NULLS FIRST.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, field in NULLABLE_SORT_INDEXES.items():
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+        schema_editor.execute(
+            f'CREATE INDEX {schema_editor.quote_name(name)} ON api_device '
+            f'({schema_editor.quote_name(field)} ASC {nulls}, {schema_editor.quote_name("id")})'
+        )
+
+
+def nulls_first(apps, schema_editor):
+    _recreate_indexes(schema_editor, 'NULLS FIRST')
+
+
+def nulls_last(apps, schema_editor):
+    _recreate_indexes(schema_editor, 'NULLS LAST')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0048_device_list_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(nulls_first, nulls_last),
+    ]
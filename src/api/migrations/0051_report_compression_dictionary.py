@@ -0,0 +1,41 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:01
+
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def store_configured_dictionary(apps, schema_editor):
+    # Reports compressed so far used the configured dictionary (if any); keep a copy so that
+    # they stay readable when it is replaced
+    path = settings.REPORT_COMPRESSION_DICTIONARY
+    if not path or not os.path.isfile(path):
+        return
+    with open(path, 'rb') as f:
+        data = f.read()
+    ReportCompressionDictionary = apps.get_model('api', 'ReportCompressionDictionary')
+    ReportCompressionDictionary.objects.get_or_create(
+        dictionary_id=hashlib.sha256(data).hexdigest()[:16], defaults={'data': data},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0050_device_list_null_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dictionary_id', models.CharField(max_length=16, unique=True)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(store_configured_dictionary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+from api.utils.history_partitions import partition_history_tables, unpartition_history_tables
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0051_report_compression_dictionary'),
+    ]
+
+    operations = [
+        # Monthly partitions of the history tables, each with copies of their indexes
+        # (including the created_at indexes of 0047)
+        migrations.RunPython(partition_history_tables, unpartition_history_tables),
+    ]
@@ -1,7 +1,17 @@
-from django.db import models
+import jmespath
+import logging
+import time
+from itertools import zip_longest
+from django.conf import settings
+from django.db import models, router
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
-from .utils.policy_query import evaluate_query
+from .utils.history_partitions import assign_history_ids
+from .utils.report_storage import ReportBodyField
+from .utils.policy_query import run_query, compile_query, discard_compiled_query, extract_query_fields
+from .utils.rule_stats import histogram_percentile_ms, record_rule_evaluation
 
 class Organization(models.Model):
     name = models.CharField(max_length=255)
@@ -96,32 +106,125 @@ class Device(models.Model):
     )
     rulesets = models.ManyToManyField('PolicyRuleset', related_name='devices', blank=True)
     compliant = models.BooleanField(default=True)
+    # When the device last became non-compliant; null while compliant
+    non_compliant_since = models.DateTimeField(blank=True, null=True)
+    # Values of the latest report shown in the device list (see api.utils.device_report_summary)
+    hardening_index = models.IntegerField(blank=True, null=True)
+    uptime_in_days = models.IntegerField(blank=True, null=True)
+    trikusec_plugin_installed = models.BooleanField(default=False)
+    antivirus_installed = models.BooleanField(default=False)
+    vulnerable_packages_count = models.IntegerField(default=0)
+    # Lowercased hostname, IDs, addresses, OS and label names, indexed for device search
+    # (see api.utils.device_search)
+    search_text = models.TextField(blank=True, default='')
     
     class Meta:
         indexes = [
             models.Index(fields=['licensekey', 'hostid']),
             models.Index(fields=['licensekey', 'hostid2']),
             models.Index(fields=['last_update']),
+            # Keyset pagination of the device list: one (sort field, id) index per sort option
+            models.Index(fields=['last_update', 'id']),
+            models.Index(fields=['hostname', 'id']),
+            models.Index(fields=['warnings', 'id']),
+            models.Index(fields=['compliant', 'id']),
+            models.Index(fields=['non_compliant_since', 'id']),
+            models.Index(fields=['hardening_index', 'id']),
+            models.Index(fields=['uptime_in_days', 'id']),
+            models.Index(fields=['vulnerable_packages_count', 'id']),
+            models.Index(fields=['distro', 'id']),
+            models.Index(fields=['lynis_version', 'id']),
+            models.Index(fields=['trikusec_plugin_installed', 'id']),
+            models.Index(fields=['antivirus_installed', 'id']),
         ]
 
+    def save(self, *args, **kwargs):
+        from api.utils.device_search import SEARCH_SOURCE_FIELDS, device_search_text  # Avoid circular import
+
+        self.search_text = device_search_text(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and SEARCH_SOURCE_FIELDS.intersection(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'search_text'}
+        super(Device, self).save(*args, **kwargs)
+
 class FullReport(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
-    full_report = models.TextField()
+    # Raw report; compressed in the database when TRIKUSEC_REPORT_COMPRESSION is set, or only the
+    # hash of a file of the blob store when TRIKUSEC_REPORT_STORAGE is 'filesystem'. Nullable
+    # only so that the column could be added without rebuilding the table.
+    full_report = ReportBodyField(null=True)
+    # How full_report is stored ('none', 'zlib[:<dictionary id>]', 'zstd[:<dictionary id>]' or
+    # 'blob'), set by ReportBodyField on save
+    body_format = models.CharField(max_length=40, default='none')
+    # Parsed report (LynisReport.get_parsed_report()) stored at ingest, so fleet-wide
+    # queries don't have to parse raw reports. Null for reports stored before it existed.
+    parsed_report = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
 
     def save(self, *args, **kwargs):
+        # full_report is only readable with the body format it is saved with
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'full_report' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'body_format'}
+        elif 'body_format' in self.get_deferred_fields() and 'full_report' not in self.get_deferred_fields():
+            self.refresh_from_db(fields=['body_format'])
         super(FullReport, self).save(*args, **kwargs)
 
-class DiffReport(models.Model):
+    def get_parsed_report(self):
+        """Return the parsed report, parsing the raw report if it was stored without one."""
+        if self.parsed_report:
+            return self.parsed_report
+        if not hasattr(self, '_parsed_report_cache'):
+            from .utils.lynis_report import LynisReport
+            self._parsed_report_cache = LynisReport(self.full_report).get_parsed_report()
+        return self._parsed_report_cache
+
+class ReportCompressionDictionary(models.Model):
+    """Copy of a dictionary reports were compressed with, so they stay readable after it is replaced."""
+    # First 16 hex digits of the SHA-256 of data, as in FullReport.body_format
+    dictionary_id = models.CharField(max_length=16, unique=True)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class HistoryQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        assign_history_ids(objs, self.db)
+        return super().bulk_create(objs, *args, **kwargs)
+
+class HistoryModel(models.Model):
+    """
+    Base of the history models, whose rows are stored in monthly partitions of created_at
+    (see api.utils.history_partitions). On SQLite, ids are allocated before the insert.
+    """
+    objects = HistoryQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            assign_history_ids([self], kwargs.get('using') or router.db_for_write(type(self), instance=self))
+            # With its new id, Django would try an UPDATE first
+            if self.pk is not None and not kwargs.get('force_update') and not kwargs.get('update_fields'):
+                kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+
+class DiffReport(HistoryModel):
     device = models.ForeignKey(Device, on_delete=models.SET_NULL, null=True, blank=True)
     hostname = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     diff_report = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
 
-class DeviceEvent(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
+
+class DeviceEvent(HistoryModel):
     EVENT_TYPE_CHOICES = [
         ('enrolled', 'Device Enrolled'),
         ('deleted', 'Device Deleted'),
@@ -139,6 +242,7 @@ class DeviceEvent(models.Model):
         indexes = [
             models.Index(fields=['device', '-created_at']),
             models.Index(fields=['event_type', '-created_at']),
+            models.Index(fields=['-created_at']),
         ]
 
     def __str__(self):
@@ -187,8 +291,59 @@ class PolicyRule(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored query so a changed query can be evicted from the compile cache
+        instance._stored_rule_query = instance.__dict__.get('rule_query')
+        return instance
+
+    def validate_rule_query(self):
+        """Compile the rule query, raising ValidationError if it is not valid JMESPath."""
+        try:
+            compile_query(self.rule_query)
+        except jmespath.exceptions.JMESPathError as e:
+            raise ValidationError({'rule_query': f'Invalid JMESPath query syntax: {e}'})
+
+    def save(self, *args, **kwargs):
+        # Reject invalid queries up front instead of failing on every evaluation.
+        # Compiling here also caches the expression for this process.
+        self.validate_rule_query()
+        super().save(*args, **kwargs)
+
+        stored_query = getattr(self, '_stored_rule_query', None)
+        if stored_query and stored_query != self.rule_query:
+            discard_compiled_query(stored_query)
+        self._stored_rule_query = self.rule_query
+
+    @classmethod
+    def warm_query_cache(cls):
+        """Precompile the queries of all enabled rules. Returns the number of rules compiled."""
+        compiled = 0
+        for rule_query in cls.objects.filter(enabled=True).values_list('rule_query', flat=True):
+            try:
+                compile_query(rule_query)
+                compiled += 1
+            except jmespath.exceptions.JMESPathError as e:
+                logging.warning(f'Skipping invalid JMESPath query "{rule_query}" during warm-up: {e}')
+        return compiled
+
+    @property
+    def query_fields(self):
+        """Report keys read by the rule query, or None if it can depend on any key."""
+        return extract_query_fields(self.rule_query)
+
+    def evaluate_with_error(self, report):
+        """Evaluate the rule, returning (result, error); result is None if evaluation failed."""
+        started = time.perf_counter()
+        result, error = run_query(report, self.rule_query)
+        if self.id is not None:
+            record_rule_evaluation(self.id, time.perf_counter() - started, failed=error is not None)
+        return result, error
+
     def evaluate(self, report):
-        return evaluate_query(report, self.rule_query)
+        result, _ = self.evaluate_with_error(report)
+        return result
     
     def __str__(self):
         return self.name
@@ -212,6 +367,280 @@ class PolicyRuleset(models.Model):
         return self.name
 
 
+class PolicyRuleStats(models.Model):
+    """
+    Cumulative evaluation statistics of a policy rule across all processes.
+
+    Counters are collected in memory and added here periodically (see api.utils.rule_stats).
+    histogram counts evaluations per duration bucket (rule_stats.DURATION_BUCKETS_MS).
+    """
+    rule = models.OneToOneField(PolicyRule, on_delete=models.CASCADE, related_name='stats')
+    evaluations = models.BigIntegerField(default=0)
+    errors = models.BigIntegerField(default=0)
+    total_time = models.FloatField(default=0)  # Seconds
+    histogram = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Policy rule stats'
+
+    def add(self, counters):
+        """Add in-memory counters (evaluations, errors, total_time, histogram) to this row."""
+        self.evaluations += counters.evaluations
+        self.errors += counters.errors
+        self.total_time += counters.total_time
+        self.histogram = [a + b for a, b in zip_longest(self.histogram, counters.histogram, fillvalue=0)]
+        self.updated_at = timezone.now()
+
+    @property
+    def avg_ms(self):
+        if not self.evaluations:
+            return None
+        return self.total_time * 1000 / self.evaluations
+
+    @property
+    def p95_ms(self):
+        return histogram_percentile_ms(self.histogram, 95)
+
+    @property
+    def total_time_ms(self):
+        return self.total_time * 1000
+
+    @property
+    def is_slow(self):
+        p95 = self.p95_ms
+        return p95 is not None and p95 > settings.RULE_SLOW_THRESHOLD_MS
+
+    def __str__(self):
+        return f"{self.rule}: {self.evaluations} evaluations"
+
+
+class ReportFact(models.Model):
+    """
+    Scalar value (or element of an indexed list) of a device's latest parsed report.
+
+    Rebuilt at ingest so that simple rules can be evaluated for the whole fleet with a
+    single indexed SQL query (see api.utils.report_index).
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='report_facts')
+    key = models.CharField(max_length=255)
+    value_num = models.BigIntegerField(null=True, blank=True)  # Integer values
+    value_str = models.CharField(max_length=255, null=True, blank=True)  # String values
+    is_list = models.BooleanField(default=False)  # Element of a list key
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'value_num']),
+            models.Index(fields=['key', 'value_str']),
+            models.Index(fields=['device', 'key']),
+        ]
+
+    def __str__(self):
+        value = self.value_num if self.value_num is not None else self.value_str
+        return f"{self.device_id}: {self.key}={value}"
+
+
+class ReportFinding(models.Model):
+    """
+    Warning or suggestion (warning[] / suggestion[] entry) of a device's latest report.
+
+    Replaced for the device at every upload so that top findings and the devices affected
+    by a finding are grouped SQL queries (see api.utils.findings).
+    """
+    TYPE_CHOICES = [
+        ('warning', 'Warning'),
+        ('suggestion', 'Suggestion'),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='findings')
+    report = models.ForeignKey(FullReport, on_delete=models.CASCADE, related_name='findings')
+    finding_type = models.CharField(max_length=16, choices=TYPE_CHOICES)
+    test_id = models.CharField(max_length=64)
+    description = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['finding_type', 'test_id']),
+            models.Index(fields=['device', 'finding_type']),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id}: {self.finding_type} {self.test_id}"
+
+
+class ComplianceResult(models.Model):
+    """
+    Latest evaluation result of a policy rule on a device.
+
+    Written whenever a device's compliance is computed (report upload or recompute), so
+    read views don't need to parse reports and evaluate rules on demand.
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='compliance_results')
+    rule = models.ForeignKey(PolicyRule, on_delete=models.CASCADE, related_name='compliance_results')
+    report = models.ForeignKey(FullReport, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    passed = models.BooleanField(null=True)  # None when the evaluation failed
+    error = models.TextField(blank=True, default='')
+    evaluated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [['device', 'rule']]
+        indexes = [
+            # "Which devices fail rule X"
+            models.Index(fields=['rule', 'passed']),
+            # "What fails on device Y"
+            models.Index(fields=['device', 'passed']),
+        ]
+
+    def __str__(self):
+        status = {True: 'pass', False: 'fail'}.get(self.passed, 'error')
+        return f"{self.device_id} / {self.rule_id}: {status}"
+
+
+class ComplianceJob(models.Model):
+    """
+    Background recompute of device compliance after a rule or ruleset change, or after a
+    bulk ruleset assignment (scope 'devices', scope_id 0).
+
+    The target device ids are snapshotted when the job is created and processed in
+    chunks; the cursor is saved after every chunk so an interrupted job can resume.
+    """
+    SCOPE_CHOICES = [
+        ('ruleset', 'Ruleset'),
+        ('rule', 'Rule'),
+        ('devices', 'Devices'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    ACTIVE_STATUSES = ('pending', 'running')
+
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    scope_id = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    device_ids = models.JSONField(default=list)
+    cursor = models.PositiveIntegerField(default=0)  # Number of device_ids processed
+    refreshed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    # Set when the scope is edited again while the job runs: the job restarts once done
+    rerun_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Heartbeat while running
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['scope', 'scope_id', 'status']),
+        ]
+
+    @property
+    def total(self):
+        return len(self.device_ids)
+
+    def __str__(self):
+        return f"Compliance job {self.id} ({self.scope} {self.scope_id}): {self.status}"
+
+
+class ComplianceSnapshot(models.Model):
+    """
+    Daily compliance counts of a scope (the whole fleet, a label, a ruleset or a license).
+
+    Written once per day by the snapshot_compliance command so that trends can be charted
+    without replaying compliance_changed events.
+    """
+    SCOPE_CHOICES = [
+        ('fleet', 'Fleet'),
+        ('label', 'Label'),
+        ('ruleset', 'Ruleset'),
+        ('license', 'License'),
+    ]
+
+    date = models.DateField()
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    scope_id = models.IntegerField(default=0)  # 0 for the fleet
+    total = models.PositiveIntegerField(default=0)
+    compliant = models.PositiveIntegerField(default=0)
+    non_compliant = models.PositiveIntegerField(default=0)
+    unknown = models.PositiveIntegerField(default=0)  # No ruleset assigned / no stored results
+    avg_hardening_index = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['scope', 'scope_id', 'date']
+        unique_together = [['scope', 'scope_id', 'date']]
+
+    def __str__(self):
+        return f"{self.scope} {self.scope_id} on {self.date}: {self.compliant}/{self.total} compliant"
+
+
+class FleetSummary(models.Model):
+    """
+    Singleton with the fleet-wide counts shown on the dashboard.
+
+    Kept up to date incrementally from each device's FleetSummaryDevice contribution
+    (see api.utils.fleet_summary); built from scratch on first use or by the
+    rebuild_fleet_summary command.
+    """
+    total_devices = models.PositiveIntegerField(default=0)
+    compliant = models.PositiveIntegerField(default=0)
+    non_compliant = models.PositiveIntegerField(default=0)
+    unknown = models.PositiveIntegerField(default=0)  # Devices without rulesets
+    hardening_sum = models.BigIntegerField(default=0)
+    hardening_count = models.PositiveIntegerField(default=0)
+    warnings_total = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Fleet summary'
+
+    @property
+    def avg_hardening_index(self):
+        if not self.hardening_count:
+            return None
+        return self.hardening_sum / self.hardening_count
+
+    def __str__(self):
+        return f"Fleet summary: {self.total_devices} devices"
+
+
+class FleetSummaryDevice(models.Model):
+    """What a device currently adds to FleetSummary, so that a change can be applied as a delta."""
+    STATUS_CHOICES = [
+        ('compliant', 'Compliant'),
+        ('non_compliant', 'Non-Compliant'),
+        ('unknown', 'Unknown'),
+    ]
+
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, related_name='fleet_summary_entry')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES)
+    hardening_index = models.IntegerField(null=True, blank=True)
+    distro = models.CharField(max_length=255, blank=True, default='')
+    distro_version = models.CharField(max_length=255, blank=True, default='')
+    warnings = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.device_id}: {self.status}"
+
+
+class FleetOsCount(models.Model):
+    """Number of devices per distribution and version (the dashboard's OS distribution)."""
+    distro = models.CharField(max_length=255)
+    distro_version = models.CharField(max_length=255, blank=True, default='')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['distro', 'distro_version']]
+
+    def __str__(self):
+        return f"{self.distro} {self.distro_version}: {self.count}"
+
+
 class EnrollmentSettings(models.Model):
     """Singleton model storing global enrollment script configuration."""
 
@@ -1,8 +1,15 @@
-from django.db.models.signals import post_migrate, post_save
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from api.models import LicenseKey, FullReport
+from api.models import Device, DeviceEvent, LicenseKey, FullReport, Label, PolicyRule, PolicyRuleset
+from api.utils.device_report_summary import store_report_summary
+from api.utils.device_search import ensure_search_index, refresh_device_search_text
+from api.utils.findings import store_report_findings
+from api.utils.fleet_summary import remove_device_summary, report_hardening_index, sync_device_summary
+from api.utils.history_partitions import ensure_partitions
+from api.utils.policy_query import discard_compiled_query
+from api.utils.view_cache import bump_fleet_data_version
 from django.core.management import call_command
-from django.db import connection
+from django.db import connection, connections
 import random
 import string
 
@@ -22,6 +29,18 @@ def first_run(sender, **kwargs):
                     call_command('migrate')
                     call_command('populate_db_licensekey')
 
+@receiver(post_migrate)
+def create_device_search_index(sender, using, **kwargs):
+    """(Re)create the device search index, whose SQLite triggers are lost when a migration rebuilds the table."""
+    if sender.name == 'api':
+        ensure_search_index(connections[using])
+
+@receiver(post_migrate)
+def create_history_partitions(sender, using, **kwargs):
+    """Create the upcoming monthly partitions of the history tables."""
+    if sender.name == 'api':
+        ensure_partitions(using)
+
 @receiver(post_save, sender=FullReport)
 def cleanup_old_reports(sender, instance, created, **kwargs):
     """
@@ -34,3 +53,110 @@ def cleanup_old_reports(sender, instance, created, **kwargs):
             # Delete older reports except the latest 2
             for report in reports[2:]:
                 report.delete()
+
+@receiver(post_delete, sender=PolicyRule)
+def discard_deleted_rule_query(sender, instance, **kwargs):
+    """Evict the compiled expression of a deleted rule from this process' query cache."""
+    discard_compiled_query(instance.rule_query)
+
+@receiver(post_save, sender=Device)
+def update_fleet_summary_on_device_save(sender, instance, **kwargs):
+    """Apply changes of a device's compliance, OS or warnings to the fleet summary."""
+    sync_device_summary(instance)
+
+@receiver(pre_delete, sender=Device)
+def update_fleet_summary_on_device_delete(sender, instance, **kwargs):
+    """Remove a deleted device from the fleet summary."""
+    remove_device_summary(instance.pk)
+
+@receiver(post_save, sender=FullReport)
+def update_fleet_summary_on_report(sender, instance, created, **kwargs):
+    """Record the hardening index of a device's new latest report in the fleet summary."""
+    if created:
+        sync_device_summary(instance.device, hardening_index=report_hardening_index(instance))
+
+@receiver(post_save, sender=FullReport)
+def index_report_findings(sender, instance, created, **kwargs):
+    """Replace the device's stored warnings and suggestions with those of its new latest report."""
+    if created:
+        store_report_findings(instance)
+
+@receiver(post_save, sender=FullReport)
+def update_device_report_summary(sender, instance, created, **kwargs):
+    """Store the device list columns (hardening index, uptime, ...) of the device's new latest report."""
+    if created:
+        store_report_summary(instance)
+
+@receiver(m2m_changed, sender=Device.rulesets.through)
+def update_fleet_summary_on_ruleset_assignment(sender, instance, action, reverse, pk_set, **kwargs):
+    """Devices gaining their first ruleset or losing their last one change between assessed and unknown."""
+    if reverse and action == 'pre_clear':
+        # Devices of a ruleset being cleared: pk_set is not provided for post_clear
+        instance._cleared_device_ids = list(instance.devices.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        sync_device_summary(instance)
+        return
+    device_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_device_ids', [])
+    for device in Device.objects.filter(id__in=device_ids):
+        sync_device_summary(device)
+
+@receiver(pre_delete, sender=PolicyRuleset)
+def remember_ruleset_devices(sender, instance, **kwargs):
+    # Deleting a ruleset removes its device assignments without m2m_changed signals
+    instance._deleted_device_ids = list(instance.devices.values_list('id', flat=True))
+
+@receiver(post_delete, sender=PolicyRuleset)
+def update_fleet_summary_on_ruleset_delete(sender, instance, **kwargs):
+    """Devices whose last ruleset was deleted become unknown in the fleet summary."""
+    for device in Device.objects.filter(id__in=getattr(instance, '_deleted_device_ids', [])):
+        sync_device_summary(device)
+
+@receiver(m2m_changed, sender=Device.labels.through)
+def update_search_text_on_label_assignment(sender, instance, action, reverse, pk_set, **kwargs):
+    """Label names are part of a device's search text."""
+    if reverse and action == 'pre_clear':
+        # Devices of a label being cleared: pk_set is not provided for post_clear
+        instance._cleared_device_ids = list(instance.devices.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_device_search_text([instance.pk])
+    elif action == 'post_clear':
+        refresh_device_search_text(getattr(instance, '_cleared_device_ids', []))
+    else:
+        refresh_device_search_text(pk_set)
+
+@receiver(post_save, sender=Label)
+def update_search_text_on_label_save(sender, instance, created, **kwargs):
+    """A renamed label changes the search text of its devices."""
+    if not created:
+        refresh_device_search_text(instance.devices.values_list('id', flat=True))
+
+@receiver(pre_delete, sender=Label)
+def remember_label_devices(sender, instance, **kwargs):
+    # Deleting a label removes its device assignments without m2m_changed signals
+    instance._deleted_device_ids = list(instance.devices.values_list('id', flat=True))
+
+@receiver(post_delete, sender=Label)
+def update_search_text_on_label_delete(sender, instance, **kwargs):
+    """Devices of a deleted label are no longer found by its name."""
+    refresh_device_search_text(getattr(instance, '_deleted_device_ids', []))
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=FullReport)
+@receiver(post_save, sender=DeviceEvent)
+@receiver(post_save, sender=Label)
+@receiver(post_delete, sender=Label)
+@receiver(post_save, sender=PolicyRuleset)
+@receiver(post_delete, sender=PolicyRuleset)
+@receiver(m2m_changed, sender=Device.labels.through)
+@receiver(m2m_changed, sender=Device.rulesets.through)
+def invalidate_fleet_fragments(sender, **kwargs):
+    """Cached dashboard and device list fragments are stale once fleet data changes."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_fleet_data_version()
@@ -55,6 +55,8 @@ class TestUploadReport:
         assert report is not None
         # Compare reports ignoring trailing whitespace
         assert report.full_report.strip() == sample_lynis_report.strip()
+        # The parsed form is stored alongside the raw report
+        assert report.parsed_report['hostname'] == 'test-server'
 
     def test_upload_report_invalid_license(self, sample_lynis_report):
         """Test uploading a report with invalid license key returns 401."""
@@ -572,6 +574,15 @@ class TestHealthCheck:
         assert 'database' in data['checks']
         assert 'cache' in data['checks']
 
+    def test_health_check_reports_view_cache_hit_rate(self, monkeypatch):
+        from api.utils import view_cache
+
+        monkeypatch.setattr(view_cache, '_stats', {'hits': 3, 'misses': 1})
+
+        data = Client().get(reverse('health_check')).json()
+
+        assert data['view_cache'] == {'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
     def test_health_check_allows_all_methods(self):
         """Test health check accepts GET, POST, HEAD, OPTIONS methods."""
         client = Client()
@@ -1463,6 +1474,8 @@ class TestComplianceChange:
         # Check device is now non-compliant
         test_device.refresh_from_db()
         assert test_device.compliant is False
+        non_compliant_since = test_device.non_compliant_since
+        assert non_compliant_since is not None
         
         # Check event was created
         event = DeviceEvent.objects.filter(
@@ -1480,6 +1493,8 @@ class TestComplianceChange:
         
         # Check NO event was created
         assert DeviceEvent.objects.count() == 0
+        test_device.refresh_from_db()
+        assert test_device.non_compliant_since == non_compliant_since
         
         # Make it compliant again (disable rule)
         rule.enabled = False
@@ -1489,8 +1504,1273 @@ class TestComplianceChange:
         
         test_device.refresh_from_db()
         assert test_device.compliant is True
+        assert test_device.non_compliant_since is None
         
         event = DeviceEvent.objects.first()
         assert event is not None
         assert event.metadata['old_status'] == 'Non-Compliant'
         assert event.metadata['new_status'] == 'Compliant'
+
+
+@pytest.mark.django_db
+class TestCompiledQueryCache:
+    """Tests for the per-process cache of compiled JMESPath expressions."""
+
+    def test_evaluate_query_reuses_compiled_expression(self, monkeypatch):
+        from api.utils import policy_query
+
+        cache = policy_query.CompiledQueryCache(maxsize=10)
+        monkeypatch.setattr(policy_query, 'compiled_query_cache', cache)
+        compile_calls = []
+        original_compile = policy_query.jmespath.compile
+
+        def counting_compile(query):
+            compile_calls.append(query)
+            return original_compile(query)
+
+        monkeypatch.setattr(policy_query.jmespath, 'compile', counting_compile)
+
+        for _ in range(3):
+            assert policy_query.evaluate_query({'hardening_index': 80}, 'hardening_index > `70`') is True
+
+        assert compile_calls == ['hardening_index > `70`']
+
+    def test_cache_is_bounded_lru(self):
+        from api.utils.policy_query import CompiledQueryCache
+
+        cache = CompiledQueryCache(maxsize=2)
+        cache.get('a')
+        cache.get('b')
+        cache.get('a')  # 'a' becomes most recently used
+        cache.get('c')  # evicts 'b'
+
+        assert 'a' in cache
+        assert 'c' in cache
+        assert 'b' not in cache
+        assert len(cache) == 2
+
+    def test_rule_save_rejects_invalid_query(self):
+        from django.core.exceptions import ValidationError
+        from api.models import PolicyRule
+
+        with pytest.raises(ValidationError):
+            PolicyRule.objects.create(name='Broken', rule_query='hardening_index >', description='')
+
+        assert not PolicyRule.objects.filter(name='Broken').exists()
+
+    def test_rule_update_and_delete_invalidate_cache(self):
+        from api.models import PolicyRule
+        from api.utils.policy_query import compiled_query_cache
+
+        rule = PolicyRule.objects.create(name='Cached', rule_query='os == `"Linux"`', description='')
+        assert 'os == `"Linux"`' in compiled_query_cache
+
+        rule = PolicyRule.objects.get(id=rule.id)
+        rule.rule_query = 'os == `"FreeBSD"`'
+        rule.save()
+        assert 'os == `"Linux"`' not in compiled_query_cache
+        assert 'os == `"FreeBSD"`' in compiled_query_cache
+
+        rule.delete()
+        assert 'os == `"FreeBSD"`' not in compiled_query_cache
+
+    def test_warm_query_cache_precompiles_enabled_rules(self):
+        from api.models import PolicyRule
+        from api.utils.policy_query import compiled_query_cache
+
+        PolicyRule.objects.create(name='Enabled', rule_query='warning_count < `5`', description='')
+        PolicyRule.objects.create(name='Disabled', rule_query='warning_count < `9`', description='', enabled=False)
+        compiled_query_cache.clear()
+
+        compiled = PolicyRule.warm_query_cache()
+
+        assert compiled == PolicyRule.objects.filter(enabled=True).count()
+        assert 'warning_count < `5`' in compiled_query_cache
+        assert 'warning_count < `9`' not in compiled_query_cache
+
+
+@pytest.mark.django_db
+class TestComplianceEvaluation:
+    """Tests for prefetching and rule deduplication in compliance evaluation."""
+
+    def _create_shared_rule_setup(self, device):
+        from api.models import PolicyRule, PolicyRuleset
+
+        shared_rule = PolicyRule.objects.create(name='Shared', rule_query='hardening_index > `60`', description='')
+        other_rule = PolicyRule.objects.create(name='Other', rule_query="os == 'Linux'", description='')
+        first = PolicyRuleset.objects.create(name='First', description='')
+        second = PolicyRuleset.objects.create(name='Second', description='')
+        first.rules.add(shared_rule, other_rule)
+        second.rules.add(shared_rule)
+        device.rulesets.add(first, second)
+        return shared_rule, other_rule
+
+    def test_shared_rule_evaluated_once_per_report(self, test_device, monkeypatch):
+        from api.models import PolicyRule
+        from api.utils.compliance import check_device_compliance
+
+        shared_rule, _ = self._create_shared_rule_setup(test_device)
+        evaluated_rule_ids = []
+        original_evaluate = PolicyRule.evaluate_with_error
+
+        def counting_evaluate(rule, report):
+            evaluated_rule_ids.append(rule.id)
+            return original_evaluate(rule, report)
+
+        monkeypatch.setattr(PolicyRule, 'evaluate_with_error', counting_evaluate)
+
+        compliant, evaluated_rulesets = check_device_compliance(test_device, {'hardening_index': 65, 'os': 'Linux'})
+
+        assert compliant is True
+        assert evaluated_rule_ids.count(shared_rule.id) == 1
+        assert len(evaluated_rule_ids) == 2
+        # The shared result is still reported in every ruleset containing the rule
+        assert [len(r['rules']) for r in evaluated_rulesets] == [2, 1]
+        assert all(rule['compliant'] for r in evaluated_rulesets for rule in r['rules'])
+
+    def test_prefetched_devices_evaluate_without_extra_queries(self, test_license_key, django_assert_num_queries):
+        from conftest import DeviceFactory
+        from api.models import Device
+        from api.utils.compliance import check_device_compliance, prefetch_compliance_rulesets
+
+        devices = [DeviceFactory(licensekey=test_license_key) for _ in range(3)]
+        for device in devices:
+            self._create_shared_rule_setup(device)
+
+        # One query for devices, one for rulesets, one for rules
+        with django_assert_num_queries(3):
+            prefetched = list(prefetch_compliance_rulesets(Device.objects.filter(id__in=[d.id for d in devices])))
+            for device in prefetched:
+                check_device_compliance(device, {'hardening_index': 50, 'os': 'Linux'})
+
+
+@pytest.mark.django_db
+class TestComplianceResults:
+    """Tests for persisted per-rule compliance results."""
+
+    def _assign_rules(self, device):
+        from api.models import PolicyRule, PolicyRuleset
+
+        passing = PolicyRule.objects.create(name='Hardened', rule_query='hardening_index > `60`', description='')
+        failing = PolicyRule.objects.create(name='Few warnings', rule_query='warning_count < `1`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Baseline', description='')
+        ruleset.rules.add(passing, failing)
+        device.rulesets.add(ruleset)
+        return ruleset, passing, failing
+
+    def test_update_device_compliance_stores_results(self, test_device):
+        from api.models import ComplianceResult, FullReport
+        from api.utils.compliance import update_device_compliance
+
+        _, passing, failing = self._assign_rules(test_device)
+        full_report = FullReport.objects.create(device=test_device, full_report='hostname=test')
+
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3}, full_report)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 0}, full_report)
+
+        results = {r.rule_id: r for r in ComplianceResult.objects.filter(device=test_device)}
+        assert len(results) == 2
+        assert results[passing.id].passed is True
+        assert results[failing.id].passed is True
+        assert results[failing.id].report_id == full_report.id
+
+    def test_results_removed_when_ruleset_unassigned(self, test_device):
+        from api.models import ComplianceResult
+        from api.utils.compliance import update_device_compliance
+
+        ruleset, _, _ = self._assign_rules(test_device)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3})
+        assert ComplianceResult.objects.filter(device=test_device).count() == 2
+
+        test_device.rulesets.remove(ruleset)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3})
+
+        assert not ComplianceResult.objects.filter(device=test_device).exists()
+
+    def test_get_device_compliance_reads_stored_results(self, test_device, monkeypatch):
+        from api.models import PolicyRule
+        from api.utils.compliance import get_device_compliance, update_device_compliance
+
+        _, _, failing = self._assign_rules(test_device)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3})
+
+        def fail_evaluate(rule, report):
+            raise AssertionError('rule should not be re-evaluated')
+
+        monkeypatch.setattr(PolicyRule, 'evaluate_with_error', fail_evaluate)
+        compliant, evaluated_rulesets = get_device_compliance(test_device)
+
+        assert compliant is False
+        rules = {rule['id']: rule['compliant'] for rule in evaluated_rulesets[0]['rules']}
+        assert rules[failing.id] is False
+
+    def test_get_device_compliance_reevaluates_edited_rule(self, test_device):
+        from api.utils.compliance import get_device_compliance, update_device_compliance
+
+        _, _, failing = self._assign_rules(test_device)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3})
+
+        failing.rule_query = 'warning_count < `5`'
+        failing.save()
+        compliant, _ = get_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 3})
+
+        assert compliant is True
+
+
+class TestQueryFieldExtraction:
+    """Tests for extracting the report keys read by a JMESPath query."""
+
+    def test_extracts_top_level_fields(self):
+        from api.utils.policy_query import extract_query_fields
+
+        query = "contains(installed_package_names, 'ufw') && hardening_index > `70`"
+        assert extract_query_fields(query) == {'installed_package_names', 'hardening_index'}
+
+    def test_ignores_fields_of_nested_values(self):
+        from api.utils.policy_query import extract_query_fields
+
+        assert extract_query_fields("vulnerable_package[?name == 'openssl'].version") == {'vulnerable_package'}
+        assert extract_query_fields('sort_by(plugins, &name)[0].name') == {'plugins'}
+        assert extract_query_fields('network_interface | length(@) > `1`') == {'network_interface'}
+
+    def test_whole_report_queries_return_none(self):
+        from api.utils.policy_query import extract_query_fields
+
+        assert extract_query_fields('length(keys(@)) > `10`') is None
+        assert extract_query_fields('invalid query [') is None
+
+
+@pytest.mark.django_db
+class TestIncrementalComplianceEvaluation:
+    """Tests for re-evaluating only the rules affected by a report diff."""
+
+    def _setup(self, device):
+        from api.models import FullReport, PolicyRule, PolicyRuleset
+
+        hardening = PolicyRule.objects.create(name='Hardened', rule_query='hardening_index > `60`', description='')
+        warnings = PolicyRule.objects.create(name='Few warnings', rule_query='warning_count < `5`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Baseline', description='')
+        ruleset.rules.add(hardening, warnings)
+        device.rulesets.add(ruleset)
+        previous = FullReport.objects.create(device=device, full_report='hostname=test')
+        return hardening, warnings, previous
+
+    def test_only_rules_reading_changed_keys_are_evaluated(self, test_device, monkeypatch):
+        from api.models import PolicyRule
+        from api.utils.compliance import update_device_compliance
+
+        hardening, warnings, previous = self._setup(test_device)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 1}, previous)
+
+        evaluated_rule_ids = []
+        original_evaluate = PolicyRule.evaluate_with_error
+
+        def counting_evaluate(rule, report):
+            evaluated_rule_ids.append(rule.id)
+            return original_evaluate(rule, report)
+
+        monkeypatch.setattr(PolicyRule, 'evaluate_with_error', counting_evaluate)
+        compliant, _ = update_device_compliance(
+            test_device, {'hardening_index': 70, 'warning_count': 9}, previous,
+            previous_report=previous, changed_keys={'warning_count', 'uptime_in_days'},
+        )
+
+        assert evaluated_rule_ids == [warnings.id]
+        assert compliant is False
+
+    def test_results_of_other_reports_are_not_reused(self, test_device):
+        from api.models import FullReport
+        from api.utils.compliance import update_device_compliance
+
+        hardening, warnings, previous = self._setup(test_device)
+        update_device_compliance(test_device, {'hardening_index': 70, 'warning_count': 1})
+        older = FullReport.objects.create(device=test_device, full_report='hostname=old')
+
+        # Stored results were not computed for "older", so every rule is evaluated
+        compliant, _ = update_device_compliance(
+            test_device, {'hardening_index': 50, 'warning_count': 1}, previous,
+            previous_report=older, changed_keys=set(),
+        )
+
+        assert compliant is False
+
+
+@pytest.mark.django_db
+class TestComplianceJobs:
+    """Tests for background (chunked, resumable) compliance recompute jobs."""
+
+    def _setup(self, license_key, sample_report, count=3):
+        from conftest import DeviceFactory
+        from api.models import FullReport, PolicyRule, PolicyRuleset
+
+        rule = PolicyRule.objects.create(name='Hardening over 100', rule_query='hardening_index > `100`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Strict', description='')
+        ruleset.rules.add(rule)
+        devices = [DeviceFactory(licensekey=license_key) for _ in range(count)]
+        for device in devices:
+            device.rulesets.add(ruleset)
+            FullReport.objects.create(device=device, full_report=sample_report)
+        return ruleset, devices
+
+    def test_enqueue_processes_devices_in_chunks(self, test_license_key, sample_lynis_report, settings):
+        from api.models import Device
+        from api.utils.compliance_jobs import enqueue_compliance_job
+
+        settings.COMPLIANCE_JOB_CHUNK_SIZE = 2
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report)
+
+        job = enqueue_compliance_job('ruleset', ruleset.id)
+
+        assert job.status == 'completed'
+        assert (job.cursor, job.total, job.refreshed, job.skipped) == (3, 3, 3, 0)
+        assert not Device.objects.filter(id__in=[d.id for d in devices], compliant=True).exists()
+
+    def test_edit_while_running_is_coalesced(self, test_license_key, sample_lynis_report):
+        from api.models import ComplianceJob
+        from api.utils.compliance_jobs import enqueue_compliance_job
+
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report)
+        running = ComplianceJob.objects.create(
+            scope='ruleset', scope_id=ruleset.id, status='running', device_ids=[d.id for d in devices],
+        )
+
+        job = enqueue_compliance_job('ruleset', ruleset.id)
+
+        assert job.id == running.id
+        assert ComplianceJob.objects.count() == 1
+        running.refresh_from_db()
+        assert running.rerun_requested is True
+
+    def test_interrupted_job_resumes_from_cursor(self, test_license_key, sample_lynis_report, settings):
+        from api.models import ComplianceJob, Device
+        from api.utils.compliance_jobs import resumable_compliance_jobs, run_compliance_job
+        from datetime import timedelta
+        from django.utils import timezone
+
+        settings.COMPLIANCE_JOB_STALE_SECONDS = 60
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report)
+        job = ComplianceJob.objects.create(
+            scope='ruleset', scope_id=ruleset.id, status='running',
+            device_ids=[d.id for d in devices], cursor=2,
+        )
+        # No heartbeat for longer than the stale threshold
+        ComplianceJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+        assert list(resumable_compliance_jobs()) == [job]
+        assert run_compliance_job(job.id) is True
+
+        job.refresh_from_db()
+        assert job.status == 'completed'
+        assert job.refreshed == 1
+        # Only the device after the cursor was recomputed
+        assert list(Device.objects.filter(id__in=job.device_ids, compliant=False).values_list('id', flat=True)) == [devices[2].id]
+
+    def test_enqueue_starts_the_new_job_once(self, test_license_key, sample_lynis_report, settings, monkeypatch):
+        from api.utils import compliance_jobs
+
+        settings.COMPLIANCE_JOBS_INLINE = False
+        ruleset, _ = self._setup(test_license_key, sample_lynis_report)
+        started = []
+        monkeypatch.setattr(compliance_jobs, 'start_compliance_job', lambda job: started.append(job.id))
+
+        job = compliance_jobs.enqueue_compliance_job('ruleset', ruleset.id)
+
+        assert started == [job.id]
+
+    def test_interrupted_jobs_are_resumed_by_the_watchdog_not_by_polling(
+        self, test_user, test_license_key, sample_lynis_report, settings, monkeypatch,
+    ):
+        from api.models import ComplianceJob
+        from api.utils import compliance_jobs
+
+        settings.COMPLIANCE_JOBS_INLINE = False
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report)
+        job = ComplianceJob.objects.create(
+            scope='ruleset', scope_id=ruleset.id, status='running', device_ids=[d.id for d in devices], cursor=1,
+        )
+        ComplianceJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        started = []
+        monkeypatch.setattr(compliance_jobs, 'start_compliance_job', lambda job: started.append(job.id))
+        client = Client()
+        client.force_login(test_user)
+
+        response = client.get(reverse('compliance_job_status', kwargs={'job_id': job.id}))
+        assert response.json()['status'] == 'running'
+        assert started == []
+
+        assert compliance_jobs.resume_stale_compliance_jobs() == [job]
+        assert started == [job.id]
+
+        # A separate worker service runs the jobs instead
+        settings.COMPLIANCE_JOBS_WORKER = True
+        assert compliance_jobs.resume_stale_compliance_jobs() == []
+
+    def test_refresh_writes_status_changes_in_bulk(self, test_license_key, sample_lynis_report, django_assert_max_num_queries):
+        from api.models import Device, DeviceEvent, FullReport
+        from api.utils.compliance import refresh_devices_compliance
+        from api.utils.lynis_report import LynisReport
+
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report, count=5)
+        device_ids = [d.id for d in devices]
+        # Evaluated from the parsed reports stored at ingest, without parsing the raw ones again
+        FullReport.objects.filter(device_id__in=device_ids).update(
+            parsed_report=LynisReport(sample_lynis_report).get_parsed_report(),
+        )
+
+        # Plus the allocation of the events' ids on SQLite (see api.utils.history_partitions)
+        with django_assert_max_num_queries(16):
+            refreshed, skipped = refresh_devices_compliance(Device.objects.filter(id__in=device_ids))
+
+        assert (refreshed, skipped) == (5, 0)
+        assert Device.objects.filter(id__in=device_ids, compliant=False, non_compliant_since__isnull=False).count() == 5
+        assert DeviceEvent.objects.filter(device_id__in=device_ids, event_type='compliance_changed').count() == 5
+
+    def test_rerun_requested_restarts_with_current_scope(self, test_license_key, sample_lynis_report):
+        from api.models import ComplianceJob
+        from api.utils.compliance_jobs import run_compliance_job
+
+        ruleset, devices = self._setup(test_license_key, sample_lynis_report)
+        job = ComplianceJob.objects.create(
+            scope='ruleset', scope_id=ruleset.id, device_ids=[devices[0].id], rerun_requested=True,
+        )
+
+        run_compliance_job(job.id)
+
+        job.refresh_from_db()
+        assert job.status == 'completed'
+        assert job.rerun_requested is False
+        assert job.device_ids == [d.id for d in devices]
+        assert job.cursor == 3
+
+
+@pytest.mark.django_db
+class TestRulePreview:
+    """Tests for evaluating draft queries against stored parsed reports."""
+
+    def _create_devices(self, license_key):
+        from conftest import DeviceFactory
+        from api.models import FullReport
+
+        devices = []
+        for hardening_index in (50, 70, 90):
+            device = DeviceFactory(licensekey=license_key)
+            FullReport.objects.create(device=device, full_report='', parsed_report={'hardening_index': 10})
+            FullReport.objects.create(
+                device=device, full_report='', parsed_report={'hardening_index': hardening_index, 'os': 'Linux'},
+            )
+            devices.append(device)
+        return devices
+
+    def test_counts_latest_report_of_each_device(self, test_license_key):
+        from api.models import Device
+        from api.utils.rule_preview import preview_query
+
+        devices = self._create_devices(test_license_key)
+
+        preview = preview_query('hardening_index > `60`', Device.objects.all(), time_budget=10)
+
+        assert (preview['evaluated'], preview['passed'], preview['failed']) == (3, 2, 1)
+        assert preview['complete'] is True
+        assert [d['id'] for d in preview['failing_devices']] == [devices[0].id]
+
+    def test_whole_report_queries_and_unindexed_reports(self, test_license_key, test_device):
+        from api.models import Device, FullReport
+        from api.utils.rule_preview import preview_query
+
+        self._create_devices(test_license_key)
+        FullReport.objects.create(device=test_device, full_report='hostname=legacy')
+
+        preview = preview_query('length(keys(@)) > `1`', Device.objects.all(), time_budget=10)
+
+        assert preview['passed'] == 3
+        assert preview['unindexed'] == 1
+
+    def test_fetched_keys_keep_their_json_type(self, test_device):
+        from api.models import Device, FullReport
+        from api.utils.rule_preview import preview_query
+
+        FullReport.objects.create(device=test_device, full_report='', parsed_report={
+            'os_version': '22.04', 'firewall_active': 'true', 'hardening_index': 70, 'ntp': None,
+            'kernel': {'release': '6.1'}, 'packages': ['openssh'],
+        })
+        devices = Device.objects.filter(id=test_device.id)
+
+        for query in (
+            "os_version == '22.04'",
+            "firewall_active == 'true'",
+            'hardening_index == `70`',
+            'ntp == null && missing_key == null',
+            "kernel.release == '6.1' && contains(packages, 'openssh')",
+        ):
+            assert preview_query(query, devices, time_budget=10)['passed'] == 1, query
+
+    def test_time_budget_stops_evaluation(self, test_license_key):
+        from api.models import Device
+        from api.utils.rule_preview import preview_query
+
+        self._create_devices(test_license_key)
+
+        preview = preview_query('hardening_index > `60`', Device.objects.all(), time_budget=-1)
+
+        assert preview['complete'] is False
+        assert preview['evaluated'] == 0
+
+
+@pytest.mark.django_db
+class TestReportFactIndex:
+    """Tests for evaluating simple rule queries in SQL over the report fact index."""
+
+    REPORTS = [
+        {'hardening_index': 50, 'os': 'Linux', 'installed_package_names': ['openssl', 'bash']},
+        {'hardening_index': 75, 'os': 'Linux', 'installed_package_names': ['bash']},
+        {'hardening_index': 90, 'os': 'FreeBSD', 'firewall_active': 1},
+        {'os': 'Linux', 'hardening_index': 'unknown'},
+    ]
+
+    def _create_devices(self, license_key):
+        from conftest import DeviceFactory
+        from api.utils.report_index import index_report_facts
+
+        devices = []
+        for parsed_report in self.REPORTS:
+            device = DeviceFactory(licensekey=license_key)
+            FullReport.objects.create(device=device, full_report='', parsed_report=parsed_report)
+            index_report_facts(device, parsed_report)
+            devices.append(device)
+        return devices
+
+    @pytest.mark.parametrize('query', [
+        'hardening_index > `60`',
+        '`60` >= hardening_index',
+        "os == 'Linux' && hardening_index >= `75`",
+        "os != 'Linux' || !(hardening_index < `60`)",
+        'firewall_active == `1`',
+        "contains(installed_package_names, 'openssl')",
+        "!contains(installed_package_names, 'openssl') && os == 'Linux'",
+    ])
+    def test_sql_matches_python_evaluation(self, test_license_key, query):
+        from api.utils.policy_query import evaluate_query
+        from api.utils.report_index import matching_devices
+
+        devices = self._create_devices(test_license_key)
+
+        expected = {d.id for d, report in zip(devices, self.REPORTS) if evaluate_query(report, query)}
+        assert set(matching_devices(query, Device.objects.all()).values_list('id', flat=True)) == expected
+
+    @pytest.mark.parametrize('query', [
+        "os != 'Linux' || !(hardening_index < `60`)",
+        "os == 'FreeBSD' && hardening_index > `60`",
+        "contains(installed_package_names, 'bash')",
+    ])
+    def test_sql_reports_evaluation_errors_like_python(self, test_license_key, query):
+        from api.utils.policy_query import run_query
+        from api.utils.report_index import compile_query_to_q
+
+        devices = self._create_devices(test_license_key)
+        _, errors = compile_query_to_q(query)
+
+        expected = {d.id for d, report in zip(devices, self.REPORTS) if run_query(report, query)[1]}
+        assert set(Device.objects.filter(errors).values_list('id', flat=True)) == expected
+
+    @pytest.mark.parametrize('query', [
+        'length(installed_package_names) > `1`',
+        'hardening_index > max_hardening_index',
+        'days_since_audit < `7`',
+        "contains(os, 'Lin')",
+        'hardening_index > `1.5`',
+    ])
+    def test_unsupported_queries_are_not_translated(self, query):
+        from api.utils.report_index import compile_query_to_q
+
+        assert compile_query_to_q(query) is None
+
+    def test_upload_indexes_report(self, test_license_key, sample_lynis_report):
+        from api.models import ReportFact
+
+        response = Client().post(reverse('upload_report'), {
+            'licensekey': test_license_key.licensekey,
+            'hostid': 'abc123def456',
+            'hostid2': 'xyz789uvw012',
+            'data': sample_lynis_report,
+        })
+
+        assert response.status_code == 200
+        device = Device.objects.get(hostid='abc123def456')
+        assert ReportFact.objects.get(device=device, key='hostname').value_str == 'test-server'
+        assert not ReportFact.objects.filter(device=device, key='days_since_audit').exists()
+
+    def test_preview_uses_sql_once_fleet_is_indexed(self, test_license_key):
+        from api.utils.policy_query import run_query
+        from api.utils.rule_preview import preview_query
+
+        devices = self._create_devices(test_license_key)
+
+        preview = preview_query('hardening_index > `60`', Device.objects.all(), time_budget=10)
+        assert preview['engine'] == 'sql'
+        assert (preview['evaluated'], preview['passed'], preview['failed'], preview['errors']) == (4, 2, 1, 1)
+        assert [d['id'] for d in preview['failing_devices']] == [devices[0].id]
+        assert [e['device_id'] for e in preview['error_samples']] == [devices[3].id]
+        # The sampled error is the actual evaluation error of the device's report
+        report = FullReport.objects.filter(device=devices[3]).latest('created_at').parsed_report
+        assert preview['error_samples'][0]['error'] == run_query(report, 'hardening_index > `60`')[1]
+
+    def test_preview_falls_back_to_python_until_fleet_is_indexed(self, test_license_key, test_device):
+        from api.utils.rule_preview import preview_query
+
+        self._create_devices(test_license_key)
+        FullReport.objects.create(device=test_device, full_report='', parsed_report={'hardening_index': 80})
+
+        preview = preview_query('hardening_index > `60`', Device.objects.all(), time_budget=10)
+        assert preview['engine'] == 'python'
+        assert preview['passed'] == 3
+
+
+@pytest.mark.django_db
+class TestComplianceSnapshots:
+    """Tests for daily compliance snapshots per scope."""
+
+    def test_counts_per_scope(self, test_license_key):
+        from conftest import DeviceFactory
+        from api.models import ComplianceResult, ComplianceSnapshot, Label, PolicyRule, PolicyRuleset, ReportFact
+
+        rule = PolicyRule.objects.create(name='Hardening', rule_query='hardening_index > `60`')
+        ruleset = PolicyRuleset.objects.create(name='Baseline')
+        ruleset.rules.add(rule)
+        label = Label.objects.create(name='web')
+
+        passing, failing, unassessed = (DeviceFactory(licensekey=test_license_key) for _ in range(3))
+        failing.compliant = False
+        failing.save()
+        for device, hardening_index in ((passing, 80), (failing, 40)):
+            device.rulesets.add(ruleset)
+            device.labels.add(label)
+            ReportFact.objects.create(device=device, key='hardening_index', value_num=hardening_index)
+            ComplianceResult.objects.create(device=device, rule=rule, passed=hardening_index > 60)
+
+        from api.utils.compliance_snapshots import take_compliance_snapshots
+
+        take_compliance_snapshots()
+        # Taking the snapshot again the same day replaces it
+        stored = take_compliance_snapshots()
+        assert stored == ComplianceSnapshot.objects.count()
+
+        fleet = ComplianceSnapshot.objects.get(scope='fleet')
+        assert (fleet.total, fleet.compliant, fleet.non_compliant, fleet.unknown) == (3, 1, 1, 1)
+        assert fleet.avg_hardening_index == 60
+        by_ruleset = ComplianceSnapshot.objects.get(scope='ruleset', scope_id=ruleset.id)
+        assert (by_ruleset.total, by_ruleset.compliant, by_ruleset.non_compliant) == (2, 1, 1)
+        by_label = ComplianceSnapshot.objects.get(scope='label', scope_id=label.id)
+        assert by_label.total == 2
+        by_license = ComplianceSnapshot.objects.get(scope='license', scope_id=test_license_key.id)
+        assert by_license.total == 3
+
+    def test_trend_returns_recent_days_oldest_first(self):
+        from api.models import ComplianceSnapshot
+        from api.utils.compliance_snapshots import compliance_trend
+
+        today = timezone.localdate()
+        for days_ago in (100, 1, 0):
+            ComplianceSnapshot.objects.create(
+                date=today - timedelta(days=days_ago), scope='fleet', total=4, compliant=3, non_compliant=1,
+            )
+
+        points = compliance_trend('fleet', days=90)
+
+        assert [p['date'] for p in points] == [(today - timedelta(days=1)).isoformat(), today.isoformat()]
+        assert points[0]['compliance_pct'] == 75
+
+
+@pytest.mark.django_db
+class TestRuleStats:
+    """Tests for per-rule evaluation statistics."""
+
+    def test_flush_accumulates_counters(self):
+        from api.models import PolicyRule, PolicyRuleStats
+        from api.utils.rule_stats import RuleStatsCollector
+
+        rule = PolicyRule.objects.create(name='Slow', rule_query='hardening_index > `60`')
+        deleted = PolicyRule.objects.create(name='Deleted', rule_query='os == `"Linux"`')
+        collector = RuleStatsCollector(flush_interval=3600)
+
+        for _ in range(19):
+            collector.record(rule.id, 0.0001)
+        collector.record(rule.id, 0.2, failed=True)
+        collector.record(deleted.id, 0.0001)
+        deleted.delete()
+        assert collector.flush() == 1
+        collector.record(rule.id, 0.0001)
+        collector.flush()
+
+        stats = PolicyRuleStats.objects.get(rule=rule)
+        assert (stats.evaluations, stats.errors) == (21, 1)
+        assert stats.p95_ms == 0.1
+        assert stats.avg_ms == pytest.approx((0.0001 * 20 + 0.2) * 1000 / 21)
+
+    def test_recording_does_not_write_to_the_database(self, django_assert_num_queries):
+        import threading
+        from api.models import PolicyRule
+        from api.utils.rule_stats import RuleStatsCollector
+
+        rule = PolicyRule.objects.create(name='Fast', rule_query='hardening_index > `60`')
+        collector = RuleStatsCollector(flush_interval=3600)
+
+        # Not even from inside a request or an ingest transaction: a background thread flushes
+        with django_assert_num_queries(0):
+            collector.record(rule.id, 0.0001)
+            collector.record(rule.id, 0.0001)
+
+        assert [t for t in threading.enumerate() if t.name == 'rule-stats-flush']
+        assert collector.flush() == 1
+
+    def test_flush_adds_to_rows_created_by_other_processes(self, monkeypatch):
+        from api.models import PolicyRule, PolicyRuleStats
+        from api.utils.rule_stats import RuleStatsCollector, empty_histogram
+
+        rule = PolicyRule.objects.create(name='Shared', rule_query='hardening_index > `60`')
+        collector = RuleStatsCollector(flush_interval=3600)
+        collector.record(rule.id, 0.0001)
+        original_bulk_create = PolicyRuleStats.objects.bulk_create
+
+        def bulk_create_after_other_process(objs, **kwargs):
+            # Another process created the row after this one checked for it
+            PolicyRuleStats.objects.create(rule=rule, evaluations=5, histogram=empty_histogram())
+            return original_bulk_create(objs, **kwargs)
+
+        monkeypatch.setattr(PolicyRuleStats.objects, 'bulk_create', bulk_create_after_other_process)
+        assert collector.flush() == 1
+
+        assert PolicyRuleStats.objects.get(rule=rule).evaluations == 6
+
+    def test_slow_rule_flagged_above_threshold(self, settings):
+        from api.models import PolicyRule, PolicyRuleStats
+        from api.utils.rule_stats import DURATION_BUCKETS_MS, empty_histogram
+
+        settings.RULE_SLOW_THRESHOLD_MS = 5
+        rule = PolicyRule.objects.create(name='Packages', rule_query='length(installed_packages_array) > `0`')
+        histogram = empty_histogram()
+        histogram[DURATION_BUCKETS_MS.index(25)] = 10
+
+        stats = PolicyRuleStats.objects.create(rule=rule, evaluations=10, total_time=0.2, histogram=histogram)
+
+        assert stats.p95_ms == 25
+        assert stats.is_slow is True
+
+    def test_evaluate_with_error_records_evaluations(self):
+        from api.models import PolicyRule
+        from api.utils.rule_stats import flush_rule_stats, rule_stats
+
+        rule_stats.clear()
+        rule = PolicyRule.objects.create(name='Invalid', rule_query='hardening_index > `60`')
+
+        rule.evaluate_with_error({'hardening_index': 70})
+        PolicyRule.objects.filter(id=rule.id).update(rule_query='length(`1`)')
+        rule.refresh_from_db()
+        rule.evaluate_with_error({})
+        flush_rule_stats()
+
+        rule.refresh_from_db()
+        assert (rule.stats.evaluations, rule.stats.errors) == (2, 1)
+
+
+@pytest.mark.django_db
+class TestFleetSummary:
+    """Tests for the incrementally maintained fleet summary."""
+
+    SUMMARY_FIELDS = ('total_devices', 'compliant', 'non_compliant', 'unknown', 'hardening_sum', 'hardening_count', 'warnings_total')
+
+    def _snapshot(self):
+        from api.models import FleetOsCount
+        from api.utils.fleet_summary import get_fleet_summary
+
+        summary = get_fleet_summary()
+        os_counts = set(FleetOsCount.objects.filter(count__gt=0).values_list('distro', 'distro_version', 'count'))
+        return {field: getattr(summary, field) for field in self.SUMMARY_FIELDS}, os_counts
+
+    def test_incremental_updates_match_rebuild(self, test_license_key, sample_lynis_report):
+        from conftest import DeviceFactory
+        from api.models import PolicyRule, PolicyRuleset
+        from api.utils.compliance import update_device_compliance
+        from api.utils.fleet_summary import rebuild_fleet_summary
+
+        assert self._snapshot()[0]['total_devices'] == 0
+
+        ruleset = PolicyRuleset.objects.create(name='Baseline')
+        ruleset.rules.add(PolicyRule.objects.create(name='Hardened', rule_query='hardening_index > `70`'))
+        other_ruleset = PolicyRuleset.objects.create(name='Other')
+        devices = [DeviceFactory(licensekey=test_license_key, distro='Ubuntu', distro_version='22.04', warnings=2) for _ in range(4)]
+        for device in devices:
+            FullReport.objects.create(device=device, full_report=sample_lynis_report)
+        devices[0].rulesets.add(ruleset)
+        ruleset.devices.add(devices[1])
+        other_ruleset.devices.add(devices[2])
+        update_device_compliance(devices[0], {'hardening_index': 65})
+        devices[3].distro = 'Debian'
+        devices[3].save()
+        devices[1].delete()
+        other_ruleset.delete()
+
+        incremental = self._snapshot()
+        rebuild_fleet_summary()
+        assert incremental == self._snapshot()
+        summary, os_counts = incremental
+        assert (summary['total_devices'], summary['non_compliant'], summary['unknown']) == (3, 1, 2)
+        assert (summary['hardening_count'], summary['warnings_total']) == (3, 6)
+        assert os_counts == {('Ubuntu', '22.04', 2), ('Debian', '22.04', 1)}
+
+    def test_dashboard_reads_summary(self, test_user, test_device):
+        client = Client()
+        client.force_login(test_user)
+
+        response = client.get(reverse('dashboard'))
+        test_device.compliant = False
+        test_device.save()
+        test_device.rulesets.create(name='Baseline')
+        response = client.get(reverse('dashboard'))
+
+        assert response.context['non_compliant_count'] == 1
+        assert response.context['total_devices'] == 1
+
+
+@pytest.mark.django_db
+class TestReportFindings:
+    """Tests for the warnings and suggestions findings table."""
+
+    REPORT = (
+        '# Lynis Report\nhostname=test1\nos=Linux\nlynis_version=3.0.0\n'
+        'warning[]=PKGS-7392|Found one or more vulnerable packages.|-|-\n'
+        'warning[]=PKGS-7392|Found another vulnerable package.|-|-\n'
+        'suggestion[]=SSH-7408|Consider hardening SSH configuration|-|-\n'
+    )
+
+    def test_findings_replaced_by_latest_report(self, test_device):
+        from api.models import ReportFinding
+
+        FullReport.objects.create(device=test_device, full_report=self.REPORT)
+        assert set(ReportFinding.objects.filter(device=test_device).values_list('finding_type', 'test_id')) == {
+            ('warning', 'PKGS-7392'), ('suggestion', 'SSH-7408'),
+        }
+
+        report = FullReport.objects.create(
+            device=test_device,
+            full_report='# Lynis Report\nhostname=test1\nwarning[]=AUTH-9286|Weak passwords|-|-\n',
+        )
+        assert list(ReportFinding.objects.filter(device=test_device).values_list('report_id', 'test_id')) == [
+            (report.id, 'AUTH-9286'),
+        ]
+
+    def test_top_findings_count_distinct_devices(self, test_license_key):
+        from conftest import DeviceFactory
+        from api.utils.findings import devices_with_finding, top_findings
+
+        d1 = DeviceFactory(licensekey=test_license_key)
+        d2 = DeviceFactory(licensekey=test_license_key)
+        DeviceFactory(licensekey=test_license_key)
+        FullReport.objects.create(device=d1, full_report=self.REPORT)
+        FullReport.objects.create(device=d2, full_report=self.REPORT)
+
+        top_warnings = top_findings('warning')
+        assert [(f['test_id'], f['count']) for f in top_warnings] == [('PKGS-7392', 2)]
+        assert top_findings('suggestion', devices=Device.objects.filter(id=d1.id))[0]['count'] == 1
+        assert set(devices_with_finding('warning', 'PKGS-7392')) == {d1, d2}
+        assert not devices_with_finding('warning', 'SSH-7408').exists()
+
+
+class TestSQLiteLockRetry:
+    """Retries of SQLite statements failing with "database is locked"."""
+
+    def test_retries_lock_errors_then_succeeds(self, monkeypatch):
+        import sqlite3
+        from trikusec.db.sqlite3 import base
+
+        monkeypatch.setattr(base.time, 'sleep', lambda seconds: None)
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise sqlite3.OperationalError('database is locked')
+            return 'ok'
+
+        assert base.retry_on_lock(flaky, attempts=5, base_delay=0.01) == 'ok'
+        assert len(calls) == 3
+
+    def test_other_errors_and_exhausted_retries_are_raised(self, monkeypatch):
+        import sqlite3
+        from trikusec.db.sqlite3 import base
+
+        monkeypatch.setattr(base.time, 'sleep', lambda seconds: None)
+
+        def locked():
+            raise sqlite3.OperationalError('database is locked')
+
+        def missing_table():
+            raise sqlite3.OperationalError('no such table: api_device')
+
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            base.retry_on_lock(locked, attempts=3, base_delay=0.01)
+        with pytest.raises(sqlite3.OperationalError, match='no such table'):
+            base.retry_on_lock(missing_table, attempts=3, base_delay=0.01)
+
+    @pytest.mark.django_db
+    def test_connections_use_tuned_pragmas(self):
+        from django.db import connection
+
+        if connection.vendor != 'sqlite':
+            pytest.skip('SQLite connection profile')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA temp_store')
+            assert cursor.fetchone()[0] == 2  # MEMORY
+            cursor.execute('PRAGMA synchronous')
+            assert cursor.fetchone()[0] == 1  # NORMAL
+
+
+@pytest.mark.django_db
+class TestIngestFunnel:
+    """Tests for funnel mode uploads and the run_ingest_writer management command."""
+
+    def _upload(self, license_key, report, hostid='funnel-host-1'):
+        return Client().post(reverse('upload_report'), {
+            'licensekey': license_key.licensekey,
+            'hostid': hostid,
+            'hostid2': f'{hostid}-2',
+            'data': report,
+        })
+
+    # The writer closes stale connections between batches, which needs a real transaction
+    @pytest.mark.django_db(transaction=True)
+    def test_uploads_are_spooled_and_stored_by_the_writer(self, settings, tmp_path, test_license_key,
+                                                          sample_lynis_report, sample_lynis_report_updated):
+        from io import StringIO
+        from django.core.management import call_command
+
+        settings.INGEST_MODE = 'funnel'
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+
+        assert self._upload(test_license_key, sample_lynis_report).content == b'OK'
+        assert self._upload(test_license_key, sample_lynis_report_updated).content == b'OK'
+        assert not Device.objects.filter(hostid='funnel-host-1').exists()
+        assert Client().get(reverse('health_check')).json()['ingest_spool']['pending'] == 2
+
+        out = StringIO()
+        call_command('run_ingest_writer', once=True, stdout=out)
+
+        device = Device.objects.get(hostid='funnel-host-1')
+        # Stored in upload order: the second report is diffed against the first
+        assert FullReport.objects.filter(device=device).count() == 2
+        assert DiffReport.objects.filter(device=device).count() == 1
+        assert 'stored 2 reports, rejected 0' in out.getvalue()
+        assert list(tmp_path.glob('*.json')) == []
+
+    def test_invalid_reports_are_refused_before_spooling(self, settings, tmp_path, test_license_key):
+        settings.INGEST_MODE = 'funnel'
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+
+        response = self._upload(test_license_key, 'not a lynis report')
+
+        assert response.status_code == 400
+        assert list(tmp_path.glob('*.json')) == []
+
+    def test_reports_of_revoked_licenses_are_rejected(self, settings, tmp_path, test_license_key, sample_lynis_report):
+        from api.utils.ingest_funnel import process_batch, writer_lock
+
+        settings.INGEST_MODE = 'funnel'
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+        self._upload(test_license_key, sample_lynis_report)
+        LicenseKey.objects.filter(pk=test_license_key.pk).update(is_active=False)
+
+        with writer_lock():
+            assert process_batch(50) == (0, 1, 0)
+
+        assert not Device.objects.filter(hostid='funnel-host-1').exists()
+        assert len(list((tmp_path / 'rejected').glob('*.json'))) == 1
+
+    def test_failing_reports_are_retried_later_then_rejected(self, settings, tmp_path, monkeypatch, test_license_key,
+                                                              sample_lynis_report):
+        import time
+        from api.utils import ingest_funnel
+
+        settings.INGEST_MODE = 'funnel'
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+        settings.INGEST_RETRY_DELAY = 60
+        settings.INGEST_MAX_ATTEMPTS = 3
+        store = ingest_funnel.ingest_report
+
+        def failing_ingest(license_key, hostid, hostid2, report):
+            if hostid == 'funnel-host-1':
+                raise RuntimeError('unexpected failure')
+            return store(license_key, hostid, hostid2, report)
+
+        monkeypatch.setattr(ingest_funnel, 'ingest_report', failing_ingest)
+        self._upload(test_license_key, sample_lynis_report, hostid='funnel-host-1')
+        self._upload(test_license_key, sample_lynis_report, hostid='funnel-host-2')
+
+        with ingest_funnel.writer_lock():
+            assert ingest_funnel.process_batch(50) == (1, 0, 1)
+            # Waiting for its backoff: the next batches don't pick it
+            assert ingest_funnel.pending_reports() == []
+            assert ingest_funnel.spool_stats()['retrying'] == 1
+
+            # Retried once its backoff (60 s, then 120 s) has passed, until the last attempt
+            now_ns = time.time_ns()
+            monkeypatch.setattr(ingest_funnel.time, 'time_ns', lambda: now_ns + 61 * 10**9)
+            assert ingest_funnel.process_batch(50) == (0, 0, 1)
+            monkeypatch.setattr(ingest_funnel.time, 'time_ns', lambda: now_ns + 200 * 10**9)
+            assert ingest_funnel.process_batch(50) == (0, 1, 0)
+
+        assert Device.objects.filter(hostid='funnel-host-2').exists()
+        assert list(tmp_path.glob('*.json')) == []
+        assert len(list((tmp_path / 'rejected').glob('*.json'))) == 1
+
+    @pytest.mark.parametrize('failure', ['raise', 'swallow'])
+    def test_database_errors_after_the_report_is_saved_retry_it(self, settings, tmp_path, monkeypatch, failure,
+                                                                 test_license_key, sample_lynis_report):
+        from django.db import DatabaseError, transaction
+        from api.utils import ingest_funnel, report_index
+
+        settings.INGEST_MODE = 'funnel'
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+
+        def failing_index(device, parsed_report):
+            if failure == 'raise':
+                raise DatabaseError('index write failed')
+            # A caller that logs the error leaves the transaction marked for rollback
+            transaction.set_rollback(True)
+
+        monkeypatch.setattr(report_index, 'index_report_facts', failing_index)
+        self._upload(test_license_key, sample_lynis_report)
+
+        with ingest_funnel.writer_lock():
+            assert ingest_funnel.process_batch(50) == (0, 0, 1)
+
+        assert not FullReport.objects.exists()
+        assert ingest_funnel.spool_stats() == {'pending': 1, 'retrying': 1, 'oldest_seconds': 0.0}
+
+    def test_only_one_writer_runs(self, settings, tmp_path):
+        from api.utils.ingest_funnel import WriterBusy, writer_lock
+
+        settings.INGEST_SPOOL_DIR = str(tmp_path)
+
+        with writer_lock():
+            with pytest.raises(WriterBusy):
+                with writer_lock():
+                    pass
+
+
+@pytest.mark.django_db
+class TestFleetIteration:
+    """Tests for chunked fleet-wide iteration and connection pool statistics."""
+
+    def test_compliance_refresh_reads_devices_in_chunks(self, settings, test_license_key, sample_lynis_report):
+        from conftest import DeviceFactory
+        from api.models import PolicyRule, PolicyRuleset
+        from api.utils.compliance import refresh_devices_compliance
+        from api.utils.fleet_iteration import iter_chunks
+
+        settings.DB_ITERATOR_CHUNK_SIZE = 2
+        ruleset = PolicyRuleset.objects.create(name='Baseline')
+        ruleset.rules.add(PolicyRule.objects.create(name='Hardened', rule_query='hardening_index > `100`'))
+        devices = [DeviceFactory(licensekey=test_license_key) for _ in range(5)]
+        for device in devices:
+            FullReport.objects.create(device=device, full_report=sample_lynis_report)
+            device.rulesets.add(ruleset)
+
+        assert [len(chunk) for chunk in iter_chunks(Device.objects.order_by('id'))] == [2, 2, 1]
+        assert refresh_devices_compliance(Device.objects.all()) == (5, 0)
+        assert set(Device.objects.values_list('compliant', flat=True)) == {False}
+
+    def test_health_check_reports_pool_stats(self, monkeypatch):
+        from django.db import connection
+
+        class Pool:
+            def get_stats(self):
+                return {'pool_size': 4, 'pool_available': 3, 'requests_waiting': 0}
+
+        # A property of the PostgreSQL backend, so it is replaced on the class
+        monkeypatch.setattr(type(connection), 'pool', property(lambda self: Pool()), raising=False)
+
+        data = Client().get(reverse('health_check')).json()
+
+        assert data['database_pool'] == {'pool_size': 4, 'pool_available': 3, 'requests_waiting': 0}
+
+
+@pytest.mark.django_db
+class TestHistoryPartitions:
+    """Tests for the monthly partitions of DiffReport and DeviceEvent."""
+
+    @staticmethod
+    def partition_rows(name):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM "{name}"')
+            return cursor.fetchone()[0]
+
+    def test_rows_are_stored_in_their_month(self, test_device):
+        from api.models import DeviceEvent
+        from api.utils.history_partitions import DEFAULT_PARTITION_SUFFIX, current_month, partition_name
+
+        this_month = partition_name('api_deviceevent', current_month())
+        events = DeviceEvent.objects.bulk_create([
+            DeviceEvent(device=test_device, event_type='enrolled'),
+            DeviceEvent(device=test_device, event_type='compliance_changed'),
+        ])
+        assert len({event.pk for event in events}) == 2
+        assert self.partition_rows(this_month) == 2
+
+        # Moving a row out of the partitioned months stores it in the default partition
+        old = timezone.now() - timedelta(days=3 * 365)
+        assert DeviceEvent.objects.filter(pk=events[0].pk).update(created_at=old) == 1
+        assert self.partition_rows(this_month) == 1
+        assert self.partition_rows('api_deviceevent' + DEFAULT_PARTITION_SUFFIX) == 1
+        assert DeviceEvent.objects.get(pk=events[0].pk).created_at == old
+        assert DeviceEvent.objects.filter(created_at__gte=old + timedelta(days=1)).count() == 1
+
+    def test_save_and_delete_existing_rows(self, test_device):
+        from api.models import DeviceEvent, DiffReport
+
+        diff = DiffReport.objects.create(device=test_device, hostname='web-01', diff_report={'added': {}})
+        diff.hostname = 'web-02'
+        diff.save()
+        assert list(DiffReport.objects.values_list('hostname', flat=True)) == ['web-02']
+
+        event = DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        test_device.delete()
+        event.refresh_from_db()
+        assert event.device is None
+        assert DeviceEvent.objects.filter(pk=event.pk).delete()[0] == 1
+        assert not DeviceEvent.objects.exists()
+        # Ids are not reused
+        assert DeviceEvent.objects.create(event_type='enrolled').pk > event.pk
+
+    def test_expired_months_are_dropped(self, test_device):
+        from api.models import DeviceEvent, DiffReport
+        from api.utils.history_partitions import (
+            add_months, current_month, drop_expired_partitions, ensure_partitions, partition_months, partition_name,
+        )
+
+        DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        DiffReport.objects.create(device=test_device, diff_report={})
+        assert current_month() in partition_months('api_deviceevent')
+
+        # Two months from now, with one month of retention, this month has expired
+        later = timezone.now() + timedelta(days=62)
+        assert partition_name('api_deviceevent', add_months(current_month(), 5)) in ensure_partitions(now=later)
+        dropped = drop_expired_partitions(retention_months=1, now=later)
+        assert partition_name('api_deviceevent', current_month()) in dropped
+        assert partition_name('api_diffreport', current_month()) in dropped
+        assert current_month() not in partition_months('api_deviceevent')
+        assert not DeviceEvent.objects.exists()
+        assert not DiffReport.objects.exists()
+
+        # Rows of dropped months go to the default partition
+        event = DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        assert DeviceEvent.objects.get().pk == event.pk
+
+    def test_latest_history_stops_at_the_months_holding_it(self, test_device, django_assert_num_queries):
+        from api.models import DeviceEvent
+        from api.utils.history_partitions import latest_history
+
+        recent = DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        old = DeviceEvent.objects.create(device=test_device, event_type='license_changed')
+        older = DeviceEvent.objects.create(device=test_device, event_type='deleted')
+        DeviceEvent.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=100))
+        DeviceEvent.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(days=3 * 365))
+
+        # The partitions, then the current month only
+        with django_assert_num_queries(2):
+            assert [event.pk for event in latest_history(DeviceEvent.objects.all(), 1)] == [recent.pk]
+        assert [event.pk for event in latest_history(DeviceEvent.objects.all(), 10)] == [recent.pk, old.pk, older.pk]
+        assert [event.pk for event in latest_history(DeviceEvent.objects.all(), 2)] == [recent.pk, old.pk]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestHistoryPartitionSchemaChanges:
+    """Schema changes (migrations) of the partitioned history tables."""
+
+    def test_fields_and_indexes_are_changed_on_every_partition(self, test_device):
+        from django.db import connection, models
+        from api.models import DeviceEvent, DiffReport
+        from api.utils.history_partitions import current_month, is_partitioned, partition_months
+
+        DiffReport.objects.create(device=test_device, hostname='web-01', diff_report={})
+        event = DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        DeviceEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - timedelta(days=3 * 365))
+        months = partition_months('api_deviceevent')
+
+        note = models.CharField(max_length=20, null=True)
+        note.set_attributes_from_name('note')
+        index = models.Index(fields=['event_type', 'created_at'], name='api_deviceevent_note_idx')
+        old_hostname = DiffReport._meta.get_field('hostname')
+        new_hostname = models.CharField(max_length=300, blank=True, null=True, db_index=True)
+        new_hostname.set_attributes_from_name('hostname')
+        new_hostname.model = DiffReport
+        with connection.schema_editor() as schema_editor:
+            schema_editor.add_field(DeviceEvent, note)
+            schema_editor.add_index(DeviceEvent, index)
+            schema_editor.alter_field(DiffReport, old_hostname, new_hostname)
+
+        assert is_partitioned('api_deviceevent') and is_partitioned('api_diffreport')
+        assert partition_months('api_deviceevent') == months
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT "id", "note" FROM "api_deviceevent"')
+            assert cursor.fetchall() == [(event.pk, None)]
+            cursor.execute('UPDATE "api_deviceevent" SET "note" = %s', ['checked'])
+            cursor.execute('SELECT "note" FROM "api_deviceevent"')
+            assert cursor.fetchall() == [('checked',)]
+        assert list(DiffReport.objects.values_list('hostname', flat=True)) == ['web-01']
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(DeviceEvent, index)
+            schema_editor.remove_field(DeviceEvent, note)
+            schema_editor.alter_field(DiffReport, new_hostname, old_hostname)
+
+        assert current_month() in partition_months('api_deviceevent')
+        assert DeviceEvent.objects.create(device=test_device, event_type='deleted').pk > event.pk
+        assert DeviceEvent.objects.count() == 2
+
+
+class TestReadReplicaRouting:
+    """Tests for read replica routing, session stickiness and the lag fallback."""
+
+    @pytest.fixture(autouse=True)
+    def replica(self, monkeypatch):
+        from trikusec.db import replica
+
+        monkeypatch.setattr(replica, 'replica_configured', lambda: True)
+        monkeypatch.setattr(replica, 'replica_lag', lambda: 0.5)
+        monkeypatch.setattr(replica, '_health', {'checked_at': None, 'available': False})
+        return replica
+
+    def test_reads_of_decorated_views_use_the_replica_until_a_write(self, replica):
+        router = replica.ReplicaRouter()
+
+        assert router.db_for_read(Device) == 'default'
+        with replica.read_from_replica():
+            assert router.db_for_read(Device) == 'replica'
+            assert router.db_for_write(Device) == 'default'
+            assert router.db_for_read(Device) == 'default'
+        assert router.db_for_read(Device) == 'default'
+
+    def test_sessions_that_wrote_read_from_the_primary(self, replica):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from api.middleware import ReplicaStickinessMiddleware
+
+        request = RequestFactory().post('/devices/bulk/labels/')
+        request.session = {}
+        ReplicaStickinessMiddleware(lambda request: HttpResponse()).process_response(request, HttpResponse())
+
+        with replica.read_from_replica(request) as use_replica:
+            assert not use_replica
+        request.session[replica.SESSION_PRIMARY_UNTIL_KEY] = 0
+        with replica.read_from_replica(request) as use_replica:
+            assert use_replica
+
+    def test_lagging_replica_falls_back_to_the_primary(self, replica, monkeypatch, settings):
+        settings.DATABASE_REPLICA_MAX_LAG = 5
+        settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL = 0
+        monkeypatch.setattr(replica, 'replica_lag', lambda: 30.0)
+
+        with replica.read_from_replica() as use_replica:
+            assert not use_replica
+            assert replica.ReplicaRouter().db_for_read(Device) == 'default'
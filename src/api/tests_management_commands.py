@@ -1,8 +1,10 @@
 """Tests for management commands."""
 import pytest
 import os
+from datetime import timedelta
 from django.core.management import call_command
 from django.contrib.auth.models import User
+from django.utils import timezone
 from io import StringIO
 
 
@@ -97,3 +99,310 @@ class TestChangeAdminPassword:
         # The Django user.set_password(None) will set an unusable password
         admin.refresh_from_db()
         assert not admin.check_password('initial_password')
+
+
+@pytest.mark.django_db
+class TestRecomputeCompliance:
+    """Tests for the recompute_compliance management command."""
+
+    def _setup(self, license_key, report, count=3):
+        from conftest import DeviceFactory
+        from api.models import FullReport, PolicyRule, PolicyRuleset
+
+        rule = PolicyRule.objects.create(name='Hardening over 100', rule_query='hardening_index > `100`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Strict', description='')
+        ruleset.rules.add(rule)
+        devices = [DeviceFactory(licensekey=license_key) for _ in range(count)]
+        for device in devices:
+            device.rulesets.add(ruleset)
+            FullReport.objects.create(device=device, full_report=report)
+        return rule, devices
+
+    # Starting the workers closes the database connections, which needs a real transaction
+    @pytest.mark.django_db(transaction=True)
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_recomputes_and_records_changes_in_bulk(self, test_license_key, sample_lynis_report, workers):
+        from api.models import ComplianceResult, Device, DeviceEvent
+
+        from api.utils.rule_stats import rule_stats
+
+        rule, devices = self._setup(test_license_key, sample_lynis_report)
+        rule_stats.clear()
+
+        out = StringIO()
+        call_command('recompute_compliance', workers=workers, batch_size=2, stdout=out)
+
+        assert not Device.objects.filter(compliant=True).exists()
+        assert ComplianceResult.objects.filter(rule=rule, passed=False).count() == 3
+        assert DeviceEvent.objects.filter(event_type='compliance_changed').count() == 3
+        assert 'devices/s' in out.getvalue()
+        # Timings measured in the workers are recorded by the parent process
+        assert rule.stats.evaluations == 3
+
+    def test_label_filter_and_devices_without_reports(self, test_license_key, sample_lynis_report):
+        from conftest import DeviceFactory
+        from api.models import Device, Label
+
+        _, devices = self._setup(test_license_key, sample_lynis_report)
+        label = Label.objects.create(name='web')
+        devices[0].labels.add(label)
+        no_report = DeviceFactory(licensekey=test_license_key)
+        no_report.labels.add(label)
+
+        out = StringIO()
+        call_command('recompute_compliance', label='web', workers=1, stdout=out)
+
+        assert list(Device.objects.filter(compliant=False)) == [devices[0]]
+        assert 'for 1 devices (1 skipped' in out.getvalue()
+
+    def test_unknown_ruleset_is_an_error(self):
+        from django.core.management.base import CommandError
+
+        with pytest.raises(CommandError):
+            call_command('recompute_compliance', ruleset='missing', workers=1, stdout=StringIO())
+
+
+@pytest.mark.django_db
+class TestBackfillParsedReports:
+    """Tests for the backfill_parsed_reports management command."""
+
+    def test_stores_parsed_report_for_legacy_rows(self, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        out = StringIO()
+        call_command('backfill_parsed_reports', stdout=out)
+
+        report.refresh_from_db()
+        assert report.parsed_report['hostname'] == 'test-server'
+        assert 'for 1 of 1 reports' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestReindexReports:
+    """Tests for the reindex_reports management command."""
+
+    def test_indexes_latest_report_of_each_device(self, test_device, sample_lynis_report):
+        from api.models import FullReport, ReportFact
+
+        FullReport.objects.create(device=test_device, full_report='', parsed_report={'hostname': 'old'})
+        FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        out = StringIO()
+        call_command('reindex_reports', stdout=out)
+
+        assert ReportFact.objects.get(device=test_device, key='hostname').value_str == 'test-server'
+        assert 'of 1 of 1 devices' in out.getvalue()
+
+    def test_rebuilds_device_report_columns(self, test_device):
+        from api.models import Device, FullReport
+
+        FullReport.objects.create(device=test_device, full_report='', parsed_report={'hardening_index': '64'})
+        Device.objects.filter(pk=test_device.pk).update(hardening_index=None)
+
+        call_command('reindex_reports', stdout=StringIO())
+
+        test_device.refresh_from_db()
+        assert test_device.hardening_index == 64
+
+
+@pytest.mark.django_db
+class TestSnapshotCompliance:
+    """Tests for the snapshot_compliance management command."""
+
+    def test_stores_fleet_snapshot(self, test_device):
+        from api.models import ComplianceSnapshot
+
+        out = StringIO()
+        call_command('snapshot_compliance', stdout=out)
+
+        assert ComplianceSnapshot.objects.get(scope='fleet').total == 1
+        assert 'Stored' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestRebuildFleetSummary:
+    """Tests for the rebuild_fleet_summary management command."""
+
+    def test_repairs_drifted_summary(self, test_device):
+        from api.models import FleetSummary
+        from api.utils.fleet_summary import get_fleet_summary
+
+        get_fleet_summary()
+        FleetSummary.objects.update(total_devices=42)
+
+        out = StringIO()
+        call_command('rebuild_fleet_summary', stdout=out)
+
+        assert get_fleet_summary().total_devices == 1
+        assert '1 devices' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestCompressReports:
+    """Tests for report compression and the compress_reports management command."""
+
+    def test_compresses_existing_reports_in_place(self, settings, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+        settings.REPORT_COMPRESSION = 'zlib'
+
+        out = StringIO()
+        call_command('compress_reports', stdout=out)
+
+        body_format, stored = FullReport.objects.values_list('body_format', 'full_report').get(pk=report.pk)
+        assert body_format == 'zlib'
+        assert len(stored) < len(sample_lynis_report)
+        assert FullReport.objects.get(pk=report.pk).full_report == sample_lynis_report
+        assert 'Rewrote 1 of 1 reports as zlib' in out.getvalue()
+
+        settings.REPORT_COMPRESSION = 'none'
+        call_command('compress_reports', stdout=StringIO())
+        body_format, stored = FullReport.objects.values_list('body_format', 'full_report').get(pk=report.pk)
+        assert body_format == 'none'
+        assert bytes(stored) == sample_lynis_report.encode('utf-8')
+
+    def test_new_reports_use_trained_dictionary(self, settings, tmp_path, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+        FullReport.objects.create(device=test_device, full_report=sample_lynis_report.replace('test-server', 'other'))
+        settings.REPORT_COMPRESSION = 'zlib'
+        dictionary_path = tmp_path / 'reports.dict'
+
+        call_command('compress_reports', train_dictionary=str(dictionary_path), stdout=StringIO())
+        settings.REPORT_COMPRESSION_DICTIONARY = str(dictionary_path)
+        report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        body_format = FullReport.objects.values_list('body_format', flat=True).get(pk=report.pk)
+        assert body_format.startswith('zlib:') and len(body_format) > len('zlib:')
+        assert FullReport.objects.get(pk=report.pk).get_parsed_report()['hostname'] == 'test-server'
+
+    def test_reports_stay_readable_after_the_dictionary_is_replaced(self, settings, tmp_path, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        settings.REPORT_COMPRESSION = 'zlib'
+        old_path, new_path = tmp_path / 'old.dict', tmp_path / 'new.dict'
+        old_path.write_bytes(b'Lynis report old dictionary\n')
+        new_path.write_bytes(b'Lynis report new dictionary\n')
+        settings.REPORT_COMPRESSION_DICTIONARY = str(old_path)
+        report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        settings.REPORT_COMPRESSION_DICTIONARY = str(new_path)
+        old_path.unlink()
+        new_report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        formats = dict(FullReport.objects.values_list('id', 'body_format'))
+        assert formats[report.pk] != formats[new_report.pk]
+        assert FullReport.objects.get(pk=report.pk).full_report == sample_lynis_report
+        assert FullReport.objects.get(pk=new_report.pk).full_report == sample_lynis_report
+
+
+    @pytest.mark.parametrize('storage', ['database', 'filesystem'])
+    def test_reports_looking_like_stored_values_are_kept(self, settings, tmp_path, test_device, storage):
+        from api.models import FullReport
+
+        settings.REPORT_STORAGE = storage
+        settings.REPORT_BLOB_DIR = str(tmp_path)
+        settings.REPORT_COMPRESSION = 'zlib'
+        bodies = ['trikusec-compressed:zlib::eJwrSS0u', 'trikusec-blob:sha256:../../../../etc/hostname']
+        reports = [FullReport.objects.create(device=test_device, full_report=body) for body in bodies]
+
+        assert [FullReport.objects.get(pk=report.pk).full_report for report in reports] == bodies
+
+
+@pytest.mark.django_db
+class TestReportBlobStore:
+    """Tests for the filesystem report storage and the gc_report_blobs management command."""
+
+    def test_reports_are_deduplicated_and_collected(self, settings, tmp_path, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        settings.REPORT_STORAGE = 'filesystem'
+        settings.REPORT_BLOB_DIR = str(tmp_path)
+        first = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+        FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+
+        body_format, stored = FullReport.objects.values_list('body_format', 'full_report').get(pk=first.pk)
+        assert body_format == 'blob'
+        assert len(stored) == 64
+        assert len(list(tmp_path.rglob('*'))) == 3  # Two shard directories and one file
+        assert FullReport.objects.get(pk=first.pk).full_report == sample_lynis_report
+
+        FullReport.objects.all().delete()
+        out = StringIO()
+        call_command('gc_report_blobs', grace_seconds=0, stdout=out)
+
+        assert 'Deleted 1 unreferenced report files, kept 0' in out.getvalue()
+
+    def test_only_sha256_digests_map_to_blob_files(self, settings, tmp_path, test_device):
+        from api.models import FullReport
+        from api.utils.report_storage import blob_path
+
+        settings.REPORT_BLOB_DIR = str(tmp_path)
+        report = FullReport.objects.create(device=test_device, full_report='x')
+        FullReport.objects.filter(pk=report.pk).update(body_format='blob', full_report=b'../../../../etc/hostname')
+
+        assert blob_path('a' * 64) == str(tmp_path / 'aa' / 'aa' / ('a' * 64))
+        for digest in ('../../../../etc/hostname', 'A' * 64, 'a' * 64 + '\n'):
+            with pytest.raises(ValueError):
+                blob_path(digest)
+        with pytest.raises(ValueError):
+            FullReport.objects.get(pk=report.pk).full_report
+
+    def test_moves_reports_between_backends(self, settings, tmp_path, test_device, sample_lynis_report):
+        from api.models import FullReport
+
+        report = FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+        settings.REPORT_STORAGE = 'filesystem'
+        settings.REPORT_BLOB_DIR = str(tmp_path)
+
+        call_command('compress_reports', stdout=StringIO())
+        assert FullReport.objects.values_list('body_format', flat=True).get(pk=report.pk) == 'blob'
+
+        settings.REPORT_STORAGE = 'database'
+        call_command('compress_reports', stdout=StringIO())
+        body_format, stored = FullReport.objects.values_list('body_format', 'full_report').get(pk=report.pk)
+        assert body_format == 'none'
+        assert bytes(stored) == sample_lynis_report.encode('utf-8')
+
+
+@pytest.mark.django_db
+class TestMaintainHistoryPartitions:
+    """Tests for the maintain_history_partitions management command."""
+
+    def test_drops_the_partitions_of_expired_months(self, monkeypatch, test_device):
+        from api.models import DeviceEvent, DiffReport
+        from api.utils.history_partitions import add_months, current_month, partition_months, partition_name
+
+        this_month = current_month()
+        DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        DiffReport.objects.create(device=test_device, diff_report={})
+        # Four months from now, the current month is more than 2 months old
+        later = timezone.now() + timedelta(days=4 * 31)
+        monkeypatch.setattr(timezone, 'now', lambda: later)
+
+        out = StringIO()
+        call_command('maintain_history_partitions', retention_months=2, stdout=out)
+
+        assert f'Dropped partition {partition_name("api_deviceevent", this_month)}' in out.getvalue()
+        assert f'Dropped partition {partition_name("api_diffreport", this_month)}' in out.getvalue()
+        assert this_month not in partition_months('api_deviceevent')
+        assert add_months(current_month(later), 3) in partition_months('api_deviceevent')
+        assert not DeviceEvent.objects.exists()
+        assert not DiffReport.objects.exists()
+
+    def test_keeps_all_history_by_default(self, settings, test_device):
+        from api.models import DeviceEvent
+
+        settings.HISTORY_RETENTION_MONTHS = 0
+        event = DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        DeviceEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - timedelta(days=3 * 365))
+
+        out = StringIO()
+        call_command('maintain_history_partitions', stdout=out)
+
+        assert DeviceEvent.objects.count() == 1
+        assert 'keeping all history' in out.getvalue()
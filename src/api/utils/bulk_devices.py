@@ -0,0 +1,79 @@
+from django.db import transaction
+
+from .compliance_jobs import enqueue_devices_compliance_job
+from .device_search import refresh_device_search_text
+from .fleet_summary import sync_device_summary
+from .view_cache import bump_fleet_data_version
+
+# Device many-to-many relations that can be changed in bulk -> column of the related object
+# in the relation's through table
+BULK_RELATIONS = {
+    'rulesets': 'policyruleset_id',
+    'labels': 'label_id',
+}
+
+
+def _ids_with_rulesets(device_ids):
+    from api.models import Device  # Avoid circular import
+
+    return set(
+        Device.rulesets.through.objects.filter(device_id__in=device_ids)
+        .values_list('device_id', flat=True).distinct()
+    )
+
+
+def bulk_update_relation(relation, device_ids, add_ids=(), remove_ids=(), user=None):
+    """
+    Add and remove rulesets or labels (relation) on many devices at once.
+
+    Changes are applied with one delete and one bulk insert in a single transaction, then
+    their side effects run once for all devices: label changes refresh the search text,
+    ruleset changes schedule a single compliance recompute job. Ids of objects that do not
+    exist are ignored. Returns {'added', 'removed', 'compliance_job'}.
+    """
+    from api.models import Device  # Avoid circular import
+
+    related_column = BULK_RELATIONS[relation]
+    related_model = Device._meta.get_field(relation).related_model
+    through = getattr(Device, relation).through
+    device_ids = list(Device.objects.filter(id__in=list(device_ids)).values_list('id', flat=True))
+    add_ids = set(related_model.objects.filter(id__in=list(add_ids)).values_list('id', flat=True))
+    remove_ids = set(remove_ids) - add_ids
+
+    with transaction.atomic():
+        had_rulesets = _ids_with_rulesets(device_ids) if relation == 'rulesets' else None
+
+        removed = 0
+        if remove_ids and device_ids:
+            removed, _ = through.objects.filter(
+                device_id__in=device_ids, **{f'{related_column}__in': remove_ids}
+            ).delete()
+
+        added = 0
+        if add_ids and device_ids:
+            existing = set(through.objects.filter(
+                device_id__in=device_ids, **{f'{related_column}__in': add_ids}
+            ).values_list('device_id', related_column))
+            new_rows = [
+                through(device_id=device_id, **{related_column: related_id})
+                for device_id in device_ids
+                for related_id in sorted(add_ids)
+                if (device_id, related_id) not in existing
+            ]
+            through.objects.bulk_create(new_rows, batch_size=500)
+            added = len(new_rows)
+
+        job = None
+        if added or removed:
+            # Set-based changes send no m2m_changed signals: apply their effects here
+            bump_fleet_data_version()
+            if relation == 'labels':
+                refresh_device_search_text(device_ids)
+            else:
+                # Devices gaining their first ruleset or losing their last one change between
+                # assessed and unknown; the recompute only saves devices whose status changes
+                for device in Device.objects.filter(id__in=had_rulesets ^ _ids_with_rulesets(device_ids)):
+                    sync_device_summary(device)
+                job = enqueue_devices_compliance_job(device_ids, user)
+
+    return {'added': added, 'removed': removed, 'compliance_job': job}
@@ -1,16 +1,81 @@
 import logging
 
-def check_device_compliance(device, report):
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery, prefetch_related_objects
+from django.utils import timezone
+
+from .fleet_iteration import iter_chunks
+from .lynis_report import LynisReport
+from .policy_query import VOLATILE_REPORT_KEYS
+from .view_cache import bump_fleet_data_version
+
+
+def _rulesets_prefetch():
+    from api.models import PolicyRuleset  # Avoid circular import
+
+    return Prefetch(
+        'rulesets',
+        queryset=PolicyRuleset.objects.order_by('id').prefetch_related('rules'),
+    )
+
+
+def prefetch_compliance_rulesets(devices):
     """
-    Check the compliance of a device and return both the compliance status and detailed rule results.
+    Load the rulesets and rules of many devices in a constant number of queries.
+
+    Accepts a Device queryset (returns a new queryset with the prefetch applied) or a
+    list of Device instances (prefetched in place and returned).
+    """
+    if hasattr(devices, 'prefetch_related'):
+        return devices.prefetch_related(_rulesets_prefetch())
+    devices = list(devices)
+    prefetch_related_objects(devices, _rulesets_prefetch())
+    return devices
+
+
+def _device_rulesets(device):
+    """Return the device's rulesets with their rules, reusing prefetched data when available."""
+    if 'rulesets' in getattr(device, '_prefetched_objects_cache', {}):
+        return list(device.rulesets.all())
+    # Not prefetched by the caller: load fresh data (two queries) without caching it on the instance
+    return list(device.rulesets.order_by('id').prefetch_related('rules'))
+
+
+def report_diff_keys(diff):
+    """Return the set of report keys added, removed or changed in a DiffReport-style diff."""
+    keys = set(diff.get('added', {})) | set(diff.get('removed', {}))
+    for change in diff.get('changed', []):
+        keys.update(change)
+    return keys
+
+
+def _reusable_results(device, previous_report, changed_keys):
+    """
+    Return {rule_id: (passed, error)} of the results stored for previous_report that are
+    still valid for a report in which only changed_keys differ from it.
+    """
+    affected_keys = set(changed_keys) | VOLATILE_REPORT_KEYS
+    reusable = {}
+    for result in device.compliance_results.filter(report=previous_report).select_related('rule'):
+        rule = result.rule
+        if result.passed is None or result.evaluated_at < rule.updated_at:
+            continue
+        fields = rule.query_fields
+        if fields is not None and not (fields & affected_keys):
+            reusable[rule.id] = (result.passed, result.error or None)
+    return reusable
+
+
+def evaluate_rulesets(policy_rulesets, rule_result):
+    """
+    Build the per-ruleset compliance structure from per-rule results.
+
+    rule_result(rule) returns (passed, error) and is called once per distinct rule; rules
+    shared by several rulesets reuse the same result. Returns (compliant, evaluated_rulesets).
     """
-    policy_rulesets = device.rulesets.all()
-    policy_rulesets = list(policy_rulesets)
-    
-    logging.debug('Policy rulesets for device %s: %s', device, policy_rulesets)
-    
     compliant = True
     evaluated_rulesets = []
+    rule_results = {}
     
     for policy_ruleset in policy_rulesets:
         ruleset_dict = {
@@ -22,14 +87,17 @@ def check_device_compliance(device, report):
         
         ruleset_compliant = True
         for rule in policy_ruleset.rules.all():
-            rule_compliant = rule.evaluate(report)
+            if rule.id not in rule_results:
+                rule_results[rule.id] = rule_result(rule)
+            rule_compliant, rule_error = rule_results[rule.id]
             ruleset_dict['rules'].append({
                 'id': rule.id,
                 'name': rule.name,
                 'description': rule.description,
                 'enabled': rule.enabled,
                 'alert': rule.alert,
-                'compliant': rule_compliant
+                'compliant': rule_compliant,
+                'error': rule_error,
             })
             # Only enabled rules affect ruleset compliance status
             if rule.enabled and not rule_compliant:
@@ -44,37 +112,229 @@ def check_device_compliance(device, report):
     return compliant, evaluated_rulesets
 
 
-def update_device_compliance(device, report):
+def check_device_compliance(device, report, previous_report=None, changed_keys=None):
     """
-    Check compliance, update device status, and log event if status changed.
-    Returns (compliant, evaluated_rulesets).
+    Check the compliance of a device and return both the compliance status and detailed rule results.
+
+    Each distinct rule is evaluated once per report; rules shared by several rulesets
+    reuse the same result. When previous_report (FullReport) and changed_keys (report keys
+    that differ from it) are given, rules that read none of the changed keys keep the
+    result stored for previous_report.
+    """
+    policy_rulesets = _device_rulesets(device)
+    
+    logging.debug('Policy rulesets for device %s: %s', device, policy_rulesets)
+    
+    reusable = {}
+    if previous_report is not None and changed_keys is not None:
+        reusable = _reusable_results(device, previous_report, changed_keys)
+
+    def rule_result(rule):
+        if rule.id in reusable:
+            return reusable[rule.id]
+        return rule.evaluate_with_error(report)
+
+    return evaluate_rulesets(policy_rulesets, rule_result)
+
+
+def bulk_store_compliance_results(entries):
+    """
+    Persist the per-rule results of many compliance checks as ComplianceResult rows.
+
+    entries is an iterable of (device, evaluated_rulesets, full_report). Results of rules
+    no longer assigned to a device are removed; the others are upserted in a single statement.
+    """
+    from api.models import ComplianceResult  # Avoid circular import
+
+    now = timezone.now()
+    results = {}
+    for device, evaluated_rulesets, full_report in entries:
+        for ruleset in evaluated_rulesets:
+            for rule in ruleset['rules']:
+                results[(device.id, rule['id'])] = ComplianceResult(
+                    device=device,
+                    rule_id=rule['id'],
+                    report=full_report,
+                    passed=rule['compliant'],
+                    error=rule.get('error') or '',
+                    evaluated_at=now,
+                )
+
+    device_ids = {device.id for device, _, _ in entries}
+    stale_ids = [
+        result_id
+        for result_id, device_id, rule_id in ComplianceResult.objects.filter(
+            device_id__in=device_ids
+        ).values_list('id', 'device_id', 'rule_id')
+        if (device_id, rule_id) not in results
+    ]
+    if stale_ids:
+        ComplianceResult.objects.filter(id__in=stale_ids).delete()
+    if results:
+        ComplianceResult.objects.bulk_create(
+            results.values(),
+            update_conflicts=True,
+            unique_fields=['device', 'rule'],
+            update_fields=['report', 'passed', 'error', 'evaluated_at'],
+        )
+
+
+def store_compliance_results(device, evaluated_rulesets, full_report=None):
+    """Persist the per-rule results of a device's compliance check (see bulk_store_compliance_results)."""
+    bulk_store_compliance_results([(device, evaluated_rulesets, full_report)])
+
+
+def get_device_compliance(device, report=None):
     """
+    Return (compliant, evaluated_rulesets) for a device from its stored ComplianceResult rows.
+
+    Rules without a stored result, or whose definition changed after the result was
+    stored, are evaluated against the given report (parsed dict). If no report is given,
+    those rules are reported with an unknown (None) status.
+    """
+    stored = {result.rule_id: result for result in device.compliance_results.all()}
+
+    def rule_result(rule):
+        result = stored.get(rule.id)
+        if result is not None and result.evaluated_at >= rule.updated_at:
+            return result.passed, result.error or None
+        if report is not None:
+            return rule.evaluate_with_error(report)
+        return None, None
+
+    return evaluate_rulesets(_device_rulesets(device), rule_result)
+
+
+def compliance_change_event(device, compliant):
+    """Return an unsaved 'compliance_changed' DeviceEvent for a device moving to the given status."""
     from api.models import DeviceEvent  # Avoid circular import
     
+    old_status = 'Compliant' if device.compliant else 'Non-Compliant'
+    new_status = 'Compliant' if compliant else 'Non-Compliant'
+
+    logging.info(f"Device {device.hostname} compliance changed: {old_status} -> {new_status}")
+
+    return DeviceEvent(
+        device=device,
+        event_type='compliance_changed',
+        metadata={
+            'old_status': old_status,
+            'new_status': new_status,
+            'hostname': device.hostname
+        }
+    )
+
+
+def set_device_compliance(device, compliant, now=None):
+    """Set a device's compliance status and when it became non-compliant, without saving it."""
+    device.compliant = compliant
+    device.non_compliant_since = None if compliant else (now or timezone.now())
+
+
+def update_device_compliance(device, report, full_report=None, previous_report=None, changed_keys=None):
+    """
+    Check compliance, store per-rule results, update device status, and log event if status changed.
+    Returns (compliant, evaluated_rulesets).
+
+    full_report is the FullReport the parsed report came from, recorded on the stored results.
+    previous_report and changed_keys limit re-evaluation to the rules reading changed keys
+    (see check_device_compliance).
+    """
     # Check compliance
-    compliant, evaluated_rulesets = check_device_compliance(device, report)
+    compliant, evaluated_rulesets = check_device_compliance(device, report, previous_report, changed_keys)
+    store_compliance_results(device, evaluated_rulesets, full_report)
     
     # Check if status changed
     if device.compliant != compliant:
-        old_status = 'Compliant' if device.compliant else 'Non-Compliant'
-        new_status = 'Compliant' if compliant else 'Non-Compliant'
-        
-        logging.info(f"Device {device.hostname} compliance changed: {old_status} -> {new_status}")
-        
         # Create event
-        DeviceEvent.objects.create(
-            device=device,
-            event_type='compliance_changed',
-            metadata={
-                'old_status': old_status,
-                'new_status': new_status,
-                'hostname': device.hostname
-            }
-        )
+        compliance_change_event(device, compliant).save()
         
         # Update device
-        device.compliant = compliant
+        set_device_compliance(device, compliant)
         device.save()
         
     return compliant, evaluated_rulesets
 
+
+def annotate_latest_report_id(devices_queryset):
+    """Annotate each device of a queryset with the id of its most recent FullReport (latest_report_id)."""
+    from api.models import FullReport  # Avoid circular import
+
+    latest_report_id = FullReport.objects.filter(device=OuterRef('pk')).order_by('-created_at').values('id')[:1]
+    return devices_queryset.annotate(latest_report_id=Subquery(latest_report_id))
+
+
+def prepare_stored_report(report):
+    """Return a copy of a stored parsed report with its time-derived keys refreshed for evaluation."""
+    report = dict(report)
+    if 'days_since_audit' in report:
+        report['days_since_audit'] = LynisReport.days_since_audit(report.get('report_datetime_end'))
+    return report
+
+
+def _save_compliance_changes(changed, events):
+    """Save the new compliance status of many devices and their change events in bulk."""
+    from api.models import Device, DeviceEvent  # Avoid circular import
+    from .fleet_summary import sync_device_summary  # Avoid circular import
+
+    DeviceEvent.objects.bulk_create(events)
+    Device.objects.bulk_update(changed, ['compliant', 'non_compliant_since'])
+    # Bulk writes send no post_save signals
+    for device in changed:
+        sync_device_summary(device)
+    bump_fleet_data_version()
+
+
+def refresh_devices_compliance(devices_queryset):
+    """
+    Recalculate and persist compliance status for the devices in a queryset from their latest report.
+
+    Devices are read in chunks; the rulesets, rules and latest parsed reports of each chunk
+    are loaded, and its results, status changes and change events written, in a constant
+    number of queries. Returns (refreshed, skipped).
+    """
+    from api.models import FullReport  # Avoid circular import
+
+    devices = prefetch_compliance_rulesets(annotate_latest_report_id(devices_queryset.distinct()))
+
+    refreshed = 0
+    skipped = 0
+    for chunk in iter_chunks(devices):
+        # The raw report is only read for reports stored without a parsed version
+        latest_reports = FullReport.objects.defer('full_report').in_bulk(
+            [d.latest_report_id for d in chunk if d.latest_report_id]
+        )
+        entries = []
+        changed = []
+        events = []
+        now = timezone.now()
+        for device in chunk:
+            latest_report = latest_reports.get(device.latest_report_id)
+            if not latest_report:
+                skipped += 1
+                continue
+
+            parsed_report = latest_report.get_parsed_report()
+            if not isinstance(parsed_report, dict) or not parsed_report:
+                skipped += 1
+                logging.warning(
+                    'Skipping compliance update for device %s: latest report could not be parsed',
+                    device.id,
+                )
+                continue
+
+            compliant, evaluated_rulesets = check_device_compliance(device, prepare_stored_report(parsed_report))
+            entries.append((device, evaluated_rulesets, latest_report))
+            if device.compliant != compliant:
+                events.append(compliance_change_event(device, compliant))
+                set_device_compliance(device, compliant, now)
+                changed.append(device)
+            refreshed += 1
+
+        with transaction.atomic():
+            if entries:
+                bulk_store_compliance_results(entries)
+            if changed:
+                _save_compliance_changes(changed, events)
+
+    return refreshed, skipped
@@ -0,0 +1,302 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .compliance import refresh_devices_compliance
+from .rule_stats import flush_rule_stats
+
+
+def _scope_device_ids(scope, scope_id):
+    """Return the ids of the devices whose compliance depends on the given rule or ruleset."""
+    from api.models import Device  # Avoid circular import
+
+    if scope == 'ruleset':
+        devices = Device.objects.filter(rulesets__id=scope_id)
+    else:
+        devices = Device.objects.filter(rulesets__rules__id=scope_id)
+    return list(devices.distinct().order_by('id').values_list('id', flat=True))
+
+
+def enqueue_compliance_job(scope, scope_id, user=None):
+    """
+    Schedule a compliance recompute for the devices affected by a rule or ruleset change.
+
+    If a job for the same scope is still active, the change is coalesced into it instead
+    of creating a new one: a pending job picks up the current device list, a running job
+    is flagged to do one more pass once it finishes. Returns the job.
+    """
+    from api.models import ComplianceJob  # Avoid circular import
+
+    with transaction.atomic():
+        job = (
+            ComplianceJob.objects.select_for_update()
+            .filter(scope=scope, scope_id=scope_id, status__in=ComplianceJob.ACTIVE_STATUSES)
+            .first()
+        )
+        if job is not None:
+            if job.status == 'pending':
+                job.device_ids = _scope_device_ids(scope, scope_id)
+                job.save(update_fields=['device_ids', 'updated_at'])
+            else:
+                ComplianceJob.objects.filter(id=job.id).update(rerun_requested=True)
+                job.rerun_requested = True
+            logging.info('Coalesced compliance recompute for %s %s into job %s', scope, scope_id, job.id)
+            return job
+
+        job = ComplianceJob.objects.create(
+            scope=scope,
+            scope_id=scope_id,
+            device_ids=_scope_device_ids(scope, scope_id),
+            created_by=user,
+        )
+
+    start_compliance_job(job)
+    return job
+
+
+def enqueue_devices_compliance_job(device_ids, user=None):
+    """
+    Schedule a compliance recompute for a set of devices (e.g. after a bulk ruleset assignment).
+
+    The devices are merged into a pending device-set job if there is one, otherwise a new
+    job is created. Returns the job.
+    """
+    from api.models import ComplianceJob  # Avoid circular import
+
+    device_ids = set(device_ids)
+    with transaction.atomic():
+        job = (
+            ComplianceJob.objects.select_for_update()
+            .filter(scope='devices', scope_id=0, status='pending')
+            .first()
+        )
+        if job is not None:
+            job.device_ids = sorted(device_ids.union(job.device_ids))
+            job.save(update_fields=['device_ids', 'updated_at'])
+            logging.info('Coalesced compliance recompute of %s devices into job %s', len(device_ids), job.id)
+            return job
+
+        job = ComplianceJob.objects.create(
+            scope='devices',
+            scope_id=0,
+            device_ids=sorted(device_ids),
+            created_by=user,
+        )
+
+    start_compliance_job(job)
+    return job
+
+
+def start_compliance_job(job):
+    """
+    Run a job in a background thread, or inline when COMPLIANCE_JOBS_INLINE is set. With
+    COMPLIANCE_JOBS_WORKER, jobs are left to the `resume_compliance_jobs --watch` service.
+    """
+    if settings.COMPLIANCE_JOBS_INLINE:
+        run_compliance_job(job.id)
+        job.refresh_from_db()
+        return
+    if settings.COMPLIANCE_JOBS_WORKER:
+        return
+
+    def run_in_thread():
+        try:
+            run_compliance_job(job.id)
+        finally:
+            # Threads get their own connection; don't leave it open once the job is done
+            connection.close()
+
+    # Start only once the job row is committed, so the thread can see it
+    transaction.on_commit(lambda: threading.Thread(
+        target=run_in_thread, name=f'compliance-job-{job.id}', daemon=True,
+    ).start())
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """
+    Refresh a running job's updated_at from a side thread, so a slow chunk is not taken for
+    an interrupted job; the heartbeat stops with the process running the job.
+    """
+    from api.models import ComplianceJob  # Avoid circular import
+
+    stop = threading.Event()
+    interval = max(1, settings.COMPLIANCE_JOB_STALE_SECONDS / 3)
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                ComplianceJob.objects.filter(id=job_id, status='running').update(updated_at=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'compliance-job-{job_id}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _run_claimed_job(job, chunk_size):
+    """Process a claimed job's devices, with one more pass per rerun requested meanwhile."""
+    from api.models import ComplianceJob, Device  # Avoid circular import
+
+    while True:
+        while job.cursor < job.total:
+            chunk = job.device_ids[job.cursor:job.cursor + chunk_size]
+            refreshed, skipped = refresh_devices_compliance(Device.objects.filter(id__in=chunk))
+            job.cursor += len(chunk)
+            job.refreshed += refreshed
+            job.skipped += skipped
+            job.save(update_fields=['cursor', 'refreshed', 'skipped', 'updated_at'])
+
+        # Done, unless the scope was edited again while this pass was running
+        finished = ComplianceJob.objects.filter(id=job.id, rerun_requested=False).update(
+            status='completed', finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        if finished:
+            return
+
+        job.device_ids = _scope_device_ids(job.scope, job.scope_id)
+        job.cursor = job.refreshed = job.skipped = 0
+        job.rerun_requested = False
+        job.started_at = timezone.now()
+        job.save(update_fields=[
+            'device_ids', 'cursor', 'refreshed', 'skipped', 'rerun_requested', 'started_at', 'updated_at',
+        ])
+
+
+def run_compliance_job(job_id):
+    """
+    Claim and process a compliance job chunk by chunk, resuming from its saved cursor.
+
+    A job can only be claimed while pending, or while running without a heartbeat for
+    COMPLIANCE_JOB_STALE_SECONDS (its worker died). Returns False if it could not be claimed.
+    """
+    from api.models import ComplianceJob  # Avoid circular import
+
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.COMPLIANCE_JOB_STALE_SECONDS)
+    claimed = ComplianceJob.objects.filter(id=job_id).filter(
+        Q(status='pending') | Q(status='running', updated_at__lt=stale_before)
+    ).update(status='running', updated_at=now)
+    if not claimed:
+        return False
+
+    job = ComplianceJob.objects.get(id=job_id)
+    if job.started_at is None:
+        job.started_at = now
+        job.save(update_fields=['started_at'])
+    chunk_size = settings.COMPLIANCE_JOB_CHUNK_SIZE
+
+    try:
+        with _heartbeat(job.id):
+            _run_claimed_job(job, chunk_size)
+    except Exception as e:
+        logging.error(f'Compliance job {job.id} failed: {e}', exc_info=True)
+        ComplianceJob.objects.filter(id=job.id).update(
+            status='failed', error=str(e), finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        return True
+    finally:
+        # A job evaluates many rules at once: make their timings visible without waiting
+        flush_rule_stats()
+
+    logging.info(
+        'Compliance job %s (%s %s) completed: %s refreshed, %s skipped',
+        job.id, job.scope, job.scope_id, job.refreshed, job.skipped,
+    )
+    return True
+
+
+def resumable_compliance_jobs():
+    """Return the jobs that were never started or whose worker stopped heartbeating."""
+    from api.models import ComplianceJob  # Avoid circular import
+
+    stale_before = timezone.now() - timedelta(seconds=settings.COMPLIANCE_JOB_STALE_SECONDS)
+    return ComplianceJob.objects.filter(
+        Q(status='pending') | Q(status='running', updated_at__lt=stale_before)
+    ).order_by('created_at')
+
+
+def resume_stale_compliance_jobs():
+    """
+    Start the jobs left behind by a worker that stopped (restart, recycled web worker) in
+    background threads of this process. Returns the jobs started.
+    """
+    if settings.COMPLIANCE_JOBS_INLINE or settings.COMPLIANCE_JOBS_WORKER:
+        return []
+    jobs = list(resumable_compliance_jobs())
+    for job in jobs:
+        logging.info('Resuming compliance job %s at %s/%s', job.id, job.cursor, job.total)
+        # Claiming is atomic: a job another process starts meanwhile is skipped
+        start_compliance_job(job)
+    return jobs
+
+
+_watchdog_started = False
+_watchdog_lock = threading.Lock()
+
+
+def start_compliance_job_watchdog():
+    """
+    Resume interrupted jobs from a background thread of this web worker: once when it
+    starts, then every COMPLIANCE_JOB_STALE_SECONDS, since a job interrupted by the
+    recycling of another worker only becomes stale after that delay. Started once per process.
+    """
+    global _watchdog_started
+
+    if settings.COMPLIANCE_JOBS_INLINE or settings.COMPLIANCE_JOBS_WORKER:
+        return
+    with _watchdog_lock:
+        if _watchdog_started:
+            return
+        _watchdog_started = True
+
+    def watch():
+        while True:
+            try:
+                resume_stale_compliance_jobs()
+            except Exception as e:
+                # E.g. the database is not migrated yet: try again at the next interval
+                logging.warning(f'Could not resume compliance jobs: {e}')
+            finally:
+                connection.close()
+            time.sleep(settings.COMPLIANCE_JOB_STALE_SECONDS)
+
+    threading.Thread(target=watch, name='compliance-job-watchdog', daemon=True).start()
+
+
+def compliance_job_status(job):
+    """Return a JSON-serializable progress summary of a job, including an ETA while running."""
+    done = job.cursor
+    total = job.total
+    eta_seconds = None
+    if job.status == 'running' and job.started_at and done:
+        elapsed = (timezone.now() - job.started_at).total_seconds()
+        eta_seconds = round(elapsed / done * (total - done), 1)
+
+    return {
+        'id': job.id,
+        'scope': job.scope,
+        'scope_id': job.scope_id,
+        'status': job.status,
+        'done': done,
+        'total': total,
+        'refreshed': job.refreshed,
+        'skipped': job.skipped,
+        'eta_seconds': eta_seconds,
+        'rerun_requested': job.rerun_requested,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
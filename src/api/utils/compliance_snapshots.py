@@ -0,0 +1,156 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+FLEET_SCOPE_ID = 0
+
+
+class _ScopeCounts:
+    """Running compliance counts of one scope."""
+
+    def __init__(self):
+        self.total = self.compliant = self.non_compliant = self.unknown = 0
+        self.hardening_sum = self.hardening_count = 0
+
+    def add(self, status, hardening_index):
+        self.total += 1
+        if status == 'pass':
+            self.compliant += 1
+        elif status == 'fail':
+            self.non_compliant += 1
+        else:
+            self.unknown += 1
+        if hardening_index is not None:
+            self.hardening_sum += hardening_index
+            self.hardening_count += 1
+
+    @property
+    def avg_hardening_index(self):
+        if not self.hardening_count:
+            return None
+        return round(self.hardening_sum / self.hardening_count, 1)
+
+
+def _ruleset_statuses(memberships):
+    """
+    Return {(device_id, ruleset_id): 'pass' | 'fail' | 'unknown'} from stored results,
+    the same way the ruleset detail page computes them.
+    """
+    from api.models import ComplianceResult, PolicyRuleset  # Avoid circular import
+
+    enabled_rule_counts = dict(
+        PolicyRuleset.objects.annotate(n=Count('rules', filter=Q(rules__enabled=True))).values_list('id', 'n')
+    )
+    # Per (device, ruleset): number of stored results of enabled rules, and how many passed
+    result_counts = {
+        (device_id, ruleset_id): (results, passed)
+        for device_id, ruleset_id, results, passed in ComplianceResult.objects.filter(
+            rule__enabled=True, rule__policyruleset__isnull=False,
+        ).values('device_id', 'rule__policyruleset').annotate(
+            results=Count('id'), passed=Count('id', filter=Q(passed=True)),
+        ).values_list('device_id', 'rule__policyruleset', 'results', 'passed').order_by()
+    }
+
+    statuses = {}
+    for device_id, ruleset_id in memberships:
+        results, passed = result_counts.get((device_id, ruleset_id), (0, 0))
+        if not enabled_rule_counts.get(ruleset_id):
+            statuses[(device_id, ruleset_id)] = 'pass'
+        elif passed < results:
+            statuses[(device_id, ruleset_id)] = 'fail'
+        elif results == enabled_rule_counts[ruleset_id]:
+            statuses[(device_id, ruleset_id)] = 'pass'
+        else:
+            statuses[(device_id, ruleset_id)] = 'unknown'
+    return statuses
+
+
+def take_compliance_snapshots(date=None):
+    """
+    Store today's (or the given date's) ComplianceSnapshot of the fleet and of every label,
+    ruleset and license from the current device state, replacing any taken earlier that day.
+
+    Devices without a ruleset count as unknown, like on the dashboard. Within a ruleset
+    scope a device is compliant when all the ruleset's enabled rules passed. Average
+    hardening indexes come from the report fact index. Returns the number of snapshots stored.
+    """
+    from api.models import ComplianceSnapshot, Device, Label, LicenseKey, PolicyRuleset, ReportFact  # Avoid circular import
+
+    date = date or timezone.localdate()
+    counts = defaultdict(_ScopeCounts)
+    # Scopes without devices get an empty snapshot, so charts have no gaps
+    counts[('fleet', FLEET_SCOPE_ID)]
+    for scope, model in (('label', Label), ('ruleset', PolicyRuleset), ('license', LicenseKey)):
+        for scope_id in model.objects.values_list('id', flat=True):
+            counts[(scope, scope_id)]
+
+    hardening = dict(
+        ReportFact.objects.filter(key='hardening_index', is_list=False, value_num__isnull=False)
+        .values_list('device_id', 'value_num')
+    )
+    ruleset_memberships = list(Device.rulesets.through.objects.values_list('device_id', 'policyruleset_id'))
+    assessed_device_ids = {device_id for device_id, _ in ruleset_memberships}
+    device_labels = defaultdict(list)
+    for device_id, label_id in Device.labels.through.objects.values_list('device_id', 'label_id'):
+        device_labels[device_id].append(label_id)
+
+    for device_id, compliant, license_id in Device.objects.values_list('id', 'compliant', 'licensekey_id').iterator(
+        chunk_size=settings.DB_ITERATOR_CHUNK_SIZE
+    ):
+        if device_id not in assessed_device_ids:
+            status = 'unknown'
+        else:
+            status = 'pass' if compliant else 'fail'
+        hardening_index = hardening.get(device_id)
+        counts[('fleet', FLEET_SCOPE_ID)].add(status, hardening_index)
+        counts[('license', license_id)].add(status, hardening_index)
+        for label_id in device_labels.get(device_id, ()):
+            counts[('label', label_id)].add(status, hardening_index)
+
+    for (device_id, ruleset_id), status in _ruleset_statuses(ruleset_memberships).items():
+        counts[('ruleset', ruleset_id)].add(status, hardening.get(device_id))
+
+    snapshots = [
+        ComplianceSnapshot(
+            date=date,
+            scope=scope,
+            scope_id=scope_id,
+            total=scope_counts.total,
+            compliant=scope_counts.compliant,
+            non_compliant=scope_counts.non_compliant,
+            unknown=scope_counts.unknown,
+            avg_hardening_index=scope_counts.avg_hardening_index,
+        )
+        for (scope, scope_id), scope_counts in counts.items()
+    ]
+    ComplianceSnapshot.objects.bulk_create(
+        snapshots,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['scope', 'scope_id', 'date'],
+        update_fields=['total', 'compliant', 'non_compliant', 'unknown', 'avg_hardening_index', 'updated_at'],
+    )
+    return len(snapshots)
+
+
+def compliance_trend(scope, scope_id=FLEET_SCOPE_ID, days=90):
+    """Return the daily snapshots of a scope over the last days, oldest first, as dicts."""
+    from api.models import ComplianceSnapshot  # Avoid circular import
+
+    since = timezone.localdate() - timedelta(days=days - 1)
+    points = []
+    for snapshot in ComplianceSnapshot.objects.filter(scope=scope, scope_id=scope_id, date__gte=since).order_by('date'):
+        assessed = snapshot.compliant + snapshot.non_compliant
+        points.append({
+            'date': snapshot.date.isoformat(),
+            'total': snapshot.total,
+            'compliant': snapshot.compliant,
+            'non_compliant': snapshot.non_compliant,
+            'unknown': snapshot.unknown,
+            'compliance_pct': round(snapshot.compliant * 100 / assessed) if assessed else None,
+            'avg_hardening_index': snapshot.avg_hardening_index,
+        })
+    return points
@@ -0,0 +1,235 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Value, When
+from django.utils import timezone
+
+# Sort parameter -> (Device field, whether the field sorts inversely to the column).
+# Each field has a composite (field, id) index so a page is read straight from the index.
+SORT_FIELDS = {
+    'hostname': ('hostname', False),
+    'os_version': ('distro', False),
+    'hardening_index': ('hardening_index', False),
+    'lynis_version': ('lynis_version', False),
+    'uptime': ('uptime_in_days', False),
+    'trikusec_plugin': ('trikusec_plugin_installed', False),
+    'antivirus': ('antivirus_installed', False),
+    'vulnerable_packages': ('vulnerable_packages_count', False),
+    # More days non-compliant means an earlier non_compliant_since
+    'non_compliant_days': ('non_compliant_since', True),
+    'compliant': ('compliance_status', False),
+    'warnings': ('warnings', False),
+    'last_update': ('last_update', False),
+}
+DEFAULT_SORT = 'last_update'
+
+# Sort fields annotated by device_list_queryset() rather than stored, with their type
+ANNOTATED_SORT_FIELDS = {'compliance_status': IntegerField()}
+
+# compliance_status values: devices without rulesets have no known compliance (compliant keeps
+# its default, True) and sort apart, below the non-compliant devices
+COMPLIANCE_UNKNOWN, COMPLIANCE_NON_COMPLIANT, COMPLIANCE_COMPLIANT = 0, 1, 2
+
+
+def _parse_bool_param(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+
+def _compliance_lookup(value):
+    if value == 'compliant':
+        return Q(has_rulesets=True, compliant=True)
+    if value == 'non_compliant':
+        return Q(has_rulesets=True, compliant=False)
+    if value == 'unknown':
+        return Q(has_rulesets=False)
+    raise ValueError(f'Invalid compliance status: {value}')
+
+
+# Filter parameter -> (label, function returning the Q object for a value; raises ValueError if invalid)
+COLUMN_FILTERS = {
+    'license': ('License', lambda value: Q(licensekey_id=int(value))),
+    'os': ('OS', lambda value: Q(os__iexact=value) | Q(distro__iexact=value)),
+    'compliance': ('Compliance', _compliance_lookup),
+    'plugin': ('Plugin installed', lambda value: Q(trikusec_plugin_installed=_parse_bool_param(value))),
+    'antivirus': ('Antivirus installed', lambda value: Q(antivirus_installed=_parse_bool_param(value))),
+    'vulnerable': (
+        'Vulnerable packages',
+        lambda value: Q(vulnerable_packages_count__gt=0) if _parse_bool_param(value) else Q(vulnerable_packages_count=0),
+    ),
+    'hardening_below': ('Hardening index below', lambda value: Q(hardening_index__lt=int(value))),
+    'uptime_over': ('Uptime over (days)', lambda value: Q(uptime_in_days__gt=int(value))),
+    'non_compliant_days_over': (
+        'Non-compliant for over (days)',
+        lambda value: Q(non_compliant_since__lt=timezone.now() - timedelta(days=int(value))),
+    ),
+}
+
+
+def device_list_queryset():
+    """
+    Return the devices of the device list, annotated with has_rulesets (False means compliance
+    is unknown) and compliance_status (see COMPLIANCE_UNKNOWN).
+    """
+    from api.models import Device  # Avoid circular import
+
+    assignments = Device.rulesets.through.objects.filter(device_id=OuterRef('pk'))
+    return Device.objects.annotate(has_rulesets=Exists(assignments)).annotate(
+        compliance_status=Case(
+            When(has_rulesets=False, then=Value(COMPLIANCE_UNKNOWN)),
+            When(compliant=False, then=Value(COMPLIANCE_NON_COMPLIANT)),
+            default=Value(COMPLIANCE_COMPLIANT),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def apply_column_filters(devices, params):
+    """
+    Filter a device queryset by the COLUMN_FILTERS present in params (e.g. request.GET).
+
+    Returns (devices, applied) where applied lists {'param', 'label', 'value'} of the filters
+    used; invalid values are ignored.
+    """
+    applied = []
+    for param, (label, lookup) in COLUMN_FILTERS.items():
+        value = (params.get(param) or '').strip()
+        if not value:
+            continue
+        try:
+            devices = devices.filter(lookup(value))
+        except (ValueError, TypeError):
+            continue
+        applied.append({'param': param, 'label': label, 'value': value})
+    return devices, applied
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or was issued for another sort order."""
+
+
+def encode_cursor(sort, order, device, direction):
+    """Return an opaque cursor for the page after (direction 'next') or before ('prev') a device."""
+    field, _ = SORT_FIELDS[sort]
+    value = getattr(device, field)
+    if isinstance(value, datetime):
+        # Keep microseconds (DjangoJSONEncoder rounds to milliseconds): the cursor must match exactly
+        value = value.isoformat()
+    payload = {'s': sort, 'o': order, 'd': direction, 'v': value, 'id': device.pk}
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, order):
+    """Return (direction, value, id) of a cursor issued for the given sort and order."""
+    from api.models import Device  # Avoid circular import
+
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(data)
+        if payload['s'] != sort or payload['o'] != order or payload['d'] not in ('next', 'prev'):
+            raise InvalidCursor('Cursor does not match the sort order')
+        field, _ = SORT_FIELDS[sort]
+        model_field = ANNOTATED_SORT_FIELDS.get(field) or Device._meta.get_field(field)
+        value = model_field.to_python(payload['v'])
+        return payload['d'], value, int(payload['id'])
+    except InvalidCursor:
+        raise
+    except (binascii.Error, ValueError, TypeError, KeyError, ValidationError) as e:
+        raise InvalidCursor(f'Invalid cursor: {e}')
+
+
+def _nullable(field):
+    from api.models import Device  # Avoid circular import
+
+    return field not in ANNOTATED_SORT_FIELDS and Device._meta.get_field(field).null
+
+
+def _ordering(field, descending):
+    # Devices without a value (e.g. no report yet) sort as the lowest values. This is the order
+    # of the (field, id) indexes read forwards or backwards (on PostgreSQL, those of nullable
+    # fields are created NULLS FIRST by migration 0050); other null orderings would sort in memory.
+    if not _nullable(field):
+        return [F(field).desc(), F('id').desc()] if descending else [F(field).asc(), F('id').asc()]
+    if descending:
+        return [F(field).desc(nulls_last=True), F('id').desc()]
+    return [F(field).asc(nulls_first=True), F('id').asc()]
+
+
+def _after(field, value, pk, descending):
+    """Q object selecting the rows following (value, pk) in the _ordering(field, descending) order."""
+    if descending:
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'id__lt': pk})
+        return (
+            Q(**{f'{field}__lt': value})
+            | Q(**{field: value, 'id__lt': pk})
+            | Q(**{f'{field}__isnull': True})
+        )
+    if value is None:
+        return Q(**{f'{field}__isnull': True, 'id__gt': pk}) | Q(**{f'{field}__isnull': False})
+    return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
+
+
+class KeysetPage:
+    """A page of a keyset-paginated device list."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(devices, sort, order, cursor, page_size):
+    """
+    Return the KeysetPage of a device queryset for a sort column, order ('asc'/'desc') and
+    cursor (None for the first page).
+
+    Only page_size + 1 rows are fetched: the extra row tells whether another page follows.
+    Raises InvalidCursor if the cursor cannot be used with this sort order.
+    """
+    field, inverse = SORT_FIELDS[sort]
+    descending = (order != 'asc') != inverse
+
+    direction, value, pk = 'next', None, None
+    if cursor:
+        direction, value, pk = decode_cursor(cursor, sort, order)
+
+    backwards = direction == 'prev'
+    # Going backwards reads the reversed order from the cursor, then flips the page
+    query_descending = descending != backwards
+    if pk is not None:
+        devices = devices.filter(_after(field, value, pk, query_descending))
+    rows = list(devices.order_by(*_ordering(field, query_descending))[:page_size + 1])
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    has_next = more if not backwards else True
+    has_previous = (pk is not None) if not backwards else more
+    next_cursor = encode_cursor(sort, order, rows[-1], 'next') if rows and has_next else None
+    previous_cursor = encode_cursor(sort, order, rows[0], 'prev') if rows and has_previous else None
+    return KeysetPage(rows, next_cursor, previous_cursor)
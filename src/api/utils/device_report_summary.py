@@ -0,0 +1,77 @@
+# Device columns derived from the latest report, stored at ingest so the device list can
+# sort and filter on them in SQL
+REPORT_SUMMARY_FIELDS = (
+    'hardening_index',
+    'uptime_in_days',
+    'trikusec_plugin_installed',
+    'antivirus_installed',
+    'vulnerable_packages_count',
+)
+
+KNOWN_ANTIVIRUS_PACKAGES = ('clamav', 'rkhunter', 'chkrootkit')
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def report_summary(parsed_report):
+    """Return the REPORT_SUMMARY_FIELDS values of a parsed report as a dict."""
+    summary = {
+        'hardening_index': None,
+        'uptime_in_days': None,
+        'trikusec_plugin_installed': False,
+        'antivirus_installed': False,
+        'vulnerable_packages_count': 0,
+    }
+    if not isinstance(parsed_report, dict):
+        return summary
+
+    summary['hardening_index'] = _int_or_none(parsed_report.get('hardening_index'))
+    summary['uptime_in_days'] = _int_or_none(parsed_report.get('uptime_in_days'))
+
+    installed_package_names = parsed_report.get('installed_package_names') or []
+    if not isinstance(installed_package_names, list):
+        installed_package_names = []
+    package_names = [pkg.lower() for pkg in installed_package_names if isinstance(pkg, str)]
+
+    summary['trikusec_plugin_installed'] = (
+        parsed_report.get('trikusec_custom_tests') in (1, '1', True)
+        or any('trikusec' in pkg and 'plugin' in pkg for pkg in package_names)
+    )
+
+    summary['antivirus_installed'] = (
+        parsed_report.get('malware_scanner_installed') in (1, '1', True)
+        or bool(parsed_report.get('clamav_version'))
+        or any(av_pkg in pkg for pkg in package_names for av_pkg in KNOWN_ANTIVIRUS_PACKAGES)
+    )
+
+    vulnerable_packages_found = parsed_report.get('vulnerable_packages_found')
+    if vulnerable_packages_found is None:
+        vulnerable_packages = parsed_report.get('vulnerable_package')
+        summary['vulnerable_packages_count'] = len(vulnerable_packages) if isinstance(vulnerable_packages, list) else 0
+    else:
+        summary['vulnerable_packages_count'] = _int_or_none(vulnerable_packages_found) or 0
+
+    return summary
+
+
+def apply_report_summary(device, parsed_report):
+    """Set the report summary columns of a device (unsaved) from its latest parsed report."""
+    for field, value in report_summary(parsed_report).items():
+        setattr(device, field, value)
+
+
+def store_report_summary(full_report):
+    """Store the report summary columns of a new latest report on its device."""
+    from api.models import Device  # Avoid circular import
+
+    summary = report_summary(full_report.get_parsed_report())
+    # Also update the caller's instance, which ingest saves again afterwards
+    for field, value in summary.items():
+        setattr(full_report.device, field, value)
+    # update() sends no post_save signal: only the device list reads these columns
+    Device.objects.filter(pk=full_report.device_id).update(**summary)
@@ -0,0 +1,158 @@
+import logging
+
+from django.db import DatabaseError, connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+# Maximum number of results returned for typeahead
+SEARCH_RESULT_LIMIT = 20
+
+# Device fields included in the search text (besides label names)
+SEARCH_SOURCE_FIELDS = frozenset((
+    'hostname', 'hostid', 'hostid2', 'ip_address', 'mac_address', 'os', 'distro', 'distro_version',
+))
+
+# SQLite FTS5 table indexing Device.search_text with trigrams (substring matching)
+FTS_TABLE = 'api_device_fts'
+_FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON api_device BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+    ),
+    f'{FTS_TABLE}_ad': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON api_device BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+    ),
+    f'{FTS_TABLE}_au': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_text ON api_device BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+    ),
+}
+# PostgreSQL trigram index serving LIKE '%term%' on Device.search_text
+TRIGRAM_INDEX = 'api_device_search_text_trgm'
+# Trigram indexes cannot serve shorter terms
+MIN_TRIGRAM_TERM_LENGTH = 3
+
+
+def device_search_text(device, label_names=None):
+    """Return the lowercased text a device is found by: identifiers, addresses, OS and label names."""
+    if label_names is None:
+        label_names = list(device.labels.values_list('name', flat=True)) if device.pk else []
+    values = [getattr(device, field) for field in sorted(SEARCH_SOURCE_FIELDS)] + list(label_names)
+    return ' '.join(str(value) for value in values if value).lower()
+
+
+def refresh_device_search_text(device_ids):
+    """Recompute the search text of the given devices (e.g. after their labels changed)."""
+    from api.models import Device  # Avoid circular import
+
+    devices = list(Device.objects.filter(id__in=list(device_ids)).prefetch_related('labels'))
+    for device in devices:
+        device.search_text = device_search_text(device, [label.name for label in device.labels.all()])
+    Device.objects.bulk_update(devices, ['search_text'], batch_size=500)
+
+
+def ensure_search_index(using=connection):
+    """
+    Create the database index used by device search if it is missing.
+
+    SQLite uses an FTS5 trigram table kept in sync by triggers. Rebuilding the device table
+    in a migration drops its triggers, so this runs after every migrate. PostgreSQL uses a
+    pg_trgm GIN index. Without either, search falls back to a (slower) substring scan.
+    """
+    try:
+        with using.cursor() as cursor:
+            columns = {column.name for column in using.introspection.get_table_description(cursor, 'api_device')}
+            if 'search_text' not in columns:
+                # Migrated to (or back to) a state before the column existed
+                drop_search_index(using)
+                return
+            if using.vendor == 'sqlite':
+                existing = {
+                    row[0] for row in cursor.execute(
+                        "SELECT name FROM sqlite_master WHERE name LIKE %s", [f'{FTS_TABLE}%'],
+                    ).fetchall()
+                }
+                if FTS_TABLE in existing and existing.issuperset(_FTS_TRIGGERS):
+                    return
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"search_text, content='api_device', content_rowid='id', tokenize='trigram')"
+                )
+                for statement in _FTS_TRIGGERS.values():
+                    cursor.execute(statement)
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            elif using.vendor == 'postgresql':
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON api_device USING gin (search_text gin_trgm_ops)'
+                )
+    except DatabaseError as e:
+        logging.warning('Device search index unavailable, falling back to substring scans: %s', e)
+
+
+def drop_search_index(using=connection):
+    """Drop the device search index (SQLite FTS table and triggers, or PostgreSQL trigram index)."""
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            for trigger in _FTS_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif using.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX}')
+
+
+def _fts_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def matching_devices(query, devices=None):
+    """
+    Return the devices (queryset) whose search text contains every whitespace-separated term
+    of the query, as a prefix or substring.
+    """
+    from api.models import Device  # Avoid circular import
+
+    devices = Device.objects.all() if devices is None else devices
+    terms = query.lower().split()
+    use_fts = bool(terms) and _fts_available()
+    for term in terms:
+        if use_fts and len(term) >= MIN_TRIGRAM_TERM_LENGTH:
+            phrase = '"{}"'.format(term.replace('"', '""'))
+            devices = devices.filter(id__in=RawSQL(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase],
+            ))
+        else:
+            # PostgreSQL serves this from the trigram index; short terms scan
+            devices = devices.filter(search_text__contains=term)
+    return devices
+
+
+def search_devices(query, devices=None, limit=SEARCH_RESULT_LIMIT):
+    """
+    Return up to limit devices matching a query for typeahead: exact hostname, IP or MAC
+    matches first, then prefix matches, then substring matches, each by hostname.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    rank = Case(
+        When(Q(hostname__iexact=query) | Q(ip_address=query) | Q(mac_address__iexact=query), then=Value(0)),
+        When(
+            Q(hostname__istartswith=query) | Q(ip_address__startswith=query) | Q(mac_address__istartswith=query),
+            then=Value(1),
+        ),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    return list(
+        matching_devices(query, devices)
+        .annotate(search_rank=rank)
+        .order_by('search_rank', 'hostname', 'id')
+        .prefetch_related('labels')[:limit]
+    )
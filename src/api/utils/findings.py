@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import Count, Min
+
+# Report list keys stored as findings, by finding type
+FINDING_REPORT_KEYS = {'warning': 'warning', 'suggestion': 'suggestion'}
+
+
+def extract_findings(parsed_report):
+    """Yield (finding_type, test_id, description) for the warning[] and suggestion[] entries of a parsed report."""
+    for finding_type, key in FINDING_REPORT_KEYS.items():
+        entries = parsed_report.get(key) or []
+        if not isinstance(entries, list):
+            continue
+        seen = set()
+        for entry in entries:
+            # Entries are parsed as [test_id, description, details, solution]
+            if not isinstance(entry, list) or len(entry) < 2:
+                continue
+            test_id, description = str(entry[0]), str(entry[1])
+            if test_id in seen:
+                continue
+            seen.add(test_id)
+            yield finding_type, test_id, description
+
+
+def store_report_findings(full_report):
+    """Replace the stored findings of a report's device with those of the report."""
+    from api.models import ReportFinding  # Avoid circular import
+
+    parsed_report = full_report.get_parsed_report()
+    findings = [
+        ReportFinding(
+            device_id=full_report.device_id,
+            report=full_report,
+            finding_type=finding_type,
+            test_id=test_id[:64],
+            description=description,
+        )
+        for finding_type, test_id, description in extract_findings(parsed_report if isinstance(parsed_report, dict) else {})
+    ]
+    with transaction.atomic():
+        ReportFinding.objects.filter(device_id=full_report.device_id).delete()
+        ReportFinding.objects.bulk_create(findings, batch_size=1000)
+    return len(findings)
+
+
+def top_findings(finding_type, limit=5, devices=None):
+    """
+    Return the findings of a type affecting the most devices, as
+    [{'test_id', 'description', 'count'}], optionally restricted to a Device queryset.
+    """
+    from api.models import ReportFinding  # Avoid circular import
+
+    findings = ReportFinding.objects.filter(finding_type=finding_type)
+    if devices is not None:
+        findings = findings.filter(device__in=devices)
+    return list(
+        findings.values('test_id')
+        .annotate(count=Count('device', distinct=True), description=Min('description'))
+        .order_by('-count', 'test_id')[:limit]
+    )
+
+
+def devices_with_finding(finding_type, test_id, devices=None):
+    """Return the devices (queryset) whose latest report has the given finding."""
+    from api.models import Device  # Avoid circular import
+
+    devices = Device.objects.all() if devices is None else devices
+    return devices.filter(findings__finding_type=finding_type, findings__test_id=test_id).distinct()
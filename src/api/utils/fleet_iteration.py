@@ -0,0 +1,20 @@
+from django.conf import settings
+
+
+def iter_chunks(queryset, chunk_size=None):
+    """
+    Yield the objects of a queryset in lists of up to chunk_size (DB_ITERATOR_CHUNK_SIZE).
+
+    Rows are streamed with QuerySet.iterator(), through a server-side cursor on PostgreSQL,
+    so fleet-wide loops hold one chunk in memory instead of the whole fleet. Prefetches of
+    the queryset run once per chunk.
+    """
+    chunk_size = chunk_size or settings.DB_ITERATOR_CHUNK_SIZE
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
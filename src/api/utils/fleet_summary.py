@@ -0,0 +1,201 @@
+"""
+Incrementally maintained fleet summary for the dashboard.
+
+Each device's contribution to FleetSummary (compliance status, hardening index, OS and
+warning count) is stored in FleetSummaryDevice. When a device changes, its new
+contribution is compared with the stored one and only the difference is applied, with
+atomic F() updates, to the FleetSummary singleton and the FleetOsCount rows.
+
+The summary is built from scratch the first time it is read (and by the
+rebuild_fleet_summary command); until then device changes are not tracked.
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .compliance import annotate_latest_report_id
+
+FLEET_SUMMARY_ID = 1
+
+# Sentinel: keep the hardening index stored for the device
+UNCHANGED = object()
+
+_SUMMARY_COUNTERS = ('total_devices', 'compliant', 'non_compliant', 'unknown', 'hardening_sum', 'hardening_count', 'warnings_total')
+
+
+def report_hardening_index(full_report):
+    """Return the hardening index of a FullReport as an int, or None."""
+    try:
+        return int(full_report.get_parsed_report().get('hardening_index'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _contribution(status, hardening_index, distro, distro_version, warnings):
+    return {
+        'status': status,
+        'hardening_index': hardening_index,
+        'distro': distro or '',
+        'distro_version': distro_version or '',
+        'warnings': warnings or 0,
+    }
+
+
+def _counters(contribution):
+    """Return the FleetSummary counters a contribution adds."""
+    counters = dict.fromkeys(_SUMMARY_COUNTERS, 0)
+    counters['total_devices'] = 1
+    counters[contribution['status']] = 1
+    if contribution['hardening_index'] is not None:
+        counters['hardening_sum'] = contribution['hardening_index']
+        counters['hardening_count'] = 1
+    counters['warnings_total'] = contribution['warnings']
+    return counters
+
+
+def _add_os_count(distro, distro_version, delta):
+    from api.models import FleetOsCount  # Avoid circular import
+
+    if not distro:
+        return
+    os_count, _ = FleetOsCount.objects.get_or_create(distro=distro, distro_version=distro_version)
+    FleetOsCount.objects.filter(id=os_count.id).update(count=F('count') + delta)
+
+
+def _apply(old, new):
+    """Replace contribution old by new (either may be None) in the summary tables."""
+    from api.models import FleetSummary  # Avoid circular import
+
+    old_counters = _counters(old) if old else dict.fromkeys(_SUMMARY_COUNTERS, 0)
+    new_counters = _counters(new) if new else dict.fromkeys(_SUMMARY_COUNTERS, 0)
+    deltas = {
+        field: F(field) + (new_counters[field] - old_counters[field])
+        for field in _SUMMARY_COUNTERS
+        if new_counters[field] != old_counters[field]
+    }
+    if deltas:
+        FleetSummary.objects.filter(id=FLEET_SUMMARY_ID).update(**deltas)
+
+    old_os = (old['distro'], old['distro_version']) if old else None
+    new_os = (new['distro'], new['distro_version']) if new else None
+    if old_os != new_os:
+        if old_os:
+            _add_os_count(*old_os, -1)
+        if new_os:
+            _add_os_count(*new_os, 1)
+
+
+def _summary_built():
+    from api.models import FleetSummary  # Avoid circular import
+
+    return FleetSummary.objects.filter(id=FLEET_SUMMARY_ID).exists()
+
+
+def sync_device_summary(device, hardening_index=UNCHANGED):
+    """
+    Bring the fleet summary up to date with the current state of a device.
+
+    hardening_index is the index of the device's latest report when it changed.
+    Costs a few queries, and writes only when the device's contribution changed.
+    """
+    from api.models import FleetSummaryDevice  # Avoid circular import
+
+    if not _summary_built():
+        return
+    with transaction.atomic():
+        entry = FleetSummaryDevice.objects.select_for_update().filter(device_id=device.pk).first()
+        old = None
+        if entry is not None:
+            old = _contribution(entry.status, entry.hardening_index, entry.distro, entry.distro_version, entry.warnings)
+        if hardening_index is UNCHANGED:
+            hardening_index = old['hardening_index'] if old else None
+
+        if not device.rulesets.exists():
+            status = 'unknown'
+        else:
+            status = 'compliant' if device.compliant else 'non_compliant'
+        new = _contribution(status, hardening_index, device.distro, device.distro_version, device.warnings)
+        if new == old:
+            return
+
+        _apply(old, new)
+        if entry is None:
+            FleetSummaryDevice.objects.create(device_id=device.pk, **new)
+        else:
+            FleetSummaryDevice.objects.filter(id=entry.id).update(**new)
+
+
+def remove_device_summary(device_id):
+    """Remove a (deleted) device's contribution from the fleet summary."""
+    from api.models import FleetSummaryDevice  # Avoid circular import
+
+    with transaction.atomic():
+        entry = FleetSummaryDevice.objects.select_for_update().filter(device_id=device_id).first()
+        if entry is None:
+            return
+        _apply(_contribution(entry.status, entry.hardening_index, entry.distro, entry.distro_version, entry.warnings), None)
+        entry.delete()
+
+
+def rebuild_fleet_summary():
+    """Recompute the fleet summary from all devices and their latest reports; returns it."""
+    from api.models import Device, FleetOsCount, FleetSummary, FleetSummaryDevice, FullReport  # Avoid circular import
+
+    assessed_device_ids = set(Device.rulesets.through.objects.values_list('device_id', flat=True))
+    latest_report_ids = annotate_latest_report_id(Device.objects.order_by()).values('latest_report_id')
+    hardening = {}
+    for report in FullReport.objects.filter(id__in=latest_report_ids).only('id', 'device_id', 'parsed_report', 'full_report').iterator(chunk_size=200):
+        hardening[report.device_id] = report_hardening_index(report)
+
+    entries = []
+    totals = Counter()
+    os_counts = Counter()
+    for device_id, compliant, distro, distro_version, warnings in Device.objects.values_list(
+        'id', 'compliant', 'distro', 'distro_version', 'warnings'
+    ).iterator(chunk_size=settings.DB_ITERATOR_CHUNK_SIZE):
+        if device_id not in assessed_device_ids:
+            status = 'unknown'
+        else:
+            status = 'compliant' if compliant else 'non_compliant'
+        contribution = _contribution(status, hardening.get(device_id), distro, distro_version, warnings)
+        entries.append(FleetSummaryDevice(device_id=device_id, **contribution))
+        totals.update(_counters(contribution))
+        if contribution['distro']:
+            os_counts[(contribution['distro'], contribution['distro_version'])] += 1
+
+    with transaction.atomic():
+        FleetSummaryDevice.objects.all().delete()
+        FleetOsCount.objects.all().delete()
+        FleetSummaryDevice.objects.bulk_create(entries, batch_size=1000)
+        FleetOsCount.objects.bulk_create(
+            [FleetOsCount(distro=distro, distro_version=version, count=count) for (distro, version), count in os_counts.items()],
+            batch_size=1000,
+        )
+        summary, _ = FleetSummary.objects.update_or_create(
+            id=FLEET_SUMMARY_ID, defaults={field: totals[field] for field in _SUMMARY_COUNTERS},
+        )
+    logging.info('Fleet summary rebuilt: %s devices', summary.total_devices)
+    return summary
+
+
+def get_fleet_summary():
+    """Return the FleetSummary singleton, building it on first use."""
+    from api.models import FleetSummary  # Avoid circular import
+
+    summary = FleetSummary.objects.filter(id=FLEET_SUMMARY_ID).first()
+    if summary is None:
+        summary = rebuild_fleet_summary()
+    return summary
+
+
+def fleet_os_distribution():
+    """Return [{'distro', 'distro_version', 'count'}] of the fleet, most common first."""
+    from api.models import FleetOsCount  # Avoid circular import
+
+    return list(
+        FleetOsCount.objects.filter(count__gt=0).order_by('-count', 'distro', 'distro_version')
+        .values('distro', 'distro_version', 'count')
+    )
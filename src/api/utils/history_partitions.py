@@ -0,0 +1,496 @@
+"""
+Monthly partitions of the history tables (DiffReport, DeviceEvent) by created_at.
+
+History grows with every report and is read by time (the activity feed, a device's
+changelog), so its rows are stored per month and expire by dropping a whole month: one
+DROP TABLE instead of deleting the rows one by one.
+
+- PostgreSQL: the tables are partitioned (PARTITION BY RANGE), with one partition per month
+  and a DEFAULT partition for the rows outside them. Queries bounded by created_at only scan
+  the partitions of their range.
+- SQLite, which has no partitioning: each month is a table of its own and the model's table
+  is a view over them (UNION ALL, each branch bounded to its month), written through
+  INSTEAD OF triggers routing rows to their month. A created_at bound turns the branches of
+  the other months into empty index range scans. The view cannot generate ids, so they are
+  allocated from a one-row counter table (see assign_history_ids).
+
+Partitions are created in advance (HISTORY_PARTITIONS_AHEAD) after migrations and by
+`manage.py maintain_history_partitions`, which also drops those older than
+HISTORY_RETENTION_MONTHS. Migrations change the schema of these models as usual:
+PostgreSQL applies the changes to every partition, and on SQLite the schema editor merges
+the months into a plain table around them (see trikusec.db.sqlite3.schema).
+
+The latest history is read month range by month range, newest first (see latest_history),
+so that only the partitions holding it are read.
+"""
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+HISTORY_TABLES = ('api_diffreport', 'api_deviceevent')
+HISTORY_MODELS = ('DiffReport', 'DeviceEvent')
+DEFAULT_PARTITION_SUFFIX = '_pdefault'
+# SQLite: one-row table holding the last id allocated for a history table
+ID_COUNTER_SUFFIX = '_ids'
+
+CREATE_TABLE_RE = re.compile(r'^CREATE TABLE\s+("[^"]+"|\S+)', re.IGNORECASE)
+CREATE_INDEX_RE = re.compile(r'^(CREATE (?:UNIQUE )?INDEX\s+)("[^"]+"|\S+)(\s+ON\s+)("[^"]+"|\S+)', re.IGNORECASE)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month(now=None):
+    return month_start((now or timezone.now()).astimezone(dt_timezone.utc))
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def _month_of(value):
+    """Month of a created_at value read with a raw cursor (UTC text on SQLite)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc)
+    return month_start(value)
+
+
+def _month_range(first, last):
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+def is_partitioned(table, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid)', [table])
+            row = cursor.fetchone()
+            return row is not None and row[0] == 'p'
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT type FROM sqlite_master WHERE name = %s', [table])
+            row = cursor.fetchone()
+            return row is not None and row[0] == 'view'
+    return False
+
+
+def partition_months(table, using=DEFAULT_DB_ALIAS):
+    """Return the months of the table's monthly partitions, oldest first."""
+    connection = connections[using]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass',
+                [table],
+            )
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s", [f'{table}_p%'])
+        names = [row[0] for row in cursor.fetchall()]
+    pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})(\d{{2}})$')
+    matches = [pattern.match(name) for name in names]
+    return sorted(date(int(match[1]), int(match[2]), 1) for match in matches if match)
+
+
+def _month_datetime(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def latest_history(queryset, limit, now=None):
+    """
+    Return the latest limit rows of a queryset of a history model, newest first.
+
+    Rows are read back from the current month over ranges of 1, 2, 4... months, stopping
+    when limit rows are found, so that the partitions of older months are not read. Rows
+    older than the oldest partition (in the DEFAULT partition) are read last.
+    """
+    months = partition_months(queryset.model._meta.db_table, queryset.db)
+    this_month = current_month(now)
+    oldest = min(months[0], this_month) if months else this_month
+    queryset = queryset.order_by('-created_at')
+    # The first range also holds the partitions created ahead and later rows
+    start, end, span = this_month, None, 1
+    rows = []
+    while True:
+        window = queryset.filter(created_at__gte=_month_datetime(start))
+        if end is not None:
+            window = window.filter(created_at__lt=_month_datetime(end))
+        rows += window[:limit - len(rows)]
+        if len(rows) >= limit:
+            return rows
+        if start <= oldest:
+            return rows + list(queryset.filter(created_at__lt=_month_datetime(start))[:limit - len(rows)])
+        span *= 2
+        start, end = max(add_months(start, -span), oldest), start
+
+
+def partition_tables(using=DEFAULT_DB_ALIAS):
+    """Return the names of the partitions of the partitioned history tables."""
+    names = []
+    for table in HISTORY_TABLES:
+        if is_partitioned(table, using):
+            names += [partition_name(table, month) for month in partition_months(table, using)]
+            names.append(table + DEFAULT_PARTITION_SUFFIX)
+    return names
+
+
+def assign_history_ids(objs, using=DEFAULT_DB_ALIAS):
+    """
+    Give unsaved rows of a history table their id. Only needed on SQLite, where the rows are
+    inserted through a view; on PostgreSQL the partitioned table generates them.
+    """
+    objs = [obj for obj in objs if obj.pk is None]
+    connection = connections[using]
+    if not objs or connection.vendor != 'sqlite':
+        return
+    counter = _quote(objs[0]._meta.db_table + ID_COUNTER_SUFFIX)
+    allocate = f'UPDATE {counter} SET "last_id" = "last_id" + %s'
+    if connection.features.can_return_columns_from_insert:
+        # SQLite 3.35+: a single statement
+        with connection.cursor() as cursor:
+            cursor.execute(f'{allocate} RETURNING "last_id"', [len(objs)])
+            last_id = cursor.fetchone()[0]
+    else:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(allocate, [len(objs)])
+            cursor.execute(f'SELECT "last_id" FROM {counter}')
+            last_id = cursor.fetchone()[0]
+    first_id = last_id - len(objs) + 1
+    for offset, obj in enumerate(objs):
+        obj.pk = first_id + offset
+
+
+# SQLite: monthly tables behind a view
+
+def _sqlite_bound(month):
+    # Django stores datetimes as UTC text on SQLite
+    return f"'{month:%Y-%m-%d} 00:00:00'"
+
+
+def _sqlite_month_condition(column, month):
+    return f'{column} >= {_sqlite_bound(month)} AND {column} < {_sqlite_bound(add_months(month, 1))}'
+
+
+def _sqlite_default_condition(column, months):
+    """Rows of the DEFAULT partition: outside the (contiguous) months, or without created_at."""
+    if not months:
+        return '1'
+    return (
+        f'{column} IS NULL OR {column} < {_sqlite_bound(months[0])} '
+        f'OR {column} >= {_sqlite_bound(add_months(months[-1], 1))}'
+    )
+
+
+def _sqlite_index_base(table, index_name):
+    """Name of an index of the model's table, from the name of its copy on a partition."""
+    prefix = f'{table}__'
+    return index_name[len(prefix):] if index_name.startswith(prefix) else index_name
+
+
+def _sqlite_create_like(cursor, source, name, index_name):
+    """Create table name with the columns, constraints and indexes (renamed by index_name) of source."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [source])
+    cursor.execute(CREATE_TABLE_RE.sub(lambda m: f'CREATE TABLE {_quote(name)}', cursor.fetchone()[0], count=1))
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", [source]
+    )
+    for source_index, index_sql in cursor.fetchall():
+        cursor.execute(CREATE_INDEX_RE.sub(
+            lambda m: f'{m[1]}{_quote(index_name(source_index))}{m[3]}{_quote(name)}', index_sql, count=1,
+        ))
+
+
+def _sqlite_create_partition(cursor, table, source, month):
+    name = partition_name(table, month)
+    _sqlite_create_like(cursor, source, name, lambda index: f'{name}__{_sqlite_index_base(source, index)}')
+    return name
+
+
+def _sqlite_rebuild_view(cursor, table):
+    """(Re)create the view over the table's partitions and the triggers writing through it."""
+    default = table + DEFAULT_PARTITION_SUFFIX
+    months = partition_months(table, cursor.db.alias)
+    partitions = [(partition_name(table, month), _sqlite_month_condition('NEW."created_at"', month)) for month in months]
+    partitions.append((default, _sqlite_default_condition('NEW."created_at"', months)))
+    cursor.execute(f'PRAGMA table_info({_quote(default)})')
+    columns = [row[1] for row in cursor.fetchall()]
+    column_list = ', '.join(_quote(column) for column in columns)
+    counter = _quote(table + ID_COUNTER_SUFFIX)
+
+    def route(id_value):
+        values = ', '.join(id_value if column == 'id' else f'NEW.{_quote(column)}' for column in columns)
+        return ''.join(
+            f'INSERT INTO {_quote(name)} ({column_list}) SELECT {values} WHERE {condition}; '
+            for name, condition in partitions
+        )
+
+    new_id = f'COALESCE(NEW."id", (SELECT "last_id" FROM {counter}))'
+
+    # Dropping the view drops its triggers
+    cursor.execute(f'DROP VIEW IF EXISTS {_quote(table)}')
+    branches = [
+        f'SELECT * FROM {_quote(partition_name(table, month))} WHERE {_sqlite_month_condition(_quote("created_at"), month)}'
+        for month in months
+    ]
+    branches.append(f'SELECT * FROM {_quote(default)}')
+    cursor.execute(f'CREATE VIEW {_quote(table)} AS ' + ' UNION ALL '.join(branches))
+    # Rows without an id get the next one; explicit ids move the counter past them
+    cursor.execute(
+        f'CREATE TRIGGER {_quote(table + "_insert")} INSTEAD OF INSERT ON {_quote(table)} BEGIN '
+        f'UPDATE {counter} SET "last_id" = MAX("last_id", COALESCE(NEW."id", "last_id" + 1)); '
+        f'{route(new_id)}END'
+    )
+    # A row may change month: delete it and insert it again (two changes per row, see
+    # trikusec.db.sqlite3.base)
+    reinsert = route('NEW."id"')
+    delete_old = ''.join(f'DELETE FROM {_quote(name)} WHERE "id" = OLD."id"; ' for name, _ in partitions)
+    cursor.execute(
+        f'CREATE TRIGGER {_quote(table + "_update")} INSTEAD OF UPDATE ON {_quote(table)} BEGIN '
+        f'{delete_old}{reinsert}END'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER {_quote(table + "_delete")} INSTEAD OF DELETE ON {_quote(table)} BEGIN {delete_old}END'
+    )
+
+
+def sqlite_partition(cursor, table, months):
+    """Split table into the partitions of months and a DEFAULT partition, behind a view."""
+    default = table + DEFAULT_PARTITION_SUFFIX
+    _sqlite_create_like(cursor, table, default, lambda index: f'{default}__{index}')
+    for month in months:
+        name = _sqlite_create_partition(cursor, table, table, month)
+        cursor.execute(f'INSERT INTO {_quote(name)} SELECT * FROM {_quote(table)} WHERE {_sqlite_month_condition(_quote("created_at"), month)}')
+    cursor.execute(
+        f'INSERT INTO {_quote(default)} SELECT * FROM {_quote(table)} '
+        f'WHERE {_sqlite_default_condition(_quote("created_at"), months)}'
+    )
+    # AUTOINCREMENT never reuses the ids of deleted rows: neither does the counter
+    cursor.execute(
+        f'SELECT MAX(COALESCE((SELECT MAX("id") FROM {_quote(table)}), 0), '
+        'COALESCE((SELECT "seq" FROM sqlite_sequence WHERE "name" = %s), 0))',
+        [table],
+    )
+    last_id = cursor.fetchone()[0]
+    counter = _quote(table + ID_COUNTER_SUFFIX)
+    cursor.execute(
+        f'CREATE TABLE {counter} ("id" integer NOT NULL PRIMARY KEY CHECK ("id" = 1), "last_id" integer NOT NULL)'
+    )
+    cursor.execute(f'INSERT INTO {counter} ("id", "last_id") VALUES (1, %s)', [last_id])
+    cursor.execute(f'DROP TABLE {_quote(table)}')
+    _sqlite_rebuild_view(cursor, table)
+
+
+def sqlite_unpartition(cursor, table):
+    """Merge the partitions behind the table's view back into a plain table."""
+    default = table + DEFAULT_PARTITION_SUFFIX
+    partitions = [partition_name(table, month) for month in partition_months(table, cursor.db.alias)] + [default]
+    cursor.execute(f'DROP VIEW {_quote(table)}')
+    _sqlite_create_like(cursor, default, table, lambda index: _sqlite_index_base(default, index))
+    for name in partitions:
+        cursor.execute(f'INSERT INTO {_quote(table)} SELECT * FROM {_quote(name)}')
+        cursor.execute(f'DROP TABLE {_quote(name)}')
+    # Ids allocated by the counter are not reused by AUTOINCREMENT either
+    counter = _quote(table + ID_COUNTER_SUFFIX)
+    cursor.execute('DELETE FROM sqlite_sequence WHERE "name" = %s', [table])
+    cursor.execute(
+        f'INSERT INTO sqlite_sequence ("name", "seq") SELECT %s, MAX("last_id", '
+        f'COALESCE((SELECT MAX("id") FROM {_quote(table)}), 0)) FROM {counter}',
+        [table],
+    )
+    cursor.execute(f'DROP TABLE {counter}')
+
+
+def _sqlite_add_partitions(cursor, table, months):
+    default = table + DEFAULT_PARTITION_SUFFIX
+    for month in months:
+        name = _sqlite_create_partition(cursor, table, default, month)
+        # Rows of the month stored in the DEFAULT partition move to their own
+        condition = _sqlite_month_condition(_quote('created_at'), month)
+        cursor.execute(f'INSERT INTO {_quote(name)} SELECT * FROM {_quote(default)} WHERE {condition}')
+        cursor.execute(f'DELETE FROM {_quote(default)} WHERE {condition}')
+    _sqlite_rebuild_view(cursor, table)
+
+
+# PostgreSQL: declarative partitioning
+
+def _postgres_bound(month):
+    return f"'{month:%Y-%m-%d} 00:00:00+00:00'"
+
+
+def _postgres_add_partition(cursor, table, month):
+    name = partition_name(table, month)
+    default = table + DEFAULT_PARTITION_SUFFIX
+    cursor.execute(f'CREATE TABLE {_quote(name)} (LIKE {_quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # Rows of the month stored in the DEFAULT partition move to their own; attaching the
+    # partition creates its indexes and foreign keys
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {_quote(default)} WHERE "created_at" >= {_postgres_bound(month)} '
+        f'AND "created_at" < {_postgres_bound(add_months(month, 1))} RETURNING *) '
+        f'INSERT INTO {_quote(name)} SELECT * FROM moved'
+    )
+    cursor.execute(
+        f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(name)} '
+        f'FOR VALUES FROM ({_postgres_bound(month)}) TO ({_postgres_bound(add_months(month, 1))})'
+    )
+    return name
+
+
+def _postgres_last_id(cursor, table):
+    cursor.execute(f'SELECT COALESCE(MAX("id"), 0) FROM {_quote(table)}')
+    last_id = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    if sequence:
+        cursor.execute(f'SELECT last_value FROM {sequence}')
+        last_id = max(last_id, cursor.fetchone()[0])
+    return last_id
+
+
+def _postgres_rebuild_table(cursor, schema_editor, model, partition_months_=None):
+    """
+    Replace the model's table by a copy that is partitioned by month (or, without
+    partition_months_, not partitioned), with the same rows, ids, indexes and foreign keys.
+    """
+    table = model._meta.db_table
+    old = f'{table}_old'
+    cursor.execute(f'ALTER TABLE {_quote(table)} RENAME TO {_quote(old)}')
+    if partition_months_ is None:
+        cursor.execute(f'CREATE TABLE {_quote(table)} (LIKE {_quote(old)})')
+    else:
+        cursor.execute(f'CREATE TABLE {_quote(table)} (LIKE {_quote(old)}) PARTITION BY RANGE ("created_at")')
+        cursor.execute(f'CREATE TABLE {_quote(table + DEFAULT_PARTITION_SUFFIX)} PARTITION OF {_quote(table)} DEFAULT')
+        for month in partition_months_:
+            _postgres_add_partition(cursor, table, month)
+    cursor.execute(f'INSERT INTO {_quote(table)} SELECT * FROM {_quote(old)}')
+    last_id = _postgres_last_id(cursor, old)
+    # Also drops the old partitions and id sequence, and frees the index and constraint names
+    cursor.execute(f'DROP TABLE {_quote(old)}')
+
+    sequence = f'{table}_id_seq'
+    cursor.execute(f'CREATE SEQUENCE {_quote(sequence)} START WITH {last_id + 1}')
+    cursor.execute(f"ALTER TABLE {_quote(table)} ALTER COLUMN \"id\" SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f'ALTER SEQUENCE {_quote(sequence)} OWNED BY {_quote(table)}."id"')
+    # The partition key must be part of the primary key of a partitioned table
+    primary_key = '"id"' if partition_months_ is None else '"id", "created_at"'
+    cursor.execute(f'ALTER TABLE {_quote(table)} ADD PRIMARY KEY ({primary_key})')
+    for statement in schema_editor._model_indexes_sql(model):
+        cursor.execute(str(statement))
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            cursor.execute(str(schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s')))
+
+
+# Migration and maintenance
+
+def partition_history_tables(apps, schema_editor):
+    """Migration: move the rows of the history tables into monthly partitions."""
+    connection = schema_editor.connection
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    this_month = current_month()
+    last = add_months(this_month, settings.HISTORY_PARTITIONS_AHEAD)
+    with connection.cursor() as cursor:
+        for model_name in HISTORY_MODELS:
+            model = apps.get_model('api', model_name)
+            table = model._meta.db_table
+            cursor.execute(f'SELECT MIN("created_at") FROM {_quote(table)}')
+            oldest = cursor.fetchone()[0]
+            months = _month_range(min(_month_of(oldest), this_month) if oldest else this_month, last)
+            if connection.vendor == 'postgresql':
+                _postgres_rebuild_table(cursor, schema_editor, model, months)
+            else:
+                sqlite_partition(cursor, table, months)
+
+
+def unpartition_history_tables(apps, schema_editor):
+    """Migration (reverse): merge the partitions of the history tables back into plain tables."""
+    connection = schema_editor.connection
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    with connection.cursor() as cursor:
+        for model_name in HISTORY_MODELS:
+            model = apps.get_model('api', model_name)
+            if connection.vendor == 'postgresql':
+                _postgres_rebuild_table(cursor, schema_editor, model)
+            else:
+                sqlite_unpartition(cursor, model._meta.db_table)
+
+
+def ensure_partitions(using=DEFAULT_DB_ALIAS, months_ahead=None, now=None):
+    """
+    Create the missing monthly partitions, up to months_ahead months after the current one.
+    Returns the names of the created partitions.
+    """
+    months_ahead = settings.HISTORY_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    last = add_months(current_month(now), months_ahead)
+    connection = connections[using]
+    created = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for table in HISTORY_TABLES:
+            if not is_partitioned(table, using):
+                continue
+            existing = partition_months(table, using)
+            # Extend the existing months without gaps
+            months = _month_range(add_months(existing[-1], 1) if existing else current_month(now), last)
+            if not months:
+                continue
+            if connection.vendor == 'postgresql':
+                for month in months:
+                    _postgres_add_partition(cursor, table, month)
+            else:
+                _sqlite_add_partitions(cursor, table, months)
+            created += [partition_name(table, month) for month in months]
+    return created
+
+
+def drop_expired_partitions(retention_months=None, using=DEFAULT_DB_ALIAS, now=None):
+    """
+    Drop the partitions of the months more than retention_months before the current one (none
+    when it is 0), and delete the rows of the DEFAULT partition older than those months.
+    Returns the names of the dropped partitions.
+    """
+    retention_months = settings.HISTORY_RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(current_month(now), -retention_months)
+    connection = connections[using]
+    bound = _postgres_bound(cutoff) if connection.vendor == 'postgresql' else _sqlite_bound(cutoff)
+    dropped = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for table in HISTORY_TABLES:
+            if not is_partitioned(table, using):
+                continue
+            expired = [partition_name(table, month) for month in partition_months(table, using) if month < cutoff]
+            if expired and connection.vendor == 'postgresql':
+                # Rows written earlier in the transaction have deferred foreign key checks,
+                # which would prevent dropping their partition
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for name in expired:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(f'ALTER TABLE {_quote(table)} DETACH PARTITION {_quote(name)}')
+                cursor.execute(f'DROP TABLE {_quote(name)}')
+            cursor.execute(f'DELETE FROM {_quote(table + DEFAULT_PARTITION_SUFFIX)} WHERE "created_at" < {bound}')
+            if expired and connection.vendor == 'sqlite':
+                _sqlite_rebuild_view(cursor, table)
+            dropped += expired
+    return dropped
@@ -0,0 +1,241 @@
+import logging
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+
+from .license_utils import check_license_capacity
+from .lynis_report import LynisReport
+
+
+class IngestError(Exception):
+    """A report could not be stored; status is the HTTP status to answer the upload with."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def ingest_report(licensekey, post_hostid, post_hostid2, report_data, report=None):
+    """
+    Store an uploaded report: identify (or enroll) its device, store the diff with the
+    previous report and the report itself, update the device and its compliance.
+
+    licensekey is the validated LicenseKey and report the LynisReport of report_data (parsed
+    again if not given). Returns the device; raises IngestError if the report can't be stored.
+    """
+    from api.models import Device, DeviceEvent, DiffReport, FullReport  # Avoid circular import
+
+    if report is None:
+        report = LynisReport(report_data)
+
+    # Extract all 5 identifiers for device matching
+    primary_ips = report.get('primary_ipv4_addresses') or []
+    primary_ip = primary_ips[0] if isinstance(primary_ips, list) and len(primary_ips) > 0 and primary_ips[0] != '-' else None
+
+    candidate_identifiers = {
+        'hostid': post_hostid,
+        'hostid2': post_hostid2,
+        'hostname': report.get('hostname'),
+        'ip_address': primary_ip,
+        'mac_address': report.get('primary_mac_address'),
+    }
+
+    logging.debug(f'Device identification factors: {candidate_identifiers}')
+
+    # 5-Factor Device Identification Algorithm
+    # Find candidate devices that match ANY single identifier (scoped by license key)
+    try:
+        q_objects = Q()
+        if candidate_identifiers['hostid']:
+            q_objects |= Q(hostid=candidate_identifiers['hostid'])
+        if candidate_identifiers['hostid2']:
+            q_objects |= Q(hostid2=candidate_identifiers['hostid2'])
+        if candidate_identifiers['hostname']:
+            q_objects |= Q(hostname=candidate_identifiers['hostname'])
+        if candidate_identifiers['ip_address']:
+            q_objects |= Q(ip_address=candidate_identifiers['ip_address'])
+        if candidate_identifiers['mac_address']:
+            q_objects |= Q(mac_address=candidate_identifiers['mac_address'])
+
+        # Get all candidate devices (matching any identifier, same license)
+        candidates = Device.objects.filter(licensekey=licensekey).filter(q_objects).distinct()
+
+        # Score each candidate device by counting matching factors
+        best_device = None
+        best_score = 0
+
+        for candidate in candidates:
+            score = 0
+            if candidate_identifiers['hostid'] and candidate.hostid == candidate_identifiers['hostid']:
+                score += 1
+            if candidate_identifiers['hostid2'] and candidate.hostid2 == candidate_identifiers['hostid2']:
+                score += 1
+            if candidate_identifiers['hostname'] and candidate.hostname == candidate_identifiers['hostname']:
+                score += 1
+            if candidate_identifiers['ip_address'] and candidate.ip_address == candidate_identifiers['ip_address']:
+                score += 1
+            if candidate_identifiers['mac_address'] and candidate.mac_address == candidate_identifiers['mac_address']:
+                score += 1
+
+            logging.debug(f'Candidate device {candidate.id} ({candidate.hostname or candidate.hostid}): score {score}/5')
+
+            if score > best_score:
+                best_score = score
+                best_device = candidate
+
+        # Decision: Match if score >= 2 (at least 2 factors coincide)
+        created = False
+        license_changed = False
+
+        if best_score >= 2:
+            device = best_device
+            created = False
+            logging.info(f'Device identified with score {best_score}/5. Device ID: {device.id}, Hostname: {device.hostname or device.hostid}')
+
+            # Check if license changed (shouldn't happen since we filter by licensekey, but keep for safety)
+            old_license = device.licensekey
+            if old_license != licensekey:
+                license_changed = True
+                # Check license capacity before allowing license change
+                has_capacity, capacity_error = check_license_capacity(licensekey.licensekey)
+                if not has_capacity:
+                    logging.error(f'License capacity check failed: {capacity_error}')
+                    raise IngestError(capacity_error or 'License has reached maximum device limit', 403)
+        else:
+            # New device - no match found (score < 2)
+            created = True
+            logging.info(f'No matching device found (best score: {best_score}/5). Creating new device.')
+
+            # Check license capacity before creating
+            has_capacity, capacity_error = check_license_capacity(licensekey.licensekey)
+            if not has_capacity:
+                logging.error(f'License capacity check failed: {capacity_error}')
+                raise IngestError(capacity_error or 'License has reached maximum device limit', 403)
+
+            # Create the new device
+            hostname = candidate_identifiers['hostname'] or None
+            ip_address = candidate_identifiers['ip_address'] if candidate_identifiers['ip_address'] and candidate_identifiers['ip_address'] != '-' else None
+            mac_address = candidate_identifiers['mac_address'] if candidate_identifiers['mac_address'] and candidate_identifiers['mac_address'] != '-' else None
+            device = Device.objects.create(
+                hostid=post_hostid,
+                hostid2=post_hostid2,
+                licensekey=licensekey,
+                hostname=hostname,
+                ip_address=ip_address,
+                mac_address=mac_address
+            )
+            DeviceEvent.objects.create(device=device, event_type='enrolled')
+
+        # Handle license change event
+        if license_changed:
+            DeviceEvent.objects.create(
+                device=device,
+                event_type='license_changed',
+                metadata={
+                    'old_license': old_license.licensekey if old_license else None,
+                    'old_license_name': old_license.name if old_license else None,
+                    'new_license': licensekey.licensekey,
+                    'new_license_name': licensekey.name,
+                }
+            )
+
+    except DatabaseError as e:
+        logging.error(f'Database error creating/retrieving device: {e}')
+        raise IngestError('Database error while processing device')
+
+    try:
+        latest_full_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
+    except DatabaseError as e:
+        logging.error(f'Database error retrieving previous report: {e}')
+        raise IngestError('Database error while retrieving previous report')
+
+    diff_data = None
+    if latest_full_report:
+        # Generate the diff and save it
+        try:
+            latest_lynis = LynisReport(latest_full_report.full_report)
+            # Don't filter at diff creation time - filter only at display time
+            # This ensures all activities are stored and can be shown/hidden based on current rule state
+            # Filtering happens in the activity view (frontend/views.py) based on active silence rules
+
+            # Generate structured diff (without ignore_keys - store all activities)
+            diff_data = latest_lynis.compare_reports(report_data, [])
+            # Store hostname to preserve it even if device is deleted
+            hostname = device.hostname or candidate_identifiers['hostname'] or device.hostid
+            DiffReport.objects.create(device=device, hostname=hostname, diff_report=diff_data)
+            logging.info(f'Diff created for device {post_hostid}')
+            logging.debug('Changed items: %s', diff_data)
+        except DatabaseError as e:
+            logging.error(f'Database error creating diff report: {e}')
+            raise IngestError('Database error while creating diff report')
+    else:
+        logging.info(f'No previous reports found for device {post_hostid}')
+
+    # Save the new full report
+    try:
+        full_report = FullReport.objects.create(
+            device=device, full_report=report_data, parsed_report=report.get_parsed_report(),
+        )
+    except DatabaseError as e:
+        logging.error(f'Database error saving full report: {e}')
+        raise IngestError('Database error while saving report')
+
+    # Update device information with latest values from report
+    try:
+        device.licensekey = licensekey
+        # Update HostIDs in case they changed (e.g., re-enrollment)
+        device.hostid = post_hostid
+        device.hostid2 = post_hostid2
+        # Update all identifiers
+        if candidate_identifiers['hostname']:
+            device.hostname = candidate_identifiers['hostname']
+        if candidate_identifiers['ip_address'] and candidate_identifiers['ip_address'] != '-':
+            device.ip_address = candidate_identifiers['ip_address']
+        if candidate_identifiers['mac_address'] and candidate_identifiers['mac_address'] != '-':
+            device.mac_address = candidate_identifiers['mac_address']
+        # Update other device attributes
+        device.os = report.get('os')
+        device.distro = report.get('os_fullname')
+        device.distro_version = report.get('os_version')
+        device.lynis_version = report.get('lynis_version')
+        device.last_update = report.get('report_datetime_end')
+        device.warnings = report.get('warning_count')
+        device.save()
+    except DatabaseError as e:
+        logging.error(f'Database error updating device: {e}')
+        raise IngestError('Database error while updating device')
+
+    # Check compliance and generate events if status changed
+    try:
+        from api.utils.compliance import update_device_compliance, report_diff_keys
+        # Only rules reading keys that changed since the previous report are re-evaluated
+        changed_keys = report_diff_keys(diff_data) if diff_data is not None else None
+        update_device_compliance(
+            device, report.get_parsed_report(), full_report,
+            previous_report=latest_full_report, changed_keys=changed_keys,
+        )
+    except DatabaseError:
+        # Inside a transaction (the ingest writer's) the error aborted it: let the caller
+        # roll the report back and retry it rather than commit it half stored
+        if transaction.get_connection().in_atomic_block:
+            raise
+        logging.exception('Database error checking device compliance')
+    except Exception as e:
+        # Log but don't fail the upload if compliance check fails
+        logging.error(f'Error checking device compliance: {e}')
+
+    # Index the report's scalar values so simple rules can be evaluated fleet-wide in SQL
+    try:
+        from api.utils.report_index import index_report_facts
+        index_report_facts(device, report.get_parsed_report())
+    except DatabaseError:
+        if transaction.get_connection().in_atomic_block:
+            raise
+        logging.exception('Database error indexing report facts')
+    except Exception as e:
+        # Log but don't fail the upload; reindex_reports can rebuild the index
+        logging.error(f'Error indexing report facts: {e}')
+
+    logging.info(f'Device updated: {device.hostname or device.hostid}')
+    return device
@@ -0,0 +1,206 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, transaction
+
+from .ingest import IngestError, ingest_report
+
+INGEST_MODES = ('direct', 'funnel')
+# Spooled reports the writer could not store for good (unknown license, license full)
+REJECTED_DIR = 'rejected'
+LOCK_FILE = '.writer.lock'
+
+
+class WriterBusy(Exception):
+    """Another ingest writer holds the spool lock."""
+
+
+def ingest_mode():
+    mode = settings.INGEST_MODE
+    if mode not in INGEST_MODES:
+        raise ImproperlyConfigured(f'TRIKUSEC_INGEST_MODE must be one of {", ".join(INGEST_MODES)}')
+    return mode
+
+
+def _spool_name(due_ns, report_id, attempts):
+    """File name of a spooled report: '<due time>-<id>.json', plus '.<failed attempts>' once retried."""
+    suffix = f'.{attempts}' if attempts else ''
+    return f'{due_ns:020d}-{report_id}{suffix}.json'
+
+
+def _parse_spool_name(name):
+    """Return (due time in ns, id, failed attempts) of a spool file name."""
+    due, _, rest = name[:-len('.json')].partition('-')
+    report_id, _, attempts = rest.partition('.')
+    return int(due), report_id, int(attempts or 0)
+
+
+def spool_report(licensekey, post_hostid, post_hostid2, report_data):
+    """
+    Queue a validated report for the ingest writer. Files are named by arrival time, so the
+    writer stores reports in upload order, and renamed into place once complete.
+    """
+    spool_dir = settings.INGEST_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    payload = {
+        'licensekey': licensekey,
+        'hostid': post_hostid,
+        'hostid2': post_hostid2,
+        'report': report_data,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=spool_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        path = os.path.join(spool_dir, _spool_name(time.time_ns(), uuid.uuid4().hex, 0))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def _spool_names():
+    try:
+        return sorted(name for name in os.listdir(settings.INGEST_SPOOL_DIR) if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+
+
+def pending_reports(limit=None):
+    """
+    Return the spooled report files that are due, oldest first. A retried report is due again
+    once its backoff has passed, so it doesn't hold back the reports queued behind it.
+    """
+    now_ns = time.time_ns()
+    names = [name for name in _spool_names() if _parse_spool_name(name)[0] <= now_ns]
+    if limit is not None:
+        names = names[:limit]
+    return [os.path.join(settings.INGEST_SPOOL_DIR, name) for name in names]
+
+
+def spool_stats():
+    """
+    Return the number of reports waiting for the writer, how many of them are waiting for a
+    retry, and the age of the oldest due report, in seconds.
+    """
+    names = _spool_names()
+    spooled = [_parse_spool_name(name) for name in names]
+    now_ns = time.time_ns()
+    due = [due_ns for due_ns, _, _ in spooled if due_ns <= now_ns]
+    oldest = round((now_ns - due[0]) / 1e9, 1) if due else 0.0
+    return {
+        'pending': len(spooled),
+        'retrying': sum(1 for _, _, attempts in spooled if attempts),
+        'oldest_seconds': oldest,
+    }
+
+
+@contextmanager
+def writer_lock():
+    """Hold the spool's writer lock; raises WriterBusy if another writer has it."""
+    os.makedirs(settings.INGEST_SPOOL_DIR, exist_ok=True)
+    with open(os.path.join(settings.INGEST_SPOOL_DIR, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise WriterBusy('Another ingest writer is running')
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _reject(path, reason):
+    logging.error('Rejected spooled report %s: %s', os.path.basename(path), reason)
+    rejected_dir = os.path.join(settings.INGEST_SPOOL_DIR, REJECTED_DIR)
+    os.makedirs(rejected_dir, exist_ok=True)
+    os.replace(path, os.path.join(rejected_dir, os.path.basename(path)))
+
+
+def _retry_later(path, reason):
+    """
+    Give a spooled report that failed another attempt after a backoff (doubling from
+    settings.INGEST_RETRY_DELAY seconds), or reject it after settings.INGEST_MAX_ATTEMPTS.
+    Returns False if the report was rejected.
+    """
+    directory, name = os.path.split(path)
+    _, report_id, attempts = _parse_spool_name(name)
+    attempts += 1
+    if attempts >= settings.INGEST_MAX_ATTEMPTS:
+        _reject(path, f'failed {attempts} times, last error: {reason}')
+        return False
+    delay = settings.INGEST_RETRY_DELAY * 2 ** (attempts - 1)
+    due_ns = time.time_ns() + int(delay * 1e9)
+    os.replace(path, os.path.join(directory, _spool_name(due_ns, report_id, attempts)))
+    return True
+
+
+def process_batch(batch_size):
+    """
+    Store up to batch_size spooled reports in one transaction (one savepoint per report) and
+    remove their files once it commits. Must run under writer_lock().
+
+    Reports that fail with a database or unexpected error stay in the spool and are retried
+    after a backoff, until settings.INGEST_MAX_ATTEMPTS; reports that can never be stored are
+    moved to the rejected directory. Returns (stored, rejected, retried).
+    """
+    from api.models import LicenseKey  # Avoid circular import
+
+    paths = pending_reports(batch_size)
+    if not paths:
+        return 0, 0, 0
+
+    done, rejected, retried = [], [], []
+    with transaction.atomic():
+        licenses = {}
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    payload = json.load(f)
+            except (OSError, ValueError) as e:
+                rejected.append((path, f'unreadable spool file: {e}'))
+                continue
+
+            key = payload.get('licensekey')
+            if key not in licenses:
+                licenses[key] = LicenseKey.objects.filter(licensekey=key, is_active=True).first()
+            if licenses[key] is None:
+                rejected.append((path, 'license key is no longer valid'))
+                continue
+
+            try:
+                with transaction.atomic():
+                    ingest_report(licenses[key], payload.get('hostid'), payload.get('hostid2'), payload.get('report'))
+                    # A database error caught and logged on the way (e.g. by a signal handler)
+                    # leaves the savepoint to be rolled back: the report was not stored
+                    if transaction.get_rollback():
+                        raise DatabaseError('The report transaction was aborted by an earlier error')
+            except IngestError as e:
+                if e.status >= 500:
+                    retried.append((path, e.message))
+                else:
+                    rejected.append((path, e.message))
+                continue
+            except Exception as e:
+                logging.error(f'Error storing spooled report {os.path.basename(path)}: {e}')
+                retried.append((path, str(e)))
+                continue
+            done.append(path)
+
+    # The reports are committed: drop their files. A crash before this point replays the
+    # whole batch, so delivery is at least once.
+    for path in done:
+        os.unlink(path)
+    for path, reason in rejected:
+        _reject(path, reason)
+    given_up = [path for path, reason in retried if not _retry_later(path, reason)]
+    return len(done), len(rejected) + len(given_up), len(retried) - len(given_up)
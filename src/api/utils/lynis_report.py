@@ -349,16 +349,18 @@ class LynisReport:
 
     def _add_days_since_audit_variable(self) -> None:
         """Add days_since_audit key calculated from report_datetime_end."""
-        report_end = self.get('report_datetime_end')
+        self.set('days_since_audit', self.days_since_audit(self.get('report_datetime_end')))
+
+    @classmethod
+    def days_since_audit(cls, report_end: Any) -> Any:
+        """Return the number of days elapsed since report_end (datetime or string), or None."""
         if not report_end:
-            self.set('days_since_audit', None)
-            return
+            return None
 
-        parsed_end = self._parse_report_datetime(report_end)
+        parsed_end = cls._parse_report_datetime(report_end)
 
         if not parsed_end:
-            self.set('days_since_audit', None)
-            return
+            return None
 
         now = timezone.now()
 
@@ -371,9 +373,10 @@ class LynisReport:
         days = diff.days
         if diff.total_seconds() < 0:
             days = 0
-        self.set('days_since_audit', days)
+        return days
 
-    def _parse_report_datetime(self, value: Any) -> Any:
+    @staticmethod
+    def _parse_report_datetime(value: Any) -> Any:
         """Parse report datetime strings into datetime objects."""
         if isinstance(value, datetime):
             return value
@@ -1,39 +1,185 @@
 import jmespath
 import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
 
-def evaluate_query(report, query):
+# Maximum number of compiled JMESPath expressions kept per process
+COMPILED_QUERY_CACHE_SIZE = 1024
+
+
+class CompiledQueryCache:
     """
-    Evaluate a JMESPath query against a report to determine if a device is compliant with a policy.
-    
-    Args:
-        report: Dictionary containing parsed Lynis report data
-        query: JMESPath query expression (e.g., "hardening_index > `70`", "os == 'Linux'")
-    
+    Bounded, thread-safe LRU cache of compiled JMESPath expressions keyed by query string.
+
+    Compiling a JMESPath expression means lexing and parsing it into an AST, which is far
+    more expensive than running it against a report. Rules are evaluated for every device
+    on every upload and page view, so each process keeps the compiled expressions around.
+    """
+
+    def __init__(self, maxsize=COMPILED_QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        """Return the compiled expression for the query, compiling it on a cache miss.
+
+        Raises jmespath.exceptions.JMESPathError if the query is invalid.
+        """
+        with self._lock:
+            expression = self._entries.get(query)
+            if expression is not None:
+                self._entries.move_to_end(query)
+                return expression
+
+        # Compile outside the lock; a concurrent compile of the same query is harmless
+        expression = jmespath.compile(query)
+
+        with self._lock:
+            self._entries[query] = expression
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return expression
+
+    def discard(self, query):
+        """Drop a query from the cache (no-op if it is not cached)."""
+        with self._lock:
+            self._entries.pop(query, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, query):
+        with self._lock:
+            return query in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+compiled_query_cache = CompiledQueryCache()
+
+
+def compile_query(query):
+    """
+    Return the compiled JMESPath expression for a query, using the per-process cache.
+
+    Raises jmespath.exceptions.JMESPathError if the query is invalid.
+    """
+    return compiled_query_cache.get(query)
+
+
+def discard_compiled_query(query):
+    """Invalidate the cached compiled expression for a query."""
+    if query:
+        compiled_query_cache.discard(query)
+
+
+# Report keys computed relative to the current time rather than from the report contents:
+# rules reading them can change outcome even when the report itself did not change.
+VOLATILE_REPORT_KEYS = frozenset({'days_since_audit'})
+
+# AST nodes whose first child is evaluated against the current value and whose remaining
+# children are evaluated against the result (or each element of it)
+_CHAINED_NODE_TYPES = {'subexpression', 'index_expression', 'pipe', 'projection', 'value_projection', 'filter_projection'}
+
+
+def _collect_root_fields(node, at_root, fields):
+    """Collect the report keys read by an AST node; return False if it reads the whole report."""
+    node_type = node.get('type')
+
+    if node_type in ('current', 'identity'):
+        # "@" at the top level hands the entire report to the expression
+        return not at_root
+    if node_type == 'field':
+        if at_root:
+            fields.add(node['value'])
+        return True
+    if node_type == 'expref':
+        # &expr is applied to elements by sort_by(), max_by(), ... never to the report itself
+        return _collect_root_fields(node['children'][0], False, fields)
+
+    children = node.get('children', [])
+    if node_type in _CHAINED_NODE_TYPES:
+        if not children:
+            return True
+        if not _collect_root_fields(children[0], at_root, fields):
+            return False
+        return all(_collect_root_fields(child, False, fields) for child in children[1:])
+
+    # Comparators, boolean operators, function arguments, multi-selects, flatten, ...
+    # evaluate their children against the current value
+    return all(_collect_root_fields(child, at_root, fields) for child in children)
+
+
+@lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def extract_query_fields(query):
+    """
+    Return the top-level report keys a JMESPath query reads, from its parsed AST.
+
+    Returns a frozenset of key names, or None if the query can read any key (e.g. it
+    passes "@" to a function at the top level) or is invalid.
+    """
+    try:
+        ast = compile_query(query).parsed
+    except jmespath.exceptions.JMESPathError:
+        return None
+
+    fields = set()
+    if not _collect_root_fields(ast, True, fields):
+        return None
+    return frozenset(fields)
+
+
+def run_query(report, query):
+    """
+    Evaluate a JMESPath query against a report, returning the outcome and any error message.
+
     Returns:
-        bool: True if query matches, False if it doesn't, None if evaluation failed
+        tuple: (result, error) where result is True/False, or None if evaluation failed,
+        in which case error describes the failure
     """
     try:
-        # Compile the JMESPath expression
-        expression = jmespath.compile(query)
-        
+        # Get the compiled JMESPath expression (cached per process)
+        expression = compile_query(query)
+
         # Execute the query against the report
         result = expression.search(report)
-        
+
         # JMESPath returns the query result; convert to boolean
         # For boolean expressions, result will be True/False
         # For other expressions, convert truthy/falsy to bool
         if isinstance(result, bool):
-            return result
-        
+            return result, None
+
         # Convert truthy/falsy values to boolean
         # None, empty strings, 0, empty lists are False
         # Everything else is True
-        return bool(result)
-        
+        return bool(result), None
+
     except jmespath.exceptions.JMESPathError as e:
         logging.error(f'Invalid JMESPath query "{query}": {e}')
-        return None
+        return None, f'Invalid JMESPath query: {e}'
     except Exception as e:
         logging.error(f'Unexpected error evaluating query "{query}": {e}', exc_info=True)
-        return None
+        return None, f'Error evaluating query: {e}'
+
+
+def evaluate_query(report, query):
+    """
+    Evaluate a JMESPath query against a report to determine if a device is compliant with a policy.
+
+    Args:
+        report: Dictionary containing parsed Lynis report data
+        query: JMESPath query expression (e.g., "hardening_index > `70`", "os == 'Linux'")
+
+    Returns:
+        bool: True if query matches, False if it doesn't, None if evaluation failed
+    """
+    result, _ = run_query(report, query)
+    return result
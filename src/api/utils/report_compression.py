@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for TRIKUSEC_REPORT_COMPRESSION=zstd
+    zstandard = None
+
+COMPRESSION_METHODS = ('none', 'zlib', 'zstd')
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 10
+# zlib only uses the last 32KB of a dictionary
+ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+@lru_cache(maxsize=4)
+def _load_dictionary(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()[:16]
+
+
+def _dictionary():
+    """Return (bytes, id) of the configured dictionary, or (None, '')."""
+    path = settings.REPORT_COMPRESSION_DICTIONARY
+    if not path:
+        return None, ''
+    return _load_dictionary(path)
+
+
+# Ids of the dictionaries this process has copied to the database
+_stored_dictionary_ids = set()
+
+
+def _store_dictionary(dictionary, dictionary_id):
+    """Copy a dictionary to the database, so that its reports stay readable once it is replaced."""
+    if dictionary_id in _stored_dictionary_ids:
+        return
+    from api.models import ReportCompressionDictionary  # Avoid circular import
+
+    ReportCompressionDictionary.objects.get_or_create(dictionary_id=dictionary_id, defaults={'data': dictionary})
+    # Not remembered before the row is committed: a rollback would discard it
+    transaction.on_commit(lambda: _stored_dictionary_ids.add(dictionary_id))
+
+
+@lru_cache(maxsize=8)
+def _stored_dictionary(dictionary_id):
+    from api.models import ReportCompressionDictionary  # Avoid circular import
+
+    data = ReportCompressionDictionary.objects.filter(dictionary_id=dictionary_id).values_list('data', flat=True).first()
+    if data is None:
+        raise ImproperlyConfigured(
+            f'Report was compressed with dictionary {dictionary_id}, which is not stored in the database; '
+            'set TRIKUSEC_REPORT_COMPRESSION_DICTIONARY to that dictionary file'
+        )
+    return bytes(data)
+
+
+def _dictionary_by_id(dictionary_id):
+    """Return the bytes of the dictionary with an id: the configured one or a replaced one."""
+    dictionary, configured_id = _dictionary()
+    if dictionary_id == configured_id:
+        return dictionary
+    return _stored_dictionary(dictionary_id)
+
+
+def compression_method():
+    """Return the configured compression method, falling back to zlib when zstandard is missing."""
+    method = settings.REPORT_COMPRESSION
+    if method not in COMPRESSION_METHODS:
+        raise ImproperlyConfigured(f'TRIKUSEC_REPORT_COMPRESSION must be one of {", ".join(COMPRESSION_METHODS)}')
+    if method == 'zstd' and zstandard is None:
+        logging.warning('zstandard is not installed, compressing reports with zlib')
+        return 'zlib'
+    return method
+
+
+def format_name(method, dictionary_id=''):
+    """Return the body format of a method and dictionary id, e.g. 'zlib' or 'zstd:<dictionary id>'."""
+    return f'{method}:{dictionary_id}' if dictionary_id else method
+
+
+def parse_format(body_format):
+    """Return the (method, dictionary id) of a body format."""
+    method, _, dictionary_id = body_format.partition(':')
+    return method, dictionary_id
+
+
+def target_format():
+    """Return the body format new reports are stored with."""
+    method = compression_method()
+    if method == 'none':
+        return 'none'
+    return format_name(method, _dictionary()[1])
+
+
+def compress_report(text):
+    """Return the (body format, bytes) of a report body with the configured compression."""
+    method = compression_method()
+    data = text.encode('utf-8')
+    if method == 'none':
+        return 'none', data
+    dictionary, dictionary_id = _dictionary()
+    if dictionary:
+        _store_dictionary(dictionary, dictionary_id)
+    if method == 'zstd':
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+        compressed = compressor.compress(data) + compressor.flush()
+    return format_name(method, dictionary_id), compressed
+
+
+def decompress_report(body_format, data):
+    """Return the report body of stored bytes in a body format ('none' for plain reports)."""
+    method, dictionary_id = parse_format(body_format)
+    data = bytes(data)
+    if method == 'none':
+        return data.decode('utf-8')
+    if method not in COMPRESSION_METHODS:
+        raise ValueError(f'Unknown report body format "{body_format}"')
+    dictionary = _dictionary_by_id(dictionary_id) if dictionary_id else None
+    if method == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('The zstandard package is required to read zstd-compressed reports')
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data).decode('utf-8')
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+
+def train_dictionary(samples, size=ZLIB_MAX_DICTIONARY_SIZE, method=None):
+    """
+    Build a shared compression dictionary from sample report bodies.
+
+    zstd trains a dictionary with zstandard. For zlib the dictionary is the report lines
+    that are most common across samples, the most common last (zlib favours close matches).
+    """
+    method = method or compression_method()
+    if method == 'zstd':
+        return zstandard.train_dictionary(size, [sample.encode('utf-8') for sample in samples]).as_bytes()
+
+    size = min(size, ZLIB_MAX_DICTIONARY_SIZE)
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(sample.splitlines(keepends=True)))
+    lines = []
+    total = 0
+    for line, count in counts.most_common():
+        if count < 2:
+            break
+        encoded = line.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        lines.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(lines))
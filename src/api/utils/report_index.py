@@ -0,0 +1,206 @@
+"""
+Fleet fact index: scalar report values stored as rows so simple rules run as SQL.
+
+At ingest the scalar values of a device's latest parsed report (and the elements of a
+few known list keys) are written to ReportFact. compile_query_to_q() translates the
+subset of JMESPath made of comparisons against literals, &&, || and !, and contains()
+on indexed lists, into Device filters built from EXISTS subqueries over that table.
+Queries outside the subset return None and are evaluated in Python as before.
+
+Evaluating a query can fail for some reports (e.g. ordering a string against a number),
+so each translated expression is a pair of filters: the devices for which it is truthy,
+and the devices for which evaluating it raises an error.
+"""
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .policy_query import VOLATILE_REPORT_KEYS, compile_query
+
+# List keys whose elements are indexed, for contains(<key>, <literal>)
+INDEXED_LIST_KEYS = frozenset({'installed_package_names'})
+
+# Longest string value indexed (ReportFact.value_str); rule queries are shorter anyway
+MAX_INDEXED_STRING_LENGTH = 255
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# JMESPath comparator -> Django lookup, and the lookup to use when operands are swapped
+_ORDERING_LOOKUPS = {'lt': 'lt', 'lte': 'lte', 'gt': 'gt', 'gte': 'gte'}
+_SWAPPED_COMPARATORS = {'lt': 'gt', 'lte': 'gte', 'gt': 'lt', 'gte': 'lte', 'eq': 'eq', 'ne': 'ne'}
+
+
+def _fact_value(value):
+    """Return (value_num, value_str) for an indexable scalar, or None if it isn't indexable."""
+    # bool is an int subclass but compares differently in JMESPath; reports don't contain them
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        if _INT64_MIN <= value <= _INT64_MAX:
+            return value, None
+        return None
+    if isinstance(value, str) and len(value) <= MAX_INDEXED_STRING_LENGTH:
+        return None, value
+    return None
+
+
+def extract_report_facts(parsed_report):
+    """Yield (key, value_num, value_str, is_list) tuples for the indexable values of a parsed report."""
+    for key, value in parsed_report.items():
+        if key in VOLATILE_REPORT_KEYS:
+            # Time-dependent: always evaluated in Python
+            continue
+        if isinstance(value, list):
+            if key not in INDEXED_LIST_KEYS:
+                continue
+            # Marks the list as present, even when empty
+            yield key, None, None, True
+            for element in set(v for v in value if isinstance(v, (int, str))):
+                fact = _fact_value(element)
+                if fact is not None:
+                    yield key, fact[0], fact[1], True
+        else:
+            fact = _fact_value(value)
+            if fact is not None:
+                yield key, fact[0], fact[1], False
+
+
+def index_report_facts(device, parsed_report):
+    """Replace the stored facts of a device with those of its latest parsed report."""
+    from api.models import ReportFact  # Avoid circular import
+
+    # Index the values as stored in FullReport.parsed_report (e.g. datetimes as ISO strings),
+    # which is what rules are evaluated against when reports are read back
+    parsed_report = json.loads(json.dumps(parsed_report or {}, cls=DjangoJSONEncoder))
+    facts = [
+        ReportFact(device=device, key=key, value_num=value_num, value_str=value_str, is_list=is_list)
+        for key, value_num, value_str, is_list in extract_report_facts(parsed_report)
+    ]
+    with transaction.atomic():
+        ReportFact.objects.filter(device=device).delete()
+        ReportFact.objects.bulk_create(facts, batch_size=1000)
+    return len(facts)
+
+
+class _NotTranslatable(Exception):
+    pass
+
+
+# Filters matching no device, for expressions that can't fail
+_NEVER = Q(pk__in=[])
+
+
+def _facts(**lookups):
+    from api.models import ReportFact  # Avoid circular import
+
+    return Q(Exists(ReportFact.objects.filter(device=OuterRef('pk'), **lookups)))
+
+
+def _value_lookup(value):
+    fact = _fact_value(value)
+    if fact is None:
+        raise _NotTranslatable(f'literal {value!r} is not indexable')
+    value_num, value_str = fact
+    return {'value_num': value_num} if value_str is None else {'value_str': value_str}
+
+
+def _field_name(node):
+    if node['type'] != 'field' or node['value'] in VOLATILE_REPORT_KEYS:
+        raise _NotTranslatable('operand is not an indexed report key')
+    return node['value']
+
+
+def _literal_value(node):
+    if node['type'] != 'literal':
+        raise _NotTranslatable('operand is not a literal')
+    return node['value']
+
+
+def _translate_comparator(node):
+    left, right = node['children']
+    comparator = node['value']
+    if left['type'] == 'literal' and right['type'] == 'field':
+        left, right = right, left
+        comparator = _SWAPPED_COMPARATORS[comparator]
+    key = _field_name(left)
+    value = _literal_value(right)
+
+    if comparator in ('eq', 'ne'):
+        # Only scalar facts can equal a scalar literal; a missing key is "not equal"
+        matches = _facts(key=key, is_list=False, **_value_lookup(value))
+        return (matches if comparator == 'eq' else ~matches), _NEVER
+
+    # Ordering a number against a string raises; against anything else (missing key,
+    # list, ...) it yields null
+    if isinstance(value, bool) or not isinstance(value, int) or _fact_value(value) is None:
+        raise _NotTranslatable('ordering comparisons need an integer literal')
+    lookup = f'value_num__{_ORDERING_LOOKUPS[comparator]}'
+    matches = _facts(key=key, is_list=False, value_num__isnull=False, **{lookup: value})
+    return matches, _facts(key=key, is_list=False, value_str__isnull=False)
+
+
+def _translate(node):
+    """Return (truthy, error) Device filters for an AST node, following JMESPath short-circuiting."""
+    node_type = node['type']
+    if node_type == 'comparator':
+        return _translate_comparator(node)
+    if node_type == 'and_expression':
+        left, left_error = _translate(node['children'][0])
+        right, right_error = _translate(node['children'][1])
+        return left & right, left_error | (left & right_error)
+    if node_type == 'or_expression':
+        left, left_error = _translate(node['children'][0])
+        right, right_error = _translate(node['children'][1])
+        return left | (~left_error & right), left_error | (~left & ~left_error & right_error)
+    if node_type == 'not_expression':
+        operand, error = _translate(node['children'][0])
+        return ~operand & ~error, error
+    if node_type == 'function_expression' and node['value'] == 'contains':
+        subject, search = node['children']
+        key = _field_name(subject)
+        if key not in INDEXED_LIST_KEYS:
+            raise _NotTranslatable(f'{key} is not an indexed list')
+        matches = _facts(key=key, is_list=True, **_value_lookup(_literal_value(search)))
+        # contains() on a missing key raises an invalid type error
+        return matches, ~_facts(key=key, is_list=True)
+    raise _NotTranslatable(f'{node_type} is not supported')
+
+
+def compile_query_to_q(query):
+    """
+    Translate a JMESPath rule query into Device filters over the fact table.
+
+    Returns (matches, errors): the devices for which the query is truthy and those for
+    which evaluating it fails. Returns None if the query uses anything outside the
+    supported subset (it must then be evaluated in Python).
+    Raises jmespath.exceptions.JMESPathError if the query is invalid.
+    """
+    ast = compile_query(query).parsed
+    try:
+        return _translate(ast)
+    except _NotTranslatable as e:
+        logging.debug('Query "%s" not translatable to SQL: %s', query, e)
+        return None
+
+
+def indexed_devices(devices):
+    """Restrict a Device queryset to devices whose latest report has been indexed."""
+    from api.models import ReportFact  # Avoid circular import
+
+    return devices.filter(Exists(ReportFact.objects.filter(device=OuterRef('pk'))))
+
+
+def matching_devices(query, devices):
+    """
+    Return the indexed devices of a queryset for which a query is truthy, using a single
+    SQL query, or None if the query can't be translated.
+    """
+    translated = compile_query_to_q(query)
+    if translated is None:
+        return None
+    matches, _ = translated
+    return indexed_devices(devices).filter(matches)
@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .report_compression import compress_report, decompress_report, target_format
+
+STORAGE_BACKENDS = ('database', 'filesystem')
+# Body format of reports kept in the blob store, whose database value is the SHA-256 hex digest
+BLOB_FORMAT = 'blob'
+DIGEST_RE = re.compile(r'[0-9a-f]{64}')
+
+
+def storage_backend():
+    backend = settings.REPORT_STORAGE
+    if backend not in STORAGE_BACKENDS:
+        raise ImproperlyConfigured(f'TRIKUSEC_REPORT_STORAGE must be one of {", ".join(STORAGE_BACKENDS)}')
+    return backend
+
+
+def blob_path(digest):
+    """
+    Return the file of a blob, sharded in two directory levels by the first bytes of its hash.
+    Raises ValueError if digest is not a SHA-256 hex digest.
+    """
+    if not isinstance(digest, str) or not DIGEST_RE.fullmatch(digest):
+        raise ValueError(f'Invalid report blob digest: {digest!r}')
+    return os.path.join(settings.REPORT_BLOB_DIR, digest[:2], digest[2:4], digest)
+
+
+def write_blob(text):
+    """
+    Store a report body in the blob store and return its SHA-256 hex digest.
+
+    Identical bodies share one file. Files are written to a temporary name and renamed, so
+    a reader never sees a partial file.
+    """
+    data = text.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    else:
+        # Refresh the mtime so the garbage collector's grace period covers this new reference
+        os.utime(path)
+    return digest
+
+
+def read_blob(digest):
+    """Return the report body of a blob, memory-mapping the file."""
+    path = blob_path(digest)
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data[:].decode('utf-8')
+    except FileNotFoundError:
+        logging.error('Report body %s is missing from the blob store (%s)', digest, path)
+        return ''
+
+
+def store_report_body(text):
+    """Return the (body format, database value) of a report body with the configured storage and compression."""
+    if storage_backend() == 'filesystem':
+        return BLOB_FORMAT, write_blob(text).encode('ascii')
+    return compress_report(text)
+
+
+def load_report_body(body_format, value):
+    """Return the report body of a database value stored in a body format."""
+    if body_format == BLOB_FORMAT:
+        return read_blob(bytes(value).decode('ascii'))
+    return decompress_report(body_format, value)
+
+
+def target_body_format():
+    """Return the body format new report bodies are stored with."""
+    if storage_backend() == 'filesystem':
+        return BLOB_FORMAT
+    return target_format()
+
+
+def collect_garbage(grace_seconds=None):
+    """
+    Delete blob files no report references anymore (e.g. removed by report retention or
+    device deletion). Files modified within grace_seconds are kept: they may belong to a
+    report whose transaction has not committed yet. Returns (deleted, kept).
+    """
+    from api.models import FullReport  # Avoid circular import
+
+    if grace_seconds is None:
+        grace_seconds = settings.REPORT_BLOB_GC_GRACE_SECONDS
+    cutoff = time.time() - grace_seconds
+    referenced = {
+        bytes(value).decode('ascii')
+        for value in FullReport.objects.filter(body_format=BLOB_FORMAT)
+        .values_list('full_report', flat=True).iterator(chunk_size=2000)
+    }
+
+    deleted = kept = 0
+    for directory, _, filenames in os.walk(settings.REPORT_BLOB_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename in referenced:
+                kept += 1
+                continue
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    kept += 1
+                    continue
+                os.unlink(path)
+                deleted += 1
+            except FileNotFoundError:
+                continue
+    return deleted, kept
+
+
+class ReportBodyAttribute(DeferredAttribute):
+    """Field descriptor decoding the stored value on first access."""
+
+    # Defining __set__ makes this a data descriptor, so reads go through __get__ even once
+    # the value is in the instance __dict__
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if instance is not None and isinstance(value, (bytes, memoryview)):
+            # Loaded from the database: the format is in the model's format_field
+            value = load_report_body(getattr(instance, self.field.format_field), value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
+class ReportBodyField(models.BinaryField):
+    """
+    Report body stored in the database (optionally compressed) or in the blob store.
+
+    The model reads and writes text; the column holds bytes whose format (see
+    target_body_format()) is kept in the separate format_field, which must be declared
+    after this field so that it is saved with the value this field sets on save.
+    """
+
+    descriptor_class = ReportBodyAttribute
+
+    def __init__(self, *args, format_field='body_format', **kwargs):
+        self.format_field = format_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.format_field != 'body_format':
+            kwargs['format_field'] = self.format_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        text = getattr(model_instance, self.attname)
+        if text is None:
+            return None
+        body_format, value = store_report_body(text)
+        setattr(model_instance, self.format_field, body_format)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            # e.g. QuerySet.update(full_report=text): the format could not be saved with it
+            raise TypeError('Report bodies are saved with save(), or as (format, bytes) with store_report_body()')
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def to_python(self, value):
+        # Bodies are text once loaded (the parent class would base64-decode strings)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
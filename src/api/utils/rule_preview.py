@@ -0,0 +1,192 @@
+import json
+import re
+import time
+from contextlib import closing
+
+from django.db.models import BooleanField, Exists, ExpressionWrapper, F, Func, OuterRef, Q, TextField
+
+from .compliance import annotate_latest_report_id, prepare_stored_report
+from .policy_query import compile_query, extract_query_fields, run_query
+from .report_index import compile_query_to_q, indexed_devices
+
+# Report keys that can be fetched individually from the stored JSON
+_PLAIN_KEY_RE = re.compile(r'^\w+$')
+
+
+class _ReportKeyJSON(Func):
+    """
+    The JSON text of a key of FullReport.parsed_report (NULL if it is missing), decoded
+    with json.loads. Django's key transforms can't be used: on SQLite they read strings
+    unquoted and decode them as JSON, so e.g. the string '22.04' becomes a number.
+    """
+    output_field = TextField()
+
+    def __init__(self, key):
+        super().__init__(F('parsed_report'))
+        self.key = key
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        path = f'$."{self.key}"'
+        # JSON_TYPE is 'true', 'false' or 'null' for those values, which is their JSON text
+        sql = (
+            f"CASE JSON_TYPE({column}, %s) "
+            f"WHEN 'text' THEN JSON_QUOTE(JSON_EXTRACT({column}, %s)) "
+            f"WHEN 'integer' THEN CAST(JSON_EXTRACT({column}, %s) AS TEXT) "
+            f"WHEN 'real' THEN CAST(JSON_EXTRACT({column}, %s) AS TEXT) "
+            f"WHEN 'object' THEN JSON_EXTRACT({column}, %s) "
+            f"WHEN 'array' THEN JSON_EXTRACT({column}, %s) "
+            f"ELSE JSON_TYPE({column}, %s) END"
+        )
+        return sql, (*params, path) * 7
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        return f'({column} -> %s)::text', (*params, self.key)
+
+
+def _fact_index_complete(devices):
+    """Return True if every device of the queryset that has a report has indexed facts."""
+    from api.models import FullReport, ReportFact  # Avoid circular import
+
+    return not devices.order_by().filter(
+        Exists(FullReport.objects.filter(device=OuterRef('pk'))),
+        ~Exists(ReportFact.objects.filter(device=OuterRef('pk'))),
+    ).exists()
+
+
+def _evaluation_errors(query, device_ids):
+    """Evaluate a query on the latest parsed reports of the given devices and return their errors."""
+    from api.models import Device, FullReport  # Avoid circular import
+
+    latest_report_ids = annotate_latest_report_id(Device.objects.filter(id__in=device_ids)).values('latest_report_id')
+    reports = dict(FullReport.objects.filter(id__in=latest_report_ids).values_list('device_id', 'parsed_report'))
+    samples = []
+    for device_id in device_ids:
+        _, error = run_query(prepare_stored_report(reports.get(device_id) or {}), query)
+        if error:
+            samples.append({'device_id': device_id, 'error': error})
+    return samples
+
+
+def _preview_query_sql(query, translated, devices, started, sample_size):
+    """Count the devices matching a query translated to SQL over the fact index."""
+    matches, errors = translated
+    indexed = indexed_devices(devices.order_by())
+    evaluated = indexed.count()
+    passed = indexed.filter(matches).count()
+    failed_to_evaluate = indexed.filter(errors).count()
+    failing = indexed.exclude(matches).exclude(errors).order_by('id')
+    erroring = indexed.filter(errors).order_by('id')
+    return {
+        'query': query,
+        'engine': 'sql',
+        'total_devices': devices.count(),
+        'evaluated': evaluated,
+        'passed': passed,
+        'failed': evaluated - passed - failed_to_evaluate,
+        'errors': failed_to_evaluate,
+        'unindexed': 0,
+        'complete': True,
+        'elapsed_ms': round((time.monotonic() - started) * 1000),
+        'failing_devices': list(failing.values('id', 'hostname')[:sample_size]),
+        # The index only tells which devices failed to evaluate: get the errors from their reports
+        'error_samples': _evaluation_errors(query, list(erroring.values_list('id', flat=True)[:sample_size])),
+    }
+
+
+def preview_query(query, devices, time_budget, sample_size=50):
+    """
+    Evaluate an (unsaved) JMESPath query against the latest stored parsed report of each device.
+
+    Simple queries (comparisons against literals combined with &&, || and !) are answered
+    with SQL over the fact index ('engine': 'sql') once every device's latest report has
+    been indexed (see the reindex_reports command). Otherwise only the report keys the query
+    reads are fetched from the database when they can be determined from the query.
+    Evaluation stops once time_budget seconds have elapsed, in which case 'complete' is
+    False and the counts cover the devices evaluated so far.
+
+    Raises jmespath.exceptions.JMESPathError if the query is invalid.
+    """
+    from api.models import Device, FullReport  # Avoid circular import
+
+    compile_query(query)
+    started = time.monotonic()
+
+    translated = compile_query_to_q(query)
+    if translated is not None and _fact_index_complete(devices):
+        return _preview_query_sql(query, translated, devices, started, sample_size)
+
+    fields = extract_query_fields(query)
+    if fields is not None and all(_PLAIN_KEY_RE.match(field) for field in fields):
+        fetch_keys = set(fields)
+        if 'days_since_audit' in fetch_keys:
+            fetch_keys.add('report_datetime_end')
+        fetch_keys = sorted(fetch_keys)
+        columns = {f'report_key_{index}': _ReportKeyJSON(key) for index, key in enumerate(fetch_keys)}
+    else:
+        fetch_keys = None
+        columns = {}
+
+    latest_report_ids = annotate_latest_report_id(devices.order_by()).values('latest_report_id')
+    rows = (
+        FullReport.objects.filter(id__in=latest_report_ids)
+        .annotate(indexed=ExpressionWrapper(Q(parsed_report__isnull=False), output_field=BooleanField()), **columns)
+        .order_by('device_id')
+        .values_list('device_id', 'indexed', *(columns or ['parsed_report']))
+        .iterator(chunk_size=500)
+    )
+
+    total = devices.count()
+    evaluated = passed = failed = failed_to_evaluate = unindexed = 0
+    failing_device_ids = []
+    errors = []
+    complete = True
+
+    # Stopping early must close the (server-side, on PostgreSQL) cursor
+    with closing(rows):
+        for device_id, indexed, *values in rows:
+            if time.monotonic() - started > time_budget:
+                complete = False
+                break
+            if not indexed:
+                # Stored before parsed reports were kept; see the backfill_parsed_reports command
+                unindexed += 1
+                continue
+
+            if fetch_keys is None:
+                report = values[0]
+            else:
+                report = {
+                    key: json.loads(value) for key, value in zip(fetch_keys, values) if value is not None
+                }
+            result, error = run_query(prepare_stored_report(report or {}), query)
+            evaluated += 1
+            if result is True:
+                passed += 1
+            elif result is False:
+                failed += 1
+                if len(failing_device_ids) < sample_size:
+                    failing_device_ids.append(device_id)
+            else:
+                failed_to_evaluate += 1
+                if len(errors) < sample_size:
+                    errors.append({'device_id': device_id, 'error': error})
+
+    hostnames = dict(Device.objects.filter(id__in=failing_device_ids).values_list('id', 'hostname'))
+    return {
+        'query': query,
+        'engine': 'python',
+        'total_devices': total,
+        'evaluated': evaluated,
+        'passed': passed,
+        'failed': failed,
+        'errors': failed_to_evaluate,
+        'unindexed': unindexed,
+        'complete': complete,
+        'elapsed_ms': round((time.monotonic() - started) * 1000),
+        'failing_devices': [
+            {'id': device_id, 'hostname': hostnames.get(device_id)} for device_id in failing_device_ids
+        ],
+        'error_samples': errors,
+    }
@@ -0,0 +1,143 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds (milliseconds) of the evaluation time histogram buckets; a last,
+# open-ended bucket counts slower evaluations
+DURATION_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def empty_histogram():
+    return [0] * (len(DURATION_BUCKETS_MS) + 1)
+
+
+def histogram_percentile_ms(histogram, percentile):
+    """
+    Return the upper bound (milliseconds) of the bucket holding the given percentile of a
+    duration histogram, or None if it is empty. The open-ended bucket reports the largest bound.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = total * percentile / 100
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            return DURATION_BUCKETS_MS[min(index, len(DURATION_BUCKETS_MS) - 1)]
+    return DURATION_BUCKETS_MS[-1]
+
+
+class _RuleCounters:
+    __slots__ = ('evaluations', 'errors', 'total_time', 'histogram')
+
+    def __init__(self):
+        self.evaluations = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.histogram = empty_histogram()
+
+
+class RuleStatsCollector:
+    """
+    Thread-safe, in-memory per-rule evaluation counters, periodically added to PolicyRuleStats.
+
+    Recording an evaluation only updates a few counters under a lock. The database is
+    written every flush_interval seconds by a background thread of the process, outside
+    the requests and ingest transactions evaluating rules.
+    """
+
+    def __init__(self, flush_interval=None):
+        self._flush_interval = flush_interval
+        self._counters = {}
+        self._lock = threading.Lock()
+        # Process whose flush thread is running (a forked worker starts its own)
+        self._flusher_pid = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return settings.RULE_STATS_FLUSH_INTERVAL
+
+    def record(self, rule_id, duration, failed=False):
+        """Record one evaluation of a rule taking duration seconds."""
+        bucket = bisect.bisect_left(DURATION_BUCKETS_MS, duration * 1000)
+        with self._lock:
+            counters = self._counters.get(rule_id)
+            if counters is None:
+                counters = self._counters[rule_id] = _RuleCounters()
+            counters.evaluations += 1
+            counters.total_time += duration
+            counters.histogram[bucket] += 1
+            if failed:
+                counters.errors += 1
+            start_flusher = self._flusher_pid != os.getpid()
+            if start_flusher:
+                self._flusher_pid = os.getpid()
+        if start_flusher:
+            threading.Thread(target=self._flush_periodically, name='rule-stats-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        from django.db import connection
+
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                # The thread's own connection: don't keep it open between flushes
+                connection.close()
+
+    def flush(self):
+        """Add the counters collected since the last flush to the PolicyRuleStats rows."""
+        from django.db import transaction
+        from api.models import PolicyRule, PolicyRuleStats  # Avoid circular import
+
+        with self._lock:
+            counters, self._counters = self._counters, {}
+        if not counters:
+            return 0
+
+        try:
+            with transaction.atomic():
+                # Rules deleted since they were evaluated are dropped
+                rule_ids = set(PolicyRule.objects.filter(id__in=counters).values_list('id', flat=True))
+                # Upsert: rows another process creates meanwhile are kept, then added to
+                PolicyRuleStats.objects.bulk_create(
+                    [PolicyRuleStats(rule_id=rule_id, histogram=empty_histogram()) for rule_id in rule_ids],
+                    ignore_conflicts=True,
+                )
+                # Locked until commit, so concurrent flushes add to each other's totals
+                rows = list(PolicyRuleStats.objects.select_for_update().filter(rule_id__in=rule_ids))
+                for stats in rows:
+                    stats.add(counters[stats.rule_id])
+                PolicyRuleStats.objects.bulk_update(
+                    rows, ['evaluations', 'errors', 'total_time', 'histogram', 'updated_at'],
+                )
+        except Exception as e:
+            # Statistics are best effort
+            logging.error(f'Error saving rule evaluation statistics: {e}')
+            return 0
+        return len(rule_ids)
+
+    def clear(self):
+        with self._lock:
+            self._counters = {}
+
+
+rule_stats = RuleStatsCollector()
+
+
+def record_rule_evaluation(rule_id, duration, failed=False):
+    """Record that a rule was evaluated in duration seconds (failed: evaluation raised an error)."""
+    rule_stats.record(rule_id, duration, failed)
+
+
+def flush_rule_stats():
+    """Write the counters collected by this process to the database now."""
+    return rule_stats.flush()
@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Cache alias shared by all workers of both services (see CACHES in settings)
+VIEW_CACHE_ALIAS = 'views'
+
+# Stored next to the cache entries rather than in the cache, where culling could evict it
+FLEET_DATA_VERSION_FILE = 'fleet-data-version'
+
+# Hit/miss counters of this worker process
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+# Version change scheduled by this worker process, see _publish_change()
+_bump_lock = threading.Lock()
+_bump_timer = None
+_bump_pid = None
+_pending_change_at = None
+
+
+def _cache():
+    return caches[VIEW_CACHE_ALIAS]
+
+
+def _version_path():
+    return os.path.join(settings.VIEW_CACHE_DIR, FLEET_DATA_VERSION_FILE)
+
+
+def _write_version(version):
+    """Atomically replace the fleet data version file."""
+    os.makedirs(settings.VIEW_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.VIEW_CACHE_DIR, prefix='.version-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, _version_path())
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def fleet_data_version():
+    """
+    Return the current fleet data version, a token that changes whenever devices, reports,
+    compliance or labels change. Cached fragments are keyed by it.
+    """
+    try:
+        with open(_version_path()) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        version = ''
+    if not version:
+        # First use: start a new version (nothing cached matches it)
+        version = uuid.uuid4().hex
+        _write_version(version)
+    return version
+
+
+def _set_new_version():
+    try:
+        _write_version(uuid.uuid4().hex)
+    except Exception:
+        logging.exception('Could not update the fleet data version')
+
+
+def _version_written_at():
+    try:
+        return os.stat(_version_path()).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _publish_change():
+    """
+    Set a new fleet data version for a committed change, at most once per
+    settings.VIEW_CACHE_INVALIDATE_INTERVAL: a change within the interval schedules the next
+    version for its end, which then also covers the changes committed meanwhile.
+    """
+    global _bump_timer, _bump_pid, _pending_change_at
+
+    changed_at = time.time()
+    with _bump_lock:
+        if _bump_timer is not None and _bump_pid == os.getpid():
+            _pending_change_at = changed_at
+            return
+        delay = _version_written_at() + settings.VIEW_CACHE_INVALIDATE_INTERVAL - changed_at
+        if delay <= 0:
+            _set_new_version()
+            return
+        _pending_change_at = changed_at
+        _bump_pid = os.getpid()
+        _bump_timer = threading.Timer(delay, _publish_pending_change)
+        _bump_timer.daemon = True
+        _bump_timer.start()
+
+
+def _publish_pending_change():
+    global _bump_timer, _pending_change_at
+
+    with _bump_lock:
+        changed_at = _pending_change_at
+        _bump_timer = None
+        _pending_change_at = None
+        # Skipped if another worker already set a new version after the last change
+        if changed_at is not None and _version_written_at() < changed_at:
+            _set_new_version()
+
+
+def bump_fleet_data_version():
+    """
+    Invalidate every cached fragment once the current transaction commits.
+
+    A random token rather than a counter is stored, so concurrent bumps can never end on a
+    version that was already used to cache a fragment. The changes of one transaction (e.g. a
+    report stored by the ingest writer, with its device and events) set a single new version.
+    """
+    if settings.VIEW_CACHE_TTL <= 0:
+        return
+    connection = transaction.get_connection()
+    if any(func is _publish_change for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(_publish_change)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cached_fragment(name, vary, render):
+    """
+    Return a page fragment (its HTML, or a dict of HTML parts), rendering it with render() on a
+    cache miss.
+
+    Fragments are keyed by name, the current fleet data version and vary (e.g. the request's
+    query string), and expire after settings.VIEW_CACHE_TTL seconds. A TTL of 0 disables caching.
+    """
+    ttl = settings.VIEW_CACHE_TTL
+    if ttl <= 0:
+        return render()
+
+    cache = _cache()
+    try:
+        digest = hashlib.sha256(str(vary).encode()).hexdigest()
+        key = f'fragment:{name}:{fleet_data_version()}:{digest}'
+        html = cache.get(key)
+    except Exception:
+        logging.exception('Fragment cache unavailable, rendering %s without it', name)
+        return render()
+
+    if html is not None:
+        _count('hits')
+        return html
+
+    _count('misses')
+    html = render()
+    try:
+        cache.set(key, html, ttl)
+    except Exception:
+        logging.exception('Fragment cache unavailable, not caching %s', name)
+    return html
+
+
+def fragment_cache_stats():
+    """Return {'hits', 'misses', 'hit_rate'} of the fragment cache in this worker process."""
+    with _stats_lock:
+        hits = _stats['hits']
+        misses = _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
@@ -0,0 +1,28 @@
+"""Per-worker warm-up executed when a WSGI worker loads the application."""
+import logging
+
+from django.db import DatabaseError
+
+
+def warm_up_worker(resume_compliance_jobs=False):
+    """
+    Prepare per-process caches before the worker serves its first request.
+
+    Precompiles the JMESPath query of every enabled policy rule so the first
+    compliance evaluations don't pay the parsing cost. Failures are logged and
+    ignored: the database may not be migrated yet when a worker starts.
+
+    With resume_compliance_jobs (workers of the admin UI, which runs the compliance
+    jobs), also starts the watchdog resuming interrupted jobs.
+    """
+    from api.models import PolicyRule  # Apps must be loaded first
+
+    try:
+        compiled = PolicyRule.warm_query_cache()
+        logging.info(f'Worker warm-up: precompiled {compiled} policy rule queries')
+    except DatabaseError as e:
+        logging.warning(f'Worker warm-up skipped, database not available: {e}')
+
+    if resume_compliance_jobs:
+        from api.utils.compliance_jobs import start_compliance_job_watchdog
+        start_compliance_job_watchdog()
@@ -14,6 +14,7 @@ from api.models import (
     EnrollmentSkipTest,
 )
 from django.forms import inlineformset_factory
+from api.utils.policy_query import compile_query
 import jmespath
 
 class DeviceForm(forms.ModelForm):
@@ -95,7 +96,7 @@ class PolicyRuleForm(forms.ModelForm):
         
         # Validate JMESPath syntax by attempting to compile it
         try:
-            jmespath.compile(rule_query)
+            compile_query(rule_query)
         except jmespath.exceptions.JMESPathError as e:
             raise forms.ValidationError(
                 f'Invalid JMESPath query syntax: {str(e)}. '
@@ -156,9 +156,15 @@ function submitRulesetForm() {
     .then(data => {
         if (data.success) {
             const refreshed = data.compliance_refreshed || 0;
-            const toastMessage = refreshed > 0
+            const job = data.compliance_job;
+            let toastMessage = refreshed > 0
                 ? `Ruleset updated. Compliance refreshed for ${refreshed} device${refreshed === 1 ? '' : 's'}.`
                 : 'Ruleset updated successfully.';
+            if (job && (job.status === 'pending' || job.status === 'running')) {
+                // Recompute continues in the background; base.html polls its progress
+                toastMessage = `Ruleset updated. Recomputing compliance for ${job.total} device${job.total === 1 ? '' : 's'}...`;
+                sessionStorage.setItem('pending_compliance_job_url', data.compliance_job_url);
+            }
             sessionStorage.setItem('pending_toast_message', toastMessage);
             sessionStorage.setItem('pending_toast_type', 'success');
 
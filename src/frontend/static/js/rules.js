@@ -134,9 +134,15 @@ function submitRuleForm() {
     .then(data => {
         if (data.success) {
             const refreshed = data.compliance_refreshed || 0;
-            const toastMessage = refreshed > 0
+            const job = data.compliance_job;
+            let toastMessage = refreshed > 0
                 ? `Rule updated. Compliance refreshed for ${refreshed} device${refreshed === 1 ? '' : 's'}.`
                 : 'Rule updated successfully.';
+            if (job && (job.status === 'pending' || job.status === 'running')) {
+                // Recompute continues in the background; base.html polls its progress
+                toastMessage = `Rule updated. Recomputing compliance for ${job.total} device${job.total === 1 ? '' : 's'}...`;
+                sessionStorage.setItem('pending_compliance_job_url', data.compliance_job_url);
+            }
             sessionStorage.setItem('pending_toast_message', toastMessage);
             sessionStorage.setItem('pending_toast_type', 'success');
 
@@ -159,6 +165,52 @@ function submitRuleForm() {
 }
 
 // Show form errors
+// Evaluate the draft query against the latest report of every device without saving it
+function previewRuleQuery() {
+    const query = document.getElementById('rule_query').value;
+    const resultBox = document.getElementById('rule-preview-result');
+    const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]')?.value;
+    const formData = new FormData();
+    formData.append('rule_query', query);
+
+    resultBox.classList.remove('hidden');
+    resultBox.textContent = 'Evaluating...';
+
+    fetch('/rule/preview/', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest',
+            'X-CSRFToken': csrftoken,
+        },
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            resultBox.textContent = data.error || 'Preview failed.';
+            return;
+        }
+        let summary = `${data.passed} pass, ${data.failed} fail, ${data.errors} error(s) out of ${data.evaluated} evaluated devices`;
+        if (!data.complete) {
+            summary += ' (time budget reached, partial result)';
+        }
+        if (data.unindexed > 0) {
+            summary += `; ${data.unindexed} device(s) need their reports backfilled`;
+        }
+        resultBox.textContent = summary;
+        if (data.failing_devices.length > 0) {
+            const list = document.createElement('div');
+            list.className = 'mt-1 text-gray-600';
+            list.textContent = 'Failing: ' + data.failing_devices.map(device => device.hostname || `#${device.id}`).join(', ');
+            resultBox.appendChild(list);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        resultBox.textContent = 'An error occurred while previewing the query.';
+    });
+}
+
 function showRuleFormErrors(errors) {
     const errorContainer = document.getElementById('rule-form-errors');
     const errorList = document.getElementById('rule-error-list');
@@ -5,7 +5,7 @@ from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
-from api.models import Device, FullReport, DiffReport, DeviceEvent, EnrollmentSettings, EnrollmentPlugin, EnrollmentPackage, EnrollmentSkipTest, PolicyRuleset
+from api.models import Device, FullReport, DiffReport, DeviceEvent, EnrollmentSettings, EnrollmentPlugin, EnrollmentPackage, EnrollmentSkipTest, Label, PolicyRuleset
 from frontend.templatetags import custom_filters
 from frontend.views import DEVICE_LIST_PAGE_SIZE
 from frontend.forms import (
@@ -282,9 +282,8 @@ class TestDeviceListPagination:
 
         assert response.status_code == 200
         page_obj = response.context['page_obj']
-        paginator = response.context['paginator']
-        assert paginator.count == total_devices
-        assert page_obj.number == 1
+        assert response.context['total_count'] == total_devices
+        assert page_obj.has_next and not page_obj.has_previous
         assert len(page_obj.object_list) == DEVICE_LIST_PAGE_SIZE
 
     def test_device_list_second_page_paginated(self, test_user, test_license_key, sample_lynis_report):
@@ -293,14 +292,93 @@ class TestDeviceListPagination:
         total_devices = DEVICE_LIST_PAGE_SIZE + 5
         self._create_devices(test_license_key, total_devices, sample_lynis_report)
 
-        response = client.get(reverse('device_list'), {'page': 2})
+        first = client.get(reverse('device_list')).context
+        first_page = first['page_obj']
+        next_url = f"{reverse('device_list')}?{first['pagination_query']}&cursor={first_page.next_cursor}"
+        response = client.get(next_url)
 
         assert response.status_code == 200
         page_obj = response.context['page_obj']
-        assert page_obj.number == 2
         assert len(page_obj.object_list) == total_devices - DEVICE_LIST_PAGE_SIZE
+        # Counted once, on the first page
+        assert response.context['total_count'] == total_devices
+        assert not set(page_obj.object_list) & set(first_page.object_list)
         assert response.context['is_paginated'] is True
 
+        previous_page = client.get(reverse('device_list'), {'cursor': page_obj.previous_cursor}).context['page_obj']
+        assert previous_page.object_list == first_page.object_list
+        assert not previous_page.has_previous
+
+
+    def test_device_list_json_pages_with_cursor_and_filters(self, test_user, test_license_key, sample_lynis_report):
+        client = Client()
+        client.force_login(test_user)
+        self._create_devices(test_license_key, 5, sample_lynis_report)
+        Device.objects.filter(hostname='device-4').update(os='FreeBSD')
+
+        first = client.get(reverse('device_list_json'), {'sort': 'warnings', 'order': 'asc', 'limit': 2, 'os': 'linux'}).json()
+        second = client.get(reverse('device_list_json'), {
+            'sort': 'warnings', 'order': 'asc', 'limit': 2, 'os': 'linux', 'cursor': first['next_cursor'],
+        }).json()
+
+        assert [d['hostname'] for d in first['devices']] == ['device-0', 'device-1']
+        assert [d['hostname'] for d in second['devices']] == ['device-2', 'device-3']
+        assert second['next_cursor'] is None
+        assert first['devices'][0]['compliant'] is None
+
+        response = client.get(reverse('device_list_json'), {'sort': 'hostname', 'cursor': first['next_cursor']})
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+class TestDeviceSearch:
+    """Indexed device search used for typeahead."""
+
+    def _search(self, client, **params):
+        response = client.get(reverse('device_search'), params)
+        assert response.status_code == 200
+        return [result['hostname'] for result in response.json()['results']]
+
+    def test_search_matches_substrings_of_hostname_ip_and_mac(self, test_user, test_license_key):
+        client = Client()
+        client.force_login(test_user)
+        Device.objects.create(
+            licensekey=test_license_key, hostid='h1', hostid2='h1b', hostname='web-prod-01',
+            ip_address='10.20.30.41', mac_address='AA:BB:CC:00:11:22', os='Linux',
+        )
+        Device.objects.create(
+            licensekey=test_license_key, hostid='h2', hostid2='h2b', hostname='db-prod-02',
+            ip_address='10.20.31.7', mac_address='AA:BB:CC:33:44:55', os='FreeBSD',
+        )
+
+        assert self._search(client, q='prod-0') == ['db-prod-02', 'web-prod-01']
+        assert self._search(client, q='30.41') == ['web-prod-01']
+        assert self._search(client, q='cc:33') == ['db-prod-02']
+        assert self._search(client, q='10.20.31.7') == ['db-prod-02']
+        # Exact and prefix matches come first
+        assert self._search(client, q='web') == ['web-prod-01']
+        assert self._search(client, q='prod', os='freebsd') == ['db-prod-02']
+        assert self._search(client, q='') == []
+
+    def test_search_follows_label_changes(self, test_user, test_license_key):
+        client = Client()
+        client.force_login(test_user)
+        device = Device.objects.create(licensekey=test_license_key, hostid='h1', hostid2='h1b', hostname='node-1')
+        Device.objects.create(licensekey=test_license_key, hostid='h2', hostid2='h2b', hostname='node-2')
+        label = Label.objects.create(name='payments')
+
+        device.labels.add(label)
+        assert self._search(client, q='paym') == ['node-1']
+        assert self._search(client, q='node', label=label.id) == ['node-1']
+
+        label.name = 'billing'
+        label.save()
+        assert self._search(client, q='paym') == []
+        assert self._search(client, q='billing') == ['node-1']
+
+        label.delete()
+        assert self._search(client, q='billing') == []
+
 
 @pytest.mark.django_db
 class TestDeviceComplianceUnknownStatus:
@@ -329,6 +407,32 @@ class TestDeviceComplianceUnknownStatus:
         assert b'Unknown' in response.content
 
 
+@pytest.mark.django_db
+class TestDeviceListFindingFilter:
+    """Device list filtered by a warning or suggestion of the latest report."""
+
+    def test_device_list_filters_by_warning(self, test_user, test_license_key):
+        from conftest import DeviceFactory
+
+        client = Client()
+        client.force_login(test_user)
+
+        affected = DeviceFactory(licensekey=test_license_key)
+        other = DeviceFactory(licensekey=test_license_key)
+        FullReport.objects.create(
+            device=affected,
+            full_report='# Lynis Report\nhostname=a\nwarning[]=PKGS-7392|Found vulnerable packages.|-|-\n',
+        )
+        FullReport.objects.create(device=other, full_report='# Lynis Report\nhostname=b\n')
+
+        response = client.get(reverse('device_list'), {'warning': 'PKGS-7392'})
+
+        assert response.status_code == 200
+        assert list(response.context['page_obj'].object_list) == [affected]
+        assert response.context['finding_filter'] == {'type': 'warning', 'test_id': 'PKGS-7392'}
+        assert b'Filtered by warning' in response.content
+
+
 @pytest.mark.django_db
 class TestDeviceListCustomizableColumns:
     """Tests for device list optional/customizable columns."""
@@ -361,6 +465,7 @@ class TestDeviceListCustomizableColumns:
             os='Linux',
             distro='Ubuntu',
             compliant=False,
+            non_compliant_since=timezone.now() - timedelta(days=3),
             warnings=2,
             last_update=timezone.now() - timedelta(days=4),
         )
@@ -368,14 +473,6 @@ class TestDeviceListCustomizableColumns:
         ruleset = PolicyRuleset.objects.create(name='Test ruleset', description='Ruleset for testing')
         device.rulesets.add(ruleset)
 
-        DeviceEvent.objects.create(
-            device=device,
-            event_type='compliance_changed',
-            metadata={'old_status': 'Compliant', 'new_status': 'Non-Compliant'},
-        )
-        event = DeviceEvent.objects.filter(device=device, event_type='compliance_changed').first()
-        event.created_at = timezone.now() - timedelta(days=3)
-        event.save(update_fields=['created_at'])
 
         report = """# Lynis Report
 hostname=feature-device
@@ -396,7 +493,56 @@ report_datetime_end=2024-01-01 10:05:00
         assert listed_device.trikusec_plugin_installed is True
         assert listed_device.antivirus_installed is True
         assert listed_device.vulnerable_packages_count == 7
-        assert listed_device.total_days_non_compliant == 3
+        assert b'<span class="bg-red-200 text-red-600 py-1 px-3 rounded-full text-xs">3</span>' in response.content
+
+    def test_device_list_sorts_unknown_compliance_apart(self, test_user, test_license_key):
+        from conftest import DeviceFactory
+
+        client = Client()
+        client.force_login(test_user)
+        ruleset = PolicyRuleset.objects.create(name='Baseline')
+        for hostname, compliant, assigned in (
+            ('compliant-1', True, True), ('unknown-1', True, False), ('failing-1', False, True), ('unknown-2', True, False),
+        ):
+            device = DeviceFactory(licensekey=test_license_key, hostname=hostname, compliant=compliant)
+            if assigned:
+                device.rulesets.add(ruleset)
+
+        hostnames, cursor = [], None
+        while True:
+            params = {'sort': 'compliant', 'order': 'asc', 'limit': 1}
+            if cursor:
+                params['cursor'] = cursor
+            page = client.get(reverse('device_list_json'), params).json()
+            hostnames += [d['hostname'] for d in page['devices']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        assert hostnames == ['unknown-1', 'unknown-2', 'failing-1', 'compliant-1']
+
+    def test_device_list_sorts_and_filters_report_columns_in_sql(self, test_user, test_license_key, django_assert_max_num_queries):
+        from conftest import DeviceFactory
+
+        client = Client()
+        client.force_login(test_user)
+
+        for index, hardening in enumerate((80, None, 45, 60)):
+            device = DeviceFactory(licensekey=test_license_key, hostname=f'host-{index}')
+            report = '# Lynis Report\nhostname=host-{}\n{}'.format(
+                index, f'hardening_index={hardening}\n' if hardening is not None else '',
+            )
+            FullReport.objects.create(device=device, full_report=report)
+
+        response = client.get(reverse('device_list'), {'sort': 'hardening_index', 'order': 'desc'})
+        hostnames = [d.hostname for d in response.context['devices'].object_list]
+        assert hostnames == ['host-0', 'host-3', 'host-2', 'host-1']
+
+        with django_assert_max_num_queries(12):
+            response = client.get(reverse('device_list'), {'hardening_below': '70', 'sort': 'hardening_index', 'order': 'asc'})
+        hostnames = [d.hostname for d in response.context['devices'].object_list]
+        assert hostnames == ['host-2', 'host-3']
+        assert response.context['column_filters'] == [{'param': 'hardening_below', 'label': 'Hardening index below', 'value': '70'}]
 
 
 @pytest.mark.django_db
@@ -558,6 +704,70 @@ class TestDeviceUpdateCompliance:
         assert compliance_event.metadata['new_status'] == 'Non-Compliant'
 
 
+@pytest.mark.django_db
+class TestDevicesBulkUpdate:
+    """Bulk ruleset and label assignment to a selection of devices."""
+
+    def test_bulk_ruleset_assignment_recomputes_compliance_once(self, test_user, test_license_key, sample_lynis_report):
+        from api.models import ComplianceJob, PolicyRule
+
+        client = Client()
+        client.force_login(test_user)
+        devices = [
+            Device.objects.create(licensekey=test_license_key, hostid=f'h{i}', hostid2=f'h{i}b', hostname=f'bulk-{i}')
+            for i in range(3)
+        ]
+        for device in devices:
+            FullReport.objects.create(device=device, full_report=sample_lynis_report)
+        rule = PolicyRule.objects.create(name='Hardening over 100', rule_query='hardening_index > `100`', enabled=True)
+        ruleset = PolicyRuleset.objects.create(name='Strict Baseline')
+        ruleset.rules.add(rule)
+        devices[0].rulesets.add(ruleset)
+
+        response = client.post(reverse('devices_bulk_rulesets'), {
+            'device_ids': [d.id for d in devices[:2]], 'add': [ruleset.id],
+        })
+
+        data = response.json()
+        assert data['success'] is True
+        assert (data['devices'], data['added'], data['removed']) == (2, 1, 0)
+        assert data['compliance_job']['status'] == 'completed'
+        assert data['compliance_job']['refreshed'] == 2
+        assert ComplianceJob.objects.filter(scope='devices').count() == 1
+        assert set(ruleset.devices.values_list('hostname', flat=True)) == {'bulk-0', 'bulk-1'}
+        assert list(Device.objects.filter(compliant=False).order_by('hostname').values_list('hostname', flat=True)) == [
+            'bulk-0', 'bulk-1',
+        ]
+
+        response = client.post(reverse('devices_bulk_rulesets'), {'q': 'bulk', 'remove': [ruleset.id]})
+        assert response.json()['removed'] == 2
+        assert not ruleset.devices.exists()
+
+    def test_bulk_label_assignment_by_filter(self, test_user, test_license_key):
+        client = Client()
+        client.force_login(test_user)
+        Device.objects.create(licensekey=test_license_key, hostid='h1', hostid2='h1b', hostname='a', os='Linux')
+        Device.objects.create(licensekey=test_license_key, hostid='h2', hostid2='h2b', hostname='b', os='FreeBSD')
+        label = Label.objects.create(name='unix-fleet')
+
+        response = client.post(reverse('devices_bulk_labels'), {'os': 'freebsd', 'add': [label.id]})
+
+        data = response.json()
+        assert (data['devices'], data['added'], data['compliance_job']) == (1, 1, None)
+        assert list(label.devices.values_list('hostname', flat=True)) == ['b']
+        # Search text follows the set-based change
+        assert Device.objects.get(hostname='b').search_text.endswith('unix-fleet')
+
+    def test_bulk_update_requires_a_selection(self, test_user):
+        client = Client()
+        client.force_login(test_user)
+
+        response = client.post(reverse('devices_bulk_labels'), {'add': [1]})
+
+        assert response.status_code == 400
+        assert response.json()['error'] == 'No devices selected'
+
+
 @pytest.mark.django_db
 class TestPolicyEditComplianceRefresh:
     """Tests for compliance refresh when editing rules and rulesets."""
@@ -650,6 +860,106 @@ class TestPolicyEditComplianceRefresh:
         test_device.refresh_from_db()
         assert test_device.compliant is True
 
+    def test_ajax_rule_update_returns_compliance_job_status(self, test_user, test_device, sample_lynis_report):
+        from api.models import PolicyRule, PolicyRuleset
+
+        client = Client()
+        client.force_login(test_user)
+
+        FullReport.objects.create(device=test_device, full_report=sample_lynis_report)
+        rule = PolicyRule.objects.create(name='Hardening', rule_query='hardening_index > `100`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Baseline', description='')
+        ruleset.rules.add(rule)
+        test_device.rulesets.add(ruleset)
+
+        response = client.post(
+            reverse('rule_update', kwargs={'rule_id': rule.id}),
+            data={'enabled': 'on', 'name': rule.name, 'description': 'x', 'rule_query': 'hardening_index > `60`'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+        data = response.json()
+        assert data['compliance_job']['status'] == 'completed'
+        assert data['compliance_refreshed'] == 1
+
+        status = client.get(data['compliance_job_url']).json()
+        assert (status['done'], status['total'], status['scope']) == (1, 1, 'rule')
+
+
+@pytest.mark.django_db
+class TestRulePreviewView:
+    """Tests for the fleet-wide rule preview endpoint."""
+
+    def test_preview_scoped_to_label(self, test_user, test_device, test_license_key):
+        from conftest import DeviceFactory
+        from api.models import Label
+
+        client = Client()
+        client.force_login(test_user)
+
+        label = Label.objects.create(name='web')
+        test_device.labels.add(label)
+        FullReport.objects.create(device=test_device, full_report='', parsed_report={'hardening_index': 50})
+        other = DeviceFactory(licensekey=test_license_key)
+        FullReport.objects.create(device=other, full_report='', parsed_report={'hardening_index': 50})
+
+        response = client.post(reverse('rule_preview'), {'rule_query': 'hardening_index > `60`', 'label': label.id})
+
+        data = response.json()
+        assert data['success'] is True
+        assert (data['total_devices'], data['failed']) == (1, 1)
+        assert data['failing_devices'][0]['id'] == test_device.id
+
+    def test_invalid_query_returns_400(self, test_user):
+        client = Client()
+        client.force_login(test_user)
+
+        response = client.post(reverse('rule_preview'), {'rule_query': 'hardening_index >'})
+
+        assert response.status_code == 400
+        assert response.json()['success'] is False
+
+    def test_invalid_scope_returns_400(self, test_user):
+        client = Client()
+        client.force_login(test_user)
+
+        for scope in ({'label': 'abc'}, {'license': '1; DROP'}):
+            response = client.post(reverse('rule_preview'), {'rule_query': 'hardening_index > `60`', **scope})
+
+            assert response.status_code == 400
+            assert response.json()['success'] is False
+
+
+@pytest.mark.django_db
+class TestComplianceTrendsView:
+    """Tests for the compliance trends endpoint."""
+
+    def test_returns_snapshot_points_for_label(self, test_user, test_device):
+        from api.models import Label
+        from api.utils.compliance_snapshots import take_compliance_snapshots
+
+        client = Client()
+        client.force_login(test_user)
+
+        label = Label.objects.create(name='web')
+        test_device.labels.add(label)
+        take_compliance_snapshots()
+
+        response = client.get(reverse('compliance_trends'), {'scope': 'label', 'id': label.id, 'days': 30})
+
+        data = response.json()
+        assert data['success'] is True
+        assert len(data['points']) == 1
+        assert (data['points'][0]['total'], data['points'][0]['unknown']) == (1, 1)
+
+    def test_unknown_scope_returns_400(self, test_user):
+        client = Client()
+        client.force_login(test_user)
+
+        response = client.get(reverse('compliance_trends'), {'scope': 'galaxy'})
+
+        assert response.status_code == 400
+
 
 @pytest.mark.django_db
 class TestRulesetRemoveDevice:
@@ -716,6 +1026,24 @@ class TestRulesetRemoveDevice:
         expected_url = reverse('ruleset_remove_device', kwargs={'ruleset_id': ruleset.id, 'device_id': test_device.id})
         assert expected_url.encode() in response.content
 
+    def test_ruleset_detail_shows_stored_device_status(self, test_user, test_device):
+        from api.models import PolicyRule, PolicyRuleset
+        from api.utils.compliance import update_device_compliance
+
+        client = Client()
+        client.force_login(test_user)
+
+        rule = PolicyRule.objects.create(name='Few warnings', rule_query='warning_count < `1`', description='')
+        ruleset = PolicyRuleset.objects.create(name='Baseline Ruleset', created_by=test_user)
+        ruleset.rules.add(rule)
+        test_device.rulesets.add(ruleset)
+        update_device_compliance(test_device, {'warning_count': 4})
+
+        response = client.get(reverse('ruleset_detail', kwargs={'ruleset_id': ruleset.id}))
+
+        assert response.status_code == 200
+        assert [device.ruleset_status for device in response.context['devices']] == ['fail']
+
 
 @pytest.mark.django_db
 class TestActivityView:
@@ -748,6 +1076,20 @@ class TestActivityView:
         added_block = next(block for block in first_entry['type_blocks'] if block['type'] == 'added')
         assert added_block['count'] == 4
 
+    def test_activity_view_shows_latest_history_whatever_its_age(self, test_user, test_device):
+        client = Client()
+        client.force_login(test_user)
+        DeviceEvent.objects.create(device=test_device, event_type='enrolled')
+        old = DeviceEvent.objects.create(device=test_device, event_type='license_changed')
+        old_day = timezone.now() - timedelta(days=2 * 365)
+        DeviceEvent.objects.filter(pk=old.pk).update(created_at=old_day)
+
+        response = client.get(reverse('activity'))
+        assert [entry['type'] for entry in response.context['activities']] == ['enrollment', 'license_changed']
+
+        response = client.get(reverse('activity'), {'date': old_day.strftime('%Y-%m-%d')})
+        assert [entry['type'] for entry in response.context['activities']] == ['license_changed']
+
     def test_activity_view_groups_events_by_time(
         self, test_user, test_device, monkeypatch
     ):
@@ -1795,23 +2137,19 @@ class TestDashboardView:
         client = Client()
         client.force_login(test_user)
 
-        non_compliant_device = DeviceFactory(
+        DeviceFactory(
             licensekey=test_license_key,
             compliant=False,
+            non_compliant_since=timezone.now() - timedelta(days=8),
             warnings=5,
             hostname='problem-server'
         )
-        # Create a compliance event in the past
-        event = DeviceEvent.objects.create(
-            device=non_compliant_device,
-            event_type='compliance_changed',
-            metadata={
-                'old_status': 'Compliant',
-                'new_status': 'Non-Compliant',
-                'hostname': 'problem-server'
-            }
+        # Non-compliant for less than 7 days
+        DeviceFactory(
+            licensekey=test_license_key,
+            compliant=False,
+            non_compliant_since=timezone.now() - timedelta(days=2),
         )
-        DeviceEvent.objects.filter(id=event.id).update(created_at=timezone.now() - timedelta(days=8))
 
         response = client.get(reverse('dashboard'))
 
@@ -1840,3 +2178,139 @@ class TestDashboardView:
 
         assert response.status_code == 302
         assert reverse('onboarding') in response.url
+
+
+@pytest.mark.django_db
+class TestRuleStatsDisplay:
+    """Tests for showing rule evaluation statistics in the policy pages."""
+
+    def test_slow_rule_flagged_in_rule_detail_and_policy_list(self, test_user, settings):
+        from api.models import PolicyRule, PolicyRuleStats
+        from api.utils.rule_stats import DURATION_BUCKETS_MS, empty_histogram
+
+        settings.RULE_SLOW_THRESHOLD_MS = 5
+        client = Client()
+        client.force_login(test_user)
+
+        rule = PolicyRule.objects.create(name='Packages', rule_query='length(installed_packages_array) > `0`')
+        PolicyRule.objects.create(name='Never evaluated', rule_query='os == `"Linux"`')
+        histogram = empty_histogram()
+        histogram[DURATION_BUCKETS_MS.index(25)] = 4
+        PolicyRuleStats.objects.create(rule=rule, evaluations=4, errors=1, total_time=0.08, histogram=histogram)
+
+        detail = client.get(reverse('rule_detail', kwargs={'rule_id': rule.id})).content.decode()
+        assert '4 evaluations' in detail
+        assert 'Slow' in detail
+
+        policies = client.get(reverse('policy_list')).content.decode()
+        assert policies.count('>Slow</span>') == 1
+
+
+@pytest.mark.django_db
+class TestFleetFragmentCache:
+    """Dashboard and device list content is cached until fleet data changes."""
+
+    @pytest.fixture(autouse=True)
+    def view_cache(self, settings, tmp_path, monkeypatch):
+        from django.core.cache import caches
+        from api.utils import view_cache
+
+        settings.VIEW_CACHE_TTL = 300
+        settings.VIEW_CACHE_DIR = str(tmp_path)
+        settings.VIEW_CACHE_INVALIDATE_INTERVAL = 0
+        monkeypatch.setattr(view_cache, '_stats', {'hits': 0, 'misses': 0})
+        caches['views'].clear()
+        yield caches['views']
+        caches['views'].clear()
+
+    def test_unchanged_data_served_from_cache(self, test_user, test_device):
+        from api.utils.view_cache import fragment_cache_stats
+
+        client = Client()
+        client.force_login(test_user)
+
+        client.get(reverse('device_list'))
+        cached = client.get(reverse('device_list'))
+        client.get(reverse('device_list'), {'sort': 'hostname'})
+
+        assert cached.status_code == 200
+        assert test_device.hostname.encode() in cached.content
+        assert fragment_cache_stats() == {'hits': 1, 'misses': 2, 'hit_rate': 0.3333}
+
+    def test_fleet_data_version_survives_cache_clear(self, view_cache):
+        from api.utils.view_cache import fleet_data_version
+
+        version = fleet_data_version()
+        view_cache.clear()
+
+        assert fleet_data_version() == version
+
+    def test_days_non_compliant_computed_per_request(self, test_user, test_device):
+        Device.objects.filter(pk=test_device.pk).update(
+            compliant=False, non_compliant_since=timezone.now() - timedelta(days=10),
+        )
+        client = Client()
+        client.force_login(test_user)
+        client.get(reverse('dashboard'))
+
+        # Time passes without any fleet data change (no signal, the fragment stays cached)
+        Device.objects.filter(pk=test_device.pk).update(non_compliant_since=timezone.now() - timedelta(days=12))
+        response = client.get(reverse('dashboard'))
+
+        assert response.context['attention_items'][0]['days_non_compliant'] == 12
+        assert b'12d' in response.content
+
+    def test_device_list_days_non_compliant_computed_per_request(self, test_user, test_device, monkeypatch):
+        test_device.rulesets.add(PolicyRuleset.objects.create(name='Baseline'))
+        now = timezone.now()
+        Device.objects.filter(pk=test_device.pk).update(compliant=False, non_compliant_since=now - timedelta(days=10))
+        client = Client()
+        client.force_login(test_user)
+        assert b'rounded-full text-xs">10</span>' in client.get(reverse('device_list')).content
+
+        # Two days pass without any fleet data change (the list stays cached)
+        monkeypatch.setattr(timezone, 'now', lambda: now + timedelta(days=2))
+        response = client.get(reverse('device_list'))
+
+        assert b'rounded-full text-xs">12</span>' in response.content
+        assert b'non-compliant-since' not in response.content
+
+    def test_changes_within_the_interval_set_one_new_version(self, settings, test_device, monkeypatch):
+        from api.utils import view_cache
+
+        settings.VIEW_CACHE_INVALIDATE_INTERVAL = 60
+        scheduled = []
+
+        class FakeTimer:
+            def __init__(self, delay, func):
+                self.delay, self.func = delay, func
+                scheduled.append(self)
+
+            def start(self):
+                pass
+
+        monkeypatch.setattr(view_cache.threading, 'Timer', FakeTimer)
+        monkeypatch.setattr(view_cache, '_bump_timer', None)
+        version = view_cache.fleet_data_version()
+
+        for _ in range(3):
+            view_cache._publish_change()
+
+        # The version was just written: the change waits for the end of the interval
+        assert view_cache.fleet_data_version() == version
+        assert len(scheduled) == 1 and 59 < scheduled[0].delay <= 60
+        scheduled[0].func()
+        assert view_cache.fleet_data_version() != version
+
+    @pytest.mark.django_db(transaction=True)
+    def test_change_invalidates_cached_fragments(self, test_user, test_device):
+        client = Client()
+        client.force_login(test_user)
+
+        assert b'renamed-host' not in client.get(reverse('dashboard')).content
+        assert b'renamed-host' not in client.get(reverse('device_list')).content
+
+        test_device.hostname = 'renamed-host'
+        test_device.save()
+
+        assert b'renamed-host' in client.get(reverse('device_list')).content
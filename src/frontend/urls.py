@@ -7,6 +7,7 @@ from django.views.static import serve
 urlpatterns = [
     path('', views.index, name='index'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/trends/', views.compliance_trends, name='compliance_trends'),
     path('media/<path:path>', serve, {'document_root': settings.MEDIA_ROOT}),
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
@@ -14,6 +15,10 @@ urlpatterns = [
     path('settings/', views.settings_view, name='settings'),
     path('onboarding/', views.onboarding, name='onboarding'),
     path('devices/', views.device_list, name='device_list'),
+    path('devices/json/', views.device_list_json, name='device_list_json'),
+    path('devices/search/', views.device_search, name='device_search'),
+    path('devices/bulk/rulesets/', views.devices_bulk_rulesets, name='devices_bulk_rulesets'),
+    path('devices/bulk/labels/', views.devices_bulk_labels, name='devices_bulk_labels'),
     path('device/<int:device_id>/', views.device_detail, name='device_detail'),
     path('device/<int:device_id>/edit/', views.device_update, name='device_update'),
     path('device/<int:device_id>/export-pdf/', views.device_export_pdf, name='device_export_pdf'),
@@ -37,8 +42,10 @@ urlpatterns = [
     path('rules/', views.rule_list, name='rule_list'),
     path('rule/<int:rule_id>/', views.rule_detail, name='rule_detail'),
     path('rule/create/', views.rule_create, name='rule_create'),
+    path('rule/preview/', views.rule_preview, name='rule_preview'),
     path('rule/<int:rule_id>/edit/', views.rule_update, name='rule_update'),
     path('rule/<int:rule_id>/delete/', views.rule_delete, name='rule_delete'),
+    path('compliance-job/<int:job_id>/', views.compliance_job_status_view, name='compliance_job_status'),
     path('activity/', views.activity, name='activity'),
     path('activity/silence/', views.silence_rule_list, name='silence_rule_list'),
     path('activity/silence/create/', views.silence_rule_create, name='silence_rule_create'),
@@ -7,12 +7,32 @@ from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_protect
 from django.db import transaction
-from django.db.models import Q, F, Count, Sum
+from django.db.models import Q, F, Count, Sum, Max, Prefetch
 from django.core.paginator import Paginator
 from django.conf import settings
-from api.models import Device, FullReport, DiffReport, LicenseKey, PolicyRule, PolicyRuleset, Organization, Label, ActivityIgnorePattern, DeviceEvent, EnrollmentSettings
+from django.utils import timezone as tz
+from api.models import Device, FullReport, DiffReport, LicenseKey, PolicyRule, PolicyRuleset, Organization, Label, ActivityIgnorePattern, DeviceEvent, EnrollmentSettings, ComplianceResult, ComplianceJob, ComplianceSnapshot, PolicyRuleStats
 from api.utils.lynis_report import LynisReport
-from api.utils.compliance import check_device_compliance, update_device_compliance
+from api.utils.compliance import get_device_compliance, update_device_compliance
+from api.utils.compliance_jobs import enqueue_compliance_job, compliance_job_status
+from api.utils.rule_preview import preview_query
+from api.utils.compliance_snapshots import FLEET_SCOPE_ID, compliance_trend
+from api.utils.bulk_devices import bulk_update_relation
+from api.utils.device_listing import (
+    COLUMN_FILTERS,
+    DEFAULT_SORT,
+    SORT_FIELDS as DEVICE_SORT_FIELDS,
+    InvalidCursor,
+    apply_column_filters,
+    device_list_queryset,
+    keyset_page,
+)
+from api.utils.device_search import SEARCH_RESULT_LIMIT, matching_devices, search_devices
+from api.utils.findings import devices_with_finding, top_findings
+from api.utils.fleet_summary import fleet_os_distribution, get_fleet_summary
+from api.utils.history_partitions import latest_history
+from api.utils.view_cache import cached_fragment
+from trikusec.db.replica import replica_reads
 from api.utils.license_utils import generate_license_key
 from .forms import (
     PolicyRulesetForm,
@@ -28,18 +48,24 @@ from .forms import (
     LabelForm,
 )
 import os
+import re
 import json
 import logging
-import re
 import fnmatch
+import jmespath
 from pathlib import Path
 from urllib.parse import urlparse
 from django.urls import reverse
-from datetime import datetime
+from datetime import datetime, timedelta, timezone as dt_timezone
 from weasyprint import HTML
 from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 
 DEVICE_LIST_PAGE_SIZE = getattr(settings, 'DEVICE_LIST_PAGE_SIZE', 25)
+DEVICE_LIST_JSON_MAX_LIMIT = 200
+
+COMPLIANCE_TRENDS_MAX_DAYS = 730
 
 
 def get_trikusec_version():
@@ -66,30 +92,6 @@ def safe_redirect(request, fallback_url_name='device_list', **kwargs):
         return redirect('device_list')
 
 
-def refresh_device_compliance_for_queryset(devices_queryset):
-    """Recalculate and persist compliance status for devices in the given queryset."""
-    refreshed = 0
-    skipped = 0
-
-    for device in devices_queryset.distinct():
-        latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
-        if not latest_report:
-            skipped += 1
-            continue
-
-        parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
-        if isinstance(parsed_report, dict) and parsed_report:
-            update_device_compliance(device, parsed_report)
-            refreshed += 1
-        else:
-            skipped += 1
-            logging.warning(
-                'Skipping compliance update for device %s: latest report could not be parsed',
-                device.id,
-            )
-
-    return refreshed, skipped
-
 @login_required
 def index(request):
     """Index view: redirect to onboarding if no devices, otherwise to dashboard"""
@@ -99,128 +101,66 @@ def index(request):
 
 
 @login_required
+@replica_reads
 def dashboard(request):
     """Dashboard view: security overview with stats, OS distribution, top issues, and attention items."""
-    from django.utils import timezone as tz
-
-    devices = Device.objects.all()
-    total_devices = devices.count()
+    # Summary cards are maintained incrementally, see api.utils.fleet_summary
+    summary = get_fleet_summary()
+    total_devices = summary.total_devices
 
     if total_devices == 0:
         return redirect('onboarding')
 
-    # --- Summary cards ---
-    assessed_devices = devices.filter(rulesets__isnull=False).distinct()
-    assessed_devices_count = assessed_devices.count()
-    compliant_count = assessed_devices.filter(compliant=True).count()
-    non_compliant_count = assessed_devices.filter(compliant=False).count()
-    unknown_count = total_devices - assessed_devices_count
-    compliance_pct = round(compliant_count * 100 / assessed_devices_count) if assessed_devices_count else 0
-    total_warnings = devices.aggregate(total=Sum('warnings'))['total'] or 0
-
-    # Average hardening index (requires parsing reports)
-    hardening_values = []
-    # Track unique device IDs per warning/suggestion: key -> set of device IDs
-    warning_devices = {}  # (test_id, description) -> set of device IDs
-    suggestion_devices = {}  # (test_id, description) -> set of device IDs
-
-    # Fetch latest report per device in bulk: one query per device is acceptable
-    # for dashboards with reasonable fleet sizes.  We iterate devices that have
-    # at least one report.
-    devices_with_reports = devices.filter(
-        id__in=FullReport.objects.values('device_id').distinct()
-    )
-
-    for device in devices_with_reports:
-        latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
-        if not latest_report:
-            continue
-        try:
-            parsed = LynisReport(latest_report.full_report).get_parsed_report()
-        except Exception:
-            continue
-
-        hi = parsed.get('hardening_index')
-        if hi is not None:
-            try:
-                hardening_values.append(int(hi))
-            except (ValueError, TypeError):
-                pass
-
-        # Aggregate warnings - track unique devices per warning (by test_id only)
-        for w in (parsed.get('warning') or []):
-            if isinstance(w, list) and len(w) >= 2:
-                test_id, desc = w[0], w[1]
-                key = test_id  # Use test_id only, not (test_id, description)
-                if key not in warning_devices:
-                    warning_devices[key] = {'devices': set(), 'description': desc}
-                warning_devices[key]['devices'].add(device.id)
-
-        # Aggregate suggestions - track unique devices per suggestion (by test_id only)
-        for s in (parsed.get('suggestion') or []):
-            if isinstance(s, list) and len(s) >= 2:
-                test_id, desc = s[0], s[1]
-                key = test_id  # Use test_id only, not (test_id, description)
-                if key not in suggestion_devices:
-                    suggestion_devices[key] = {'devices': set(), 'description': desc}
-                suggestion_devices[key]['devices'].add(device.id)
-
-    avg_hardening = round(sum(hardening_values) / len(hardening_values)) if hardening_values else None
-
-    # --- OS Distribution ---
-    os_distribution = (
-        devices
-        .exclude(distro__isnull=True)
-        .exclude(distro='')
-        .values('distro', 'distro_version')
-        .annotate(count=Count('id'))
-        .order_by('-count')
-    )
-
-    # --- Top warnings & suggestions (top 5) ---
-    # Sort by number of unique devices (descending) and take top 5
-    top_warnings = [
-        {'test_id': k, 'description': v['description'], 'count': len(v['devices'])}
-        for k, v in sorted(warning_devices.items(), key=lambda x: len(x[1]['devices']), reverse=True)[:5]
-    ]
-    top_suggestions = [
-        {'test_id': k, 'description': v['description'], 'count': len(v['devices'])}
-        for k, v in sorted(suggestion_devices.items(), key=lambda x: len(x[1]['devices']), reverse=True)[:5]
-    ]
+    # Relative values (event ages, days non-compliant) are computed per request, outside the cache
+    cached = cached_fragment('dashboard', '', lambda: _render_dashboard_panels(summary))
 
     # --- Recent activity (last 5 events) ---
     recent_events = DeviceEvent.objects.select_related('device').order_by('-created_at')[:5]
 
     # --- Needs attention: non-compliant for more than 7 days ---
-    non_compliant_devices = devices.filter(compliant=False)
-    attention_items = []
+    # (now - non_compliant_since).days > 7, longest non-compliant first
     now = tz.now()
+    attention_devices = Device.objects.filter(
+        compliant=False,
+        non_compliant_since__lte=now - timedelta(days=8),
+    ).order_by('non_compliant_since')
+    attention_items = [
+        {
+            'device': device,
+            'non_compliant_since': device.non_compliant_since,
+            'days_non_compliant': (now - device.non_compliant_since).days,
+        }
+        for device in attention_devices
+    ]
 
-    for device in non_compliant_devices:
-        # Find when device became non-compliant
-        compliance_event = (
-            DeviceEvent.objects
-            .filter(device=device, event_type='compliance_changed')
-            .order_by('-created_at')
-            .first()
-        )
-        if compliance_event and compliance_event.metadata.get('new_status') == 'Non-Compliant':
-            non_compliant_since = compliance_event.created_at
-        else:
-            # Fallback: use last_update or created_at
-            non_compliant_since = device.last_update or device.created_at
+    context = {
+        'cached': {name: mark_safe(html) for name, html in cached.items()},
+        'recent_events': recent_events,
+        'attention_items': attention_items,
+    }
+    return render(request, 'dashboard.html', context)
 
-        days_non_compliant = (now - non_compliant_since).days
 
-        if days_non_compliant > 7:
-            attention_items.append({
-                'device': device,
-                'non_compliant_since': non_compliant_since,
-                'days_non_compliant': days_non_compliant,
-            })
+def _render_dashboard_panels(summary):
+    """Render the fleet panels of the dashboard (summary cards, OS distribution, top findings)."""
+    total_devices = summary.total_devices
+
+    # --- Summary cards ---
+    compliant_count = summary.compliant
+    non_compliant_count = summary.non_compliant
+    assessed_devices_count = compliant_count + non_compliant_count
+    unknown_count = summary.unknown
+    compliance_pct = round(compliant_count * 100 / assessed_devices_count) if assessed_devices_count else 0
+    total_warnings = summary.warnings_total
+    avg_hardening = round(summary.avg_hardening_index) if summary.hardening_count else None
+
+    # --- OS Distribution ---
+    os_distribution = fleet_os_distribution()
 
-    # Sort by longest non-compliant first
-    attention_items.sort(key=lambda x: x['days_non_compliant'], reverse=True)
+    # --- Top warnings & suggestions (top 5) ---
+    # Sorted by number of unique devices (descending), from the findings of the latest reports
+    top_warnings = top_findings('warning', limit=5)
+    top_suggestions = top_findings('suggestion', limit=5)
 
     context = {
         'total_devices': total_devices,
@@ -234,10 +174,33 @@ def dashboard(request):
         'os_distribution': os_distribution,
         'top_warnings': top_warnings,
         'top_suggestions': top_suggestions,
-        'recent_events': recent_events,
-        'attention_items': attention_items,
     }
-    return render(request, 'dashboard.html', context)
+    return {
+        'summary_cards': render_to_string('dashboard/summary_cards.html', context),
+        'os_distribution': render_to_string('dashboard/os_distribution.html', context),
+        'top_findings': render_to_string('dashboard/top_findings.html', context),
+    }
+
+
+@login_required
+def compliance_trends(request):
+    """Compliance trends: daily snapshot counts of the fleet, a label, a ruleset or a license (JSON)"""
+    scope = request.GET.get('scope', 'fleet')
+    if scope not in dict(ComplianceSnapshot.SCOPE_CHOICES):
+        return JsonResponse({'success': False, 'error': f'Unknown scope "{scope}"'}, status=400)
+    try:
+        scope_id = FLEET_SCOPE_ID if scope == 'fleet' else int(request.GET.get('id', ''))
+        days = min(max(int(request.GET.get('days', 90)), 1), COMPLIANCE_TRENDS_MAX_DAYS)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'id and days must be integers'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'scope': scope,
+        'id': scope_id,
+        'days': days,
+        'points': compliance_trend(scope, scope_id, days),
+    })
 
 
 @login_required
@@ -392,183 +355,274 @@ def onboarding(request):
     })
 
 @login_required
+@replica_reads
 def device_list(request):
     """Device list view: show all devices."""
-    from django.utils import timezone as tz
+    # The list only depends on the query string and fleet data, so it is shared by all users
+    content = cached_fragment('device_list', request.GET.urlencode(), lambda: _render_device_list_content(request))
+    content = _fill_days_non_compliant(content, tz.now())
+    return render(request, 'device_list.html', {'content': mark_safe(content)})
 
-    now = tz.now()
 
-    def enrich_device_for_list(device, parsed_report):
-        """Attach computed fields used by the device list optional columns."""
-        device.hardening_index = None
-        device.uptime_in_days = None
-        device.trikusec_plugin_installed = False
-        device.antivirus_installed = False
-        device.vulnerable_packages_count = 0
-        device.total_days_non_compliant = 0
+# Placeholder of the days a listed device has been non-compliant, which the cached device
+# list cannot contain
+NON_COMPLIANT_SINCE_PLACEHOLDER = re.compile(r'<!--non-compliant-since:(\d+)-->')
 
-        if isinstance(parsed_report, dict):
-            device.hardening_index = parsed_report.get('hardening_index', None)
 
-            uptime_days = parsed_report.get('uptime_in_days')
-            try:
-                device.uptime_in_days = int(uptime_days) if uptime_days is not None else None
-            except (TypeError, ValueError):
-                device.uptime_in_days = None
-
-            installed_package_names = parsed_report.get('installed_package_names') or []
-            if not isinstance(installed_package_names, list):
-                installed_package_names = []
-
-            device.trikusec_plugin_installed = parsed_report.get('trikusec_custom_tests') in (1, '1', True)
-            if not device.trikusec_plugin_installed:
-                device.trikusec_plugin_installed = any(
-                    'trikusec' in pkg.lower() and 'plugin' in pkg.lower()
-                    for pkg in installed_package_names
-                    if isinstance(pkg, str)
-                )
-
-            malware_scanner_installed = parsed_report.get('malware_scanner_installed')
-            clamav_version = parsed_report.get('clamav_version')
-            known_antivirus_packages = {'clamav', 'rkhunter', 'chkrootkit'}
-            package_antivirus_installed = any(
-                any(av_pkg in pkg.lower() for av_pkg in known_antivirus_packages)
-                for pkg in installed_package_names
-                if isinstance(pkg, str)
-            )
-            device.antivirus_installed = (
-                malware_scanner_installed in (1, '1', True)
-                or bool(clamav_version)
-                or package_antivirus_installed
-            )
+def _fill_days_non_compliant(content, now):
+    """Replace the non-compliant-since placeholders of the device list with the days since then."""
+    def days_badge(match):
+        since = datetime.fromtimestamp(int(match.group(1)), tz=dt_timezone.utc)
+        days = max(0, (now - since).days)
+        if days > 0:
+            return format_html('<span class="bg-red-200 text-red-600 py-1 px-3 rounded-full text-xs">{}</span>', days)
+        return '<span class="bg-gray-200 text-gray-700 py-1 px-3 rounded-full text-xs">0</span>'
 
-            vulnerable_packages_found = parsed_report.get('vulnerable_packages_found')
-            if vulnerable_packages_found is None:
-                vulnerable_packages = parsed_report.get('vulnerable_package')
-                if isinstance(vulnerable_packages, list):
-                    device.vulnerable_packages_count = len(vulnerable_packages)
-                else:
-                    device.vulnerable_packages_count = 0
-            else:
-                try:
-                    device.vulnerable_packages_count = int(vulnerable_packages_found)
-                except (TypeError, ValueError):
-                    device.vulnerable_packages_count = 0
-
-        if device.ruleset_count > 0 and not device.compliant:
-            compliance_event = (
-                DeviceEvent.objects
-                .filter(device=device, event_type='compliance_changed')
-                .order_by('-created_at')
-                .first()
-            )
+    return NON_COMPLIANT_SINCE_PLACEHOLDER.sub(days_badge, content)
 
-            if compliance_event and compliance_event.metadata.get('new_status') == 'Non-Compliant':
-                non_compliant_since = compliance_event.created_at
-            else:
-                non_compliant_since = device.last_update or device.created_at
 
-            elapsed_days = (now - non_compliant_since).days if non_compliant_since else 0
-            device.total_days_non_compliant = max(0, elapsed_days)
+def _filter_device_list(params):
+    """
+    Apply the device list filters in params (request.GET) to the listed devices.
+
+    Returns (devices, has_devices, label_filter, finding_filter, column_filters); has_devices
+    tells whether any device matches the label and finding filters.
+    """
+    devices_qs = device_list_queryset()
 
-    devices_qs = Device.objects.annotate(ruleset_count=Count('rulesets', distinct=True))
-    
     # Handle label filtering
-    label_filter = request.GET.get('label', None)
+    label_filter = params.get('label', None)
     try:
         label_filter = int(label_filter) if label_filter else None
     except (ValueError, TypeError):
         label_filter = None
-    
+
     if label_filter is not None:
         devices_qs = devices_qs.filter(labels__id=label_filter)
-    
-    # Get all labels for filter display
-    all_labels = Label.objects.annotate(device_count=Count('devices')).order_by('name')
-    
-    has_devices = devices_qs.exists()
 
-    # Handle sorting
-    sort_field = request.GET.get('sort', 'last_update')
-    sort_order = request.GET.get('order', 'desc')
+    # Handle finding filtering: devices whose latest report has a given warning or suggestion
+    finding_filter = None
+    for finding_type in ('warning', 'suggestion'):
+        test_id = params.get(finding_type, '').strip()
+        if test_id:
+            devices_qs = devices_with_finding(finding_type, test_id, devices_qs)
+            finding_filter = {'type': finding_type, 'test_id': test_id}
 
-    # Validate sort field to prevent SQL injection
-    valid_sort_fields = {
-        'hostname': 'hostname',
-        'compliant': 'compliant',
-        'warnings': 'warnings',
-        'last_update': 'last_update',
-        'hardening_index': 'hardening_index',
-    }
+    has_devices = devices_qs.exists()
 
-    # Default to last_update if invalid sort field
-    sort_field = valid_sort_fields.get(sort_field, 'last_update')
+    # Handle license, OS, compliance and report column filters
+    devices_qs, column_filters = apply_column_filters(devices_qs, params)
+    return devices_qs, has_devices, label_filter, finding_filter, column_filters
 
-    # If no devices, return empty list
-    if not has_devices:
-        devices = []
-    # If sorting by hardening_index, we need to extract it first and sort in Python
-    elif sort_field == 'hardening_index':
-        devices = list(devices_qs)
 
-        for device in devices:
-            parsed_report = None
-            latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
-            if latest_report:
-                try:
-                    parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
-                except Exception:
-                    parsed_report = None
-            enrich_device_for_list(device, parsed_report)
-
-        # Sort by hardening_index (treat None as -1 for sorting purposes)
-        reverse_order = sort_order == 'desc'
-        devices.sort(key=lambda d: d.hardening_index if d.hardening_index is not None else -1, reverse=reverse_order)
-    else:
-        # Determine sort order
-        if sort_order == 'asc':
-            order_by = sort_field
-        else:  # default to desc
-            order_by = f'-{sort_field}'
+def _device_list_sort(params):
+    """Return the validated (sort, order) of the device list; defaults to the latest updated first."""
+    sort_field = params.get('sort', DEFAULT_SORT)
+    sort_order = params.get('order', 'desc')
+    # Validate sort field to prevent SQL injection
+    if sort_field not in DEVICE_SORT_FIELDS:
+        sort_field = DEFAULT_SORT
+    if sort_order not in ('asc', 'desc'):
+        sort_order = 'desc'
+    return sort_field, sort_order
 
-        # Order devices by selected field
-        devices = list(devices_qs.order_by(order_by))
 
-        for device in devices:
-            parsed_report = None
-            latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
-            if latest_report:
-                try:
-                    parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
-                except Exception:
-                    parsed_report = None
-            enrich_device_for_list(device, parsed_report)
+def _render_device_list_content(request):
+    """Render the device list table, filters and pagination (the device_list page content)."""
+    devices_qs, has_devices, label_filter, finding_filter, column_filters = _filter_device_list(request.GET)
 
-    paginator = Paginator(devices, DEVICE_LIST_PAGE_SIZE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Get all labels for filter display
+    all_labels = Label.objects.annotate(device_count=Count('devices')).order_by('name')
+
+    # Keyset pagination: only the requested page (plus one row) is read
+    sort_field, sort_order = _device_list_sort(request.GET)
+    devices_qs = devices_qs.prefetch_related('labels')
+    cursor = request.GET.get('cursor')
+    try:
+        page = keyset_page(devices_qs, sort_field, sort_order, cursor, DEVICE_LIST_PAGE_SIZE)
+    except InvalidCursor:
+        # e.g. a bookmarked cursor of another sort order: start over from the first page
+        cursor = None
+        page = keyset_page(devices_qs, sort_field, sort_order, None, DEVICE_LIST_PAGE_SIZE)
+
+    # The devices are only counted for the first page; the following pages get the count from
+    # their pagination links (total), or show none
+    if not cursor:
+        total_count = devices_qs.count() if page.has_next else len(page)
+    else:
+        try:
+            total_count = int(request.GET.get('total', ''))
+        except ValueError:
+            total_count = None
 
-    # Build query string for pagination (excluding page, but including sort/order)
+    # Build query string for pagination (excluding cursor, but including sort/order)
     query_params = request.GET.copy()
-    query_params.pop('page', None)
+    query_params.pop('cursor', None)
     # Ensure sort and order are always included
     query_params['sort'] = sort_field
     query_params['order'] = sort_order
+    query_params.pop('total', None)
+    if total_count is not None:
+        query_params['total'] = total_count
     base_query = query_params.urlencode()
 
-    return render(request, 'device_list.html', {
-        'devices': page_obj,
-        'page_obj': page_obj,
-        'paginator': paginator,
-        'is_paginated': page_obj.has_other_pages(),
+    return render_to_string('device_list_content.html', {
+        'devices': page,
+        'page_obj': page,
+        'total_count': total_count,
+        'is_paginated': page.has_next or page.has_previous,
         'pagination_query': base_query,
         'current_sort': sort_field,
         'current_order': sort_order,
         'has_devices': has_devices,
         'all_labels': all_labels,
         'selected_label': label_filter,
+        'finding_filter': finding_filter,
+        'column_filters': column_filters,
+    })
+
+
+@login_required
+@replica_reads
+def device_list_json(request):
+    """Device list as JSON, with the device list filters and sorting, paginated with cursors."""
+    devices_qs, _, _, _, _ = _filter_device_list(request.GET)
+    sort_field, sort_order = _device_list_sort(request.GET)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEVICE_LIST_PAGE_SIZE)), 1), DEVICE_LIST_JSON_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be an integer'}, status=400)
+    try:
+        page = keyset_page(
+            devices_qs.prefetch_related('labels'), sort_field, sort_order, request.GET.get('cursor'), limit,
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'sort': sort_field,
+        'order': sort_order,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+        'devices': [
+            {
+                'id': device.id,
+                'hostname': device.hostname,
+                'os': device.os,
+                'distro': device.distro,
+                'distro_version': device.distro_version,
+                'lynis_version': device.lynis_version,
+                'last_update': device.last_update,
+                'warnings': device.warnings,
+                # None when no ruleset is assigned (unknown)
+                'compliant': device.compliant if device.has_rulesets else None,
+                'non_compliant_since': device.non_compliant_since,
+                'hardening_index': device.hardening_index,
+                'uptime_in_days': device.uptime_in_days,
+                'trikusec_plugin_installed': device.trikusec_plugin_installed,
+                'antivirus_installed': device.antivirus_installed,
+                'vulnerable_packages_count': device.vulnerable_packages_count,
+                'labels': [label.name for label in device.labels.all()],
+            }
+            for device in page
+        ],
+    })
+
+
+@login_required
+def device_search(request):
+    """
+    Device search for typeahead: devices whose hostname, host IDs, IP or MAC address, OS or
+    labels contain the query (q), filtered like the device list (label, os, compliance, ...).
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', SEARCH_RESULT_LIMIT)), 1), SEARCH_RESULT_LIMIT)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be an integer'}, status=400)
+    devices_qs, _, _, _, _ = _filter_device_list(request.GET)
+
+    return JsonResponse({
+        'success': True,
+        'query': query,
+        'results': [
+            {
+                'id': device.id,
+                'hostname': device.hostname,
+                'ip_address': device.ip_address,
+                'mac_address': device.mac_address,
+                'os': device.os,
+                'distro': device.distro,
+                # None when no ruleset is assigned (unknown)
+                'compliant': device.compliant if device.has_rulesets else None,
+                'labels': [label.name for label in device.labels.all()],
+                'url': reverse('device_detail', args=[device.id]),
+            }
+            for device in search_devices(query, devices_qs, limit)
+        ],
     })
 
+
+def _bulk_device_selection(params):
+    """
+    Return the ids of the devices selected for a bulk operation, or None if nothing selects them.
+
+    Devices are selected by id (device_ids), or by the device list filters (label, warning,
+    column filters, ...) and a search query (q).
+    """
+    device_ids = params.getlist('device_ids')
+    if device_ids:
+        return [int(device_id) for device_id in device_ids]
+
+    filter_params = {'label', 'warning', 'suggestion', 'q', *COLUMN_FILTERS}
+    if not any((params.get(param) or '').strip() for param in filter_params):
+        return None
+    devices_qs, _, _, _, _ = _filter_device_list(params)
+    query = (params.get('q') or '').strip()
+    if query:
+        devices_qs = matching_devices(query, devices_qs)
+    return list(devices_qs.values_list('id', flat=True))
+
+
+def _bulk_update_devices(request, relation):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        device_ids = _bulk_device_selection(request.POST)
+        add_ids = [int(object_id) for object_id in request.POST.getlist('add') if object_id]
+        remove_ids = [int(object_id) for object_id in request.POST.getlist('remove') if object_id]
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid IDs'}, status=400)
+    if device_ids is None:
+        return JsonResponse({'success': False, 'error': 'No devices selected'}, status=400)
+
+    result = bulk_update_relation(relation, device_ids, add_ids, remove_ids, request.user)
+    job = result['compliance_job']
+    return JsonResponse({
+        'success': True,
+        'devices': len(device_ids),
+        'added': result['added'],
+        'removed': result['removed'],
+        'compliance_job': compliance_job_status(job) if job else None,
+        'compliance_job_url': reverse('compliance_job_status', kwargs={'job_id': job.id}) if job else None,
+    })
+
+
+@login_required
+@csrf_protect
+def devices_bulk_rulesets(request):
+    """Add and remove rulesets (add, remove) on a selection of devices, then recompute their compliance once."""
+    return _bulk_update_devices(request, 'rulesets')
+
+
+@login_required
+@csrf_protect
+def devices_bulk_labels(request):
+    """Add and remove labels (add, remove) on a selection of devices."""
+    return _bulk_update_devices(request, 'labels')
+
+
 @login_required
 def device_detail(request, device_id):
     """Device detail view: show the details of a device"""
@@ -587,9 +641,9 @@ def device_detail(request, device_id):
     if not report:
         return HttpResponse('Failed to parse the report', status=500)
     
-    # Only check compliance for display purposes, don't update device or create events
-    # Compliance updates and events should only happen on report upload
-    compliant, evaluated_rulesets = check_device_compliance(device, report)
+    # Read the results stored at upload time; the report is only evaluated for rules without a
+    # current stored result. Compliance updates and events should only happen on report upload
+    compliant, evaluated_rulesets = get_device_compliance(device, report)
 
     # Get all rulesets (used to select the rulesets for the device from the side-panel)
     policy_rulesets = PolicyRuleset.objects.prefetch_related('rules').all()
@@ -663,7 +717,7 @@ def device_update(request, device_id):
             if latest_report:
                 parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
                 if isinstance(parsed_report, dict) and parsed_report:
-                    update_device_compliance(device, parsed_report)
+                    update_device_compliance(device, parsed_report, latest_report)
                 else:
                     logging.warning('Skipping compliance update for device %s: latest report could not be parsed', device.id)
 
@@ -712,6 +766,7 @@ def device_delete(request, device_id):
     return HttpResponse('Method not allowed', status=405)
 
 @login_required
+@replica_reads
 def device_export_pdf(request, device_id):
     """Export device report to PDF"""
     device = get_object_or_404(Device, id=device_id)
@@ -733,9 +788,9 @@ def device_export_pdf(request, device_id):
     if 'hostname' not in report:
         return HttpResponse('Failed to parse the report', status=500)
     
-    # Only check compliance for display purposes, don't update device or create events
-    # Compliance updates and events should only happen on report upload
-    compliant, evaluated_rulesets = check_device_compliance(device, report)
+    # Read the results stored at upload time; the report is only evaluated for rules without a
+    # current stored result. Compliance updates and events should only happen on report upload
+    compliant, evaluated_rulesets = get_device_compliance(device, report)
     
     # Render HTML template
     html_string = render_to_string('device/device_pdf.html', {
@@ -895,7 +950,7 @@ def policy_list(request):
     
     # Pagination for rules (10 per page)
     rule_page = request.GET.get('rule_page', 1)
-    rules = PolicyRule.objects.prefetch_related('policyruleset_set').all().order_by(rule_order_by)
+    rules = PolicyRule.objects.select_related('stats').prefetch_related('policyruleset_set').all().order_by(rule_order_by)
     rule_paginator = Paginator(rules, 10)
     rules_page_obj = rule_paginator.get_page(rule_page)
     
@@ -1067,8 +1122,24 @@ def ruleset_detail(request, ruleset_id):
     # Get rules in this ruleset
     rules = ruleset.rules.all().order_by('name')
     
-    # Get devices using this ruleset
-    devices = ruleset.devices.all().order_by('hostname')
+    # Get devices using this ruleset, with their stored compliance for the ruleset's enabled rules
+    devices = list(ruleset.devices.all().order_by('hostname'))
+    enabled_rule_ids = set(ruleset.rules.filter(enabled=True).values_list('id', flat=True))
+    ruleset_results = {}
+    for device_id, passed in ComplianceResult.objects.filter(
+        device__in=[device.id for device in devices], rule_id__in=enabled_rule_ids
+    ).values_list('device_id', 'passed'):
+        ruleset_results.setdefault(device_id, []).append(passed)
+    for device in devices:
+        results = ruleset_results.get(device.id, [])
+        if not enabled_rule_ids:
+            device.ruleset_status = 'pass'
+        elif any(passed is not True for passed in results):
+            device.ruleset_status = 'fail'
+        elif len(results) == len(enabled_rule_ids):
+            device.ruleset_status = 'pass'
+        else:
+            device.ruleset_status = 'unknown'
     
     # Get all rules for rule selection sidebar
     all_rules = PolicyRule.objects.all().order_by('name')
@@ -1123,7 +1194,7 @@ def ruleset_remove_device(request, ruleset_id, device_id):
     if latest_report:
         parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
         if isinstance(parsed_report, dict) and parsed_report:
-            update_device_compliance(device, parsed_report)
+            update_device_compliance(device, parsed_report, latest_report)
         else:
             logging.warning('Skipping compliance update for device %s: latest report could not be parsed', device.id)
 
@@ -1152,13 +1223,8 @@ def ruleset_update(request, ruleset_id):
             ruleset.rules.set(selected_rules)
             ruleset.save()
 
-            refreshed, skipped = refresh_device_compliance_for_queryset(ruleset.devices.all())
-            logging.info(
-                'Refreshed compliance after ruleset %s update (selection mode): %s refreshed, %s skipped',
-                ruleset.id,
-                refreshed,
-                skipped,
-            )
+            job = enqueue_compliance_job('ruleset', ruleset.id, request.user)
+            logging.info('Scheduled compliance job %s after ruleset %s update (selection mode)', job.id, ruleset.id)
 
             return redirect('policy_list')
         
@@ -1220,13 +1286,8 @@ def ruleset_update(request, ruleset_id):
                 ruleset.rules.set(selected_rules)
                 ruleset.save()
             
-            refreshed, skipped = refresh_device_compliance_for_queryset(ruleset.devices.all())
-            logging.info(
-                'Refreshed compliance after ruleset %s update: %s refreshed, %s skipped',
-                ruleset.id,
-                refreshed,
-                skipped,
-            )
+            job = enqueue_compliance_job('ruleset', ruleset.id, request.user)
+            logging.info('Scheduled compliance job %s after ruleset %s update', job.id, ruleset.id)
 
             # AJAX request: return JSON
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -1234,8 +1295,10 @@ def ruleset_update(request, ruleset_id):
                     'success': True,
                     'ruleset_id': ruleset.id,
                     'message': 'Ruleset updated successfully',
-                    'compliance_refreshed': refreshed,
-                    'compliance_skipped': skipped,
+                    'compliance_refreshed': job.refreshed,
+                    'compliance_skipped': job.skipped,
+                    'compliance_job': compliance_job_status(job),
+                    'compliance_job_url': reverse('compliance_job_status', kwargs={'job_id': job.id}),
                 })
             
             # Traditional request: redirect
@@ -1340,30 +1403,47 @@ def rule_detail(request, rule_id):
     rulesets = rule.policyruleset_set.all().order_by('name')
 
     # Get devices that have this rule configured via at least one assigned ruleset
-    configured_devices_qs = Device.objects.filter(rulesets__rules=rule).distinct().order_by('hostname', 'hostid')
-    configured_devices = []
+    configured_devices_qs = (
+        Device.objects.filter(rulesets__rules=rule)
+        .distinct()
+        .annotate(last_report_at=Max('fullreport__created_at'))
+        .prefetch_related(Prefetch(
+            'rulesets',
+            queryset=PolicyRuleset.objects.filter(rules=rule).order_by('name'),
+            to_attr='matching_rulesets',
+        ))
+        .order_by('hostname', 'hostid')
+    )
 
-    for device in configured_devices_qs:
-        latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
-        matching_rulesets = list(device.rulesets.filter(rules=rule).order_by('name').values_list('name', flat=True))
+    # Stored results for all configured devices in one query
+    stored_results = {
+        result.device_id: result
+        for result in ComplianceResult.objects.filter(rule=rule, device__in=configured_devices_qs)
+    }
 
+    configured_devices = []
+    for device in configured_devices_qs:
         status = 'unknown'
         status_label = 'No report'
-        last_report_at = latest_report.created_at if latest_report else None
-
-        if latest_report:
-            parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
-            if isinstance(parsed_report, dict) and parsed_report:
-                evaluation_result = rule.evaluate(parsed_report)
-                if evaluation_result is True:
-                    status = 'pass'
-                    status_label = 'Pass'
-                elif evaluation_result is False:
-                    status = 'fail'
-                    status_label = 'Fail'
-                else:
-                    status = 'unknown'
-                    status_label = 'Unknown'
+
+        if device.last_report_at:
+            result = stored_results.get(device.id)
+            if result is not None and result.evaluated_at >= rule.updated_at:
+                evaluation_result = result.passed
+            else:
+                # No current stored result (e.g. not recomputed yet): evaluate the latest report
+                evaluation_result = None
+                latest_report = FullReport.objects.filter(device=device).order_by('-created_at').first()
+                parsed_report = LynisReport(latest_report.full_report).get_parsed_report()
+                if isinstance(parsed_report, dict) and parsed_report:
+                    evaluation_result = rule.evaluate(parsed_report)
+
+            if evaluation_result is True:
+                status = 'pass'
+                status_label = 'Pass'
+            elif evaluation_result is False:
+                status = 'fail'
+                status_label = 'Fail'
             else:
                 status = 'unknown'
                 status_label = 'Unknown'
@@ -1372,8 +1452,8 @@ def rule_detail(request, rule_id):
             'device': device,
             'status': status,
             'status_label': status_label,
-            'rulesets': matching_rulesets,
-            'last_report_at': last_report_at,
+            'rulesets': [ruleset.name for ruleset in device.matching_rulesets],
+            'last_report_at': device.last_report_at,
         })
 
     # Serialize rule for JavaScript
@@ -1388,9 +1468,17 @@ def rule_detail(request, rule_id):
         'updated_at': rule.updated_at.isoformat(),
     }
 
+    # Report keys the rule reads (None: the query can read any key)
+    query_fields = rule.query_fields
+    if query_fields is not None:
+        query_fields = sorted(query_fields)
+
     context = {
         'rule': rule,
         'rulesets': rulesets,  # Rulesets using this rule
+        'query_fields': query_fields,
+        'rule_stats': PolicyRuleStats.objects.filter(rule=rule).first(),
+        'slow_rule_threshold_ms': settings.RULE_SLOW_THRESHOLD_MS,
         'configured_devices': configured_devices,
         'rule_json': json.dumps(rule_data),
     }
@@ -1423,14 +1511,8 @@ def rule_update(request, rule_id):
                 rule.created_by = request.user
             rule.save()
 
-            affected_devices = Device.objects.filter(rulesets__rules=policy_rule).distinct()
-            refreshed, skipped = refresh_device_compliance_for_queryset(affected_devices)
-            logging.info(
-                'Refreshed compliance after rule %s update: %s refreshed, %s skipped',
-                policy_rule.id,
-                refreshed,
-                skipped,
-            )
+            job = enqueue_compliance_job('rule', policy_rule.id, request.user)
+            logging.info('Scheduled compliance job %s after rule %s update', job.id, policy_rule.id)
             
             # AJAX request: return JSON
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -1438,8 +1520,10 @@ def rule_update(request, rule_id):
                     'success': True,
                     'rule_id': policy_rule.id,
                     'message': 'Rule updated successfully',
-                    'compliance_refreshed': refreshed,
-                    'compliance_skipped': skipped,
+                    'compliance_refreshed': job.refreshed,
+                    'compliance_skipped': job.skipped,
+                    'compliance_job': compliance_job_status(job),
+                    'compliance_job_url': reverse('compliance_job_status', kwargs={'job_id': job.id}),
                 })
             
             # Traditional request: redirect to referer or rule list
@@ -1499,6 +1583,44 @@ def rule_add(request):
     """Rule add view: add a new policy rule"""
     return render(request, 'policy/rule_form.html')
 
+@login_required
+@csrf_protect
+def rule_preview(request):
+    """Rule preview view: evaluate a draft query against the latest report of every device (AJAX)"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    query = request.POST.get('rule_query', '').strip()
+    if not query:
+        return JsonResponse({'success': False, 'error': 'Rule query is required'}, status=400)
+
+    # Optional scope: a label and/or a license key
+    devices = Device.objects.all()
+    try:
+        label_id = int(request.POST['label']) if request.POST.get('label') else None
+        license_id = int(request.POST['license']) if request.POST.get('license') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid label or license'}, status=400)
+    if label_id is not None:
+        devices = devices.filter(labels__id=label_id)
+    if license_id is not None:
+        devices = devices.filter(licensekey__id=license_id)
+
+    try:
+        preview = preview_query(query, devices.distinct(), settings.RULE_PREVIEW_TIME_BUDGET)
+    except jmespath.exceptions.JMESPathError as e:
+        return JsonResponse({'success': False, 'error': f'Invalid JMESPath query: {e}'}, status=400)
+
+    return JsonResponse({'success': True, **preview})
+
+
+@login_required
+def compliance_job_status_view(request, job_id):
+    """Compliance job status: progress of a background compliance recompute (polled by the UI)"""
+    job = get_object_or_404(ComplianceJob, id=job_id)
+    return JsonResponse(compliance_job_status(job))
+
+
 @login_required
 def rule_evaluate_for_device(request, device_id, rule_id):
     """Rule evaluation view: evaluate a rule against device's last report and return debug information"""
@@ -1570,28 +1692,15 @@ def rule_evaluate_for_device(request, device_id, rule_id):
     field_values = {}
     if not evaluation_passed:
         # Only extract field values when the rule fails (to help debug)
-        # Extract field names from common JMESPath patterns:
-        # - Simple field access: field_name
-        # - Comparisons: field_name ==, field_name >, etc.
-        # - Functions: contains(field_name, ...), field_name in ...
-        # Pattern matches valid field names (letters, numbers, underscores, hyphens)
-        field_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_-]*)\b'
-        # Exclude JMESPath keywords and functions
-        excluded = {'contains', 'length', 'keys', 'values', 'to_string', 'to_number', 
-                    'not_null', 'abs', 'avg', 'ceil', 'floor', 'max', 'min', 'sum',
-                    'true', 'false', 'null', 'and', 'or', 'not'}
-        
-        matches = re.findall(field_pattern, rule.rule_query)
-        for field_name in matches:
-            if field_name not in excluded and field_name[0].isalpha():
-                # Check if this looks like a field name (not a number or operator)
-                if field_name in parsed_report:
-                    value = parsed_report[field_name]
-                    # Format the value for display
-                    if isinstance(value, list):
-                        field_values[field_name] = ', '.join(str(v) for v in value)
-                    else:
-                        field_values[field_name] = str(value)
+        # The report keys the query reads are taken from its parsed JMESPath AST
+        for field_name in sorted(rule.query_fields or ()):
+            if field_name in parsed_report:
+                value = parsed_report[field_name]
+                # Format the value for display
+                if isinstance(value, list):
+                    field_values[field_name] = ', '.join(str(v) for v in value)
+                else:
+                    field_values[field_name] = str(value)
     
     return JsonResponse({
         'success': True,
@@ -1606,6 +1715,7 @@ def rule_evaluate_for_device(request, device_id, rule_id):
 
 
 @login_required
+@replica_reads
 def activity(request):
     """Activity view: show the activity of the devices (from DiffReport)"""
 
@@ -1616,8 +1726,24 @@ def activity(request):
     max_history_items = 500
     preview_limit = 3
 
-    # Get all diff reports (from most recent to oldest)
-    diff_reports = DiffReport.objects.all().order_by('-created_at')[:max_history_items]
+    # The latest history, read from the latest monthly partitions until enough is found;
+    # filtering on a day reads that day's history instead
+    history_range = {}
+    filter_date = request.GET.get('date', '').strip()
+    if filter_date:
+        try:
+            day = datetime.strptime(filter_date, '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+            history_range = {'created_at__gte': day, 'created_at__lt': day + timedelta(days=1)}
+        except ValueError:
+            pass
+
+    def history(queryset):
+        if history_range:
+            return queryset.filter(**history_range).order_by('-created_at')[:max_history_items]
+        return latest_history(queryset, max_history_items)
+
+    # Get the diff reports (from most recent to oldest)
+    diff_reports = history(DiffReport.objects.all())
     
     # Let's humanize the diff reports to show them in the template
     for diff_report in diff_reports:
@@ -1747,7 +1873,7 @@ def activity(request):
     
     # Merge device events (not affected by silence rules)
     combined_activities = list(activities)
-    device_events = DeviceEvent.objects.select_related('device').order_by('-created_at')[:max_history_items]
+    device_events = history(DeviceEvent.objects.select_related('device'))
     event_activities = []
     for event in device_events:
         # Map event types to activity types
@@ -1785,7 +1911,6 @@ def activity(request):
     if combined_activities:
         from collections import OrderedDict, defaultdict
         from django.utils import timezone
-        from datetime import timedelta
 
         def get_time_period_label(timestamp):
             """Generate a human-readable time period label for grouping."""
@@ -1908,7 +2033,6 @@ def activity(request):
     # Apply filters from query parameters
     filter_type = request.GET.get('type', '').strip()
     filter_device_id = request.GET.get('device', '').strip()
-    filter_date = request.GET.get('date', '').strip()
     
     if filter_type or filter_device_id or filter_date:
         filtered_grouped_activities = []
@@ -1932,7 +2056,6 @@ def activity(request):
             if filter_date:
                 entry_date = entry['timestamp'].date()
                 try:
-                    from datetime import datetime
                     filter_date_obj = datetime.strptime(filter_date, '%Y-%m-%d').date()
                     if entry_date != filter_date_obj:
                         continue
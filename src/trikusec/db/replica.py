@@ -0,0 +1,120 @@
+"""
+Read replica routing (DATABASE_REPLICA_URL).
+
+Only views decorated with @replica_reads read from the replica; all other reads and all
+writes use the primary. A decorated view still reads from the primary when:
+
+- its session wrote within DATABASE_REPLICA_STICKY_SECONDS (read-your-writes, see
+  api.middleware.ReplicaStickinessMiddleware)
+- the replica is more than DATABASE_REPLICA_MAX_LAG seconds behind, or unreachable
+- the view already wrote, or runs inside a transaction on the primary
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+REPLICA_DB_ALIAS = 'replica'
+# Session key holding the time (epoch seconds) until which the session reads from the primary
+SESSION_PRIMARY_UNTIL_KEY = '_db_primary_until'
+# Replication lag in seconds; 0 when the replica has replayed everything it received (an
+# idle primary would otherwise look like a growing lag) or is not a standby at all
+LAG_QUERY = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+_use_replica = contextvars.ContextVar('trikusec_use_replica', default=False)
+_wrote = contextvars.ContextVar('trikusec_wrote_primary', default=False)
+# Last replica health check of this process
+_health_lock = threading.Lock()
+_health = {'checked_at': None, 'available': False}
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def replica_lag():
+    """Return the replication lag of the replica, in seconds."""
+    with connections[REPLICA_DB_ALIAS].cursor() as cursor:
+        cursor.execute(LAG_QUERY)
+        return float(cursor.fetchone()[0] or 0)
+
+
+def replica_available():
+    """Whether the replica is reachable and within DATABASE_REPLICA_MAX_LAG (checked periodically)."""
+    with _health_lock:
+        now = time.monotonic()
+        checked_at = _health['checked_at']
+        if checked_at is not None and now - checked_at < settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+            return _health['available']
+        try:
+            lag = replica_lag()
+            available = lag <= settings.DATABASE_REPLICA_MAX_LAG
+            if not available:
+                logging.warning('Read replica is %.1f s behind, reading from the primary', lag)
+        except DatabaseError as e:
+            logging.warning('Read replica is unavailable, reading from the primary: %s', e)
+            available = False
+        _health.update(checked_at=now, available=available)
+        return available
+
+
+def stick_to_primary(session):
+    """Make the session read from the primary for DATABASE_REPLICA_STICKY_SECONDS."""
+    session[SESSION_PRIMARY_UNTIL_KEY] = time.time() + settings.DATABASE_REPLICA_STICKY_SECONDS
+
+
+def is_sticky(request):
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(SESSION_PRIMARY_UNTIL_KEY, 0) > time.time()
+
+
+@contextmanager
+def read_from_replica(request=None):
+    """Route the reads of the block to the replica, unless one of the fallbacks applies."""
+    use_replica = replica_configured() and not (request is not None and is_sticky(request)) and replica_available()
+    use_token = _use_replica.set(use_replica)
+    wrote_token = _wrote.set(False)
+    try:
+        yield use_replica
+    finally:
+        _use_replica.reset(use_token)
+        _wrote.reset(wrote_token)
+
+
+def replica_reads(view):
+    """View decorator: the view's reads may be served by the read replica."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with read_from_replica(request):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Send reads inside read_from_replica() to the replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and not _wrote.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Later reads of the same view must see this write
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
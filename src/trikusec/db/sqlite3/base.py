@@ -0,0 +1,95 @@
+"""
+SQLite backend retrying statements that fail with "database is locked", and supporting the
+partitioned history tables.
+
+The admin UI and the Lynis API share one SQLite file. busy_timeout makes a connection wait
+for a lock, but SQLite gives up immediately when waiting could deadlock, and a long wait can
+still run out. Statements run outside a transaction (including the BEGIN of a transaction)
+are retried after a random delay growing with each attempt; statements inside a transaction
+are not, as the transaction's earlier statements would have to be replayed.
+
+The history tables are views over monthly tables on SQLite (api.utils.history_partitions),
+written through INSTEAD OF triggers. SQLite reports no changed rows for such statements,
+while Django relies on the count (an UPDATE of no rows makes save() INSERT instead), so it is
+derived from the rows the triggers changed. Flushing the database (tests) empties the monthly
+tables, and schema changes are applied to them (see trikusec.db.sqlite3.schema).
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db.backends.sqlite3 import base, operations
+from django.db.backends.sqlite3.base import Database
+
+from .schema import DatabaseSchemaEditor
+
+
+def is_lock_error(error):
+    return isinstance(error, Database.OperationalError) and 'locked' in str(error)
+
+
+# Rows changed by the history views' triggers per row updated (deleted and re-inserted into
+# the partition of its created_at) and per row deleted
+TRIGGER_CHANGES_PER_ROW = {'UPDATE': 2, 'DELETE': 1}
+
+
+def retry_on_lock(func, attempts=None, base_delay=None):
+    """Call func, retrying with full jitter backoff while it fails with a lock error."""
+    attempts = settings.SQLITE_LOCK_RETRIES + 1 if attempts is None else attempts
+    base_delay = settings.SQLITE_LOCK_RETRY_DELAY if base_delay is None else base_delay
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Database.OperationalError as e:
+            if not is_lock_error(e) or attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    _trigger_rowcount = None
+
+    @property
+    def rowcount(self):
+        if self._trigger_rowcount is not None:
+            return self._trigger_rowcount
+        return super().rowcount
+
+    def execute(self, query, params=None):
+        self._trigger_rowcount = None
+        changes_before = self.connection.total_changes
+        if self.connection.in_transaction:
+            result = super().execute(query, params)
+        else:
+            result = retry_on_lock(lambda: super(SQLiteCursorWrapper, self).execute(query, params))
+        statement = query.lstrip()[:6].upper()
+        if statement in TRIGGER_CHANGES_PER_ROW and super().rowcount == 0:
+            changes = self.connection.total_changes - changes_before
+            if changes:
+                self._trigger_rowcount = changes // TRIGGER_CHANGES_PER_ROW[statement]
+        return result
+
+    def executemany(self, query, param_list):
+        if self.connection.in_transaction:
+            return super().executemany(query, param_list)
+        param_list = list(param_list)
+        return retry_on_lock(lambda: super(SQLiteCursorWrapper, self).executemany(query, param_list))
+
+
+class DatabaseOperations(operations.DatabaseOperations):
+    def sql_flush(self, style, tables, *, reset_sequences=False, allow_cascade=False):
+        from api.utils.history_partitions import partition_tables  # Avoid circular import
+
+        # The history views are not flushed (nor could they be emptied quickly): their
+        # partitions are
+        if tables:
+            tables = [*tables, *partition_tables(self.connection.alias)]
+        return super().sql_flush(style, tables, reset_sequences=reset_sequences, allow_cascade=allow_cascade)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    SchemaEditorClass = DatabaseSchemaEditor
+    ops_class = DatabaseOperations
+
+    def create_cursor(self, name=None):
+        return self.connection.cursor(factory=SQLiteCursorWrapper)
@@ -0,0 +1,74 @@
+"""
+Schema editor applying schema changes to the partitioned history tables.
+
+On SQLite, the history tables are views over monthly tables (api.utils.history_partitions),
+which Django's schema changes (rebuilding the table, adding an index) cannot be applied to.
+Before the first change to such a table, its months are merged back into a plain table;
+after the last one (and the deferred statements, such as index creation), it is split into
+the same months again.
+"""
+from functools import wraps
+
+from django.db.backends.sqlite3 import schema
+
+
+def _merging_partitions(method):
+    @wraps(method)
+    def wrapper(self, model, *args, **kwargs):
+        self._merge_partitions(model._meta.db_table)
+        return method(self, model, *args, **kwargs)
+    return wrapper
+
+
+class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
+    def __enter__(self):
+        # {table: months} of the partitioned tables merged for the changes
+        self._merged_partitions = {}
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self._merged_partitions:
+            for sql in self.deferred_sql:
+                self.execute(sql)
+            self.deferred_sql = []
+            self._split_partitions()
+        super().__exit__(exc_type, exc_value, traceback)
+
+    def _merge_partitions(self, table):
+        from api.utils.history_partitions import (  # Avoid circular import
+            HISTORY_TABLES, is_partitioned, partition_months, sqlite_unpartition,
+        )
+
+        if table not in HISTORY_TABLES or table in self._merged_partitions:
+            return
+        if not is_partitioned(table, self.connection.alias):
+            return
+        months = partition_months(table, self.connection.alias)
+        with self.connection.cursor() as cursor:
+            sqlite_unpartition(cursor, table)
+        self._merged_partitions[table] = months
+
+    def _split_partitions(self):
+        from api.utils.history_partitions import sqlite_partition  # Avoid circular import
+
+        with self.connection.cursor() as cursor:
+            for table, months in self._merged_partitions.items():
+                # The table may have been deleted
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+                if cursor.fetchone():
+                    sqlite_partition(cursor, table, months)
+        self._merged_partitions = {}
+
+    delete_model = _merging_partitions(schema.DatabaseSchemaEditor.delete_model)
+    add_field = _merging_partitions(schema.DatabaseSchemaEditor.add_field)
+    remove_field = _merging_partitions(schema.DatabaseSchemaEditor.remove_field)
+    alter_field = _merging_partitions(schema.DatabaseSchemaEditor.alter_field)
+    add_index = _merging_partitions(schema.DatabaseSchemaEditor.add_index)
+    remove_index = _merging_partitions(schema.DatabaseSchemaEditor.remove_index)
+    rename_index = _merging_partitions(schema.DatabaseSchemaEditor.rename_index)
+    add_constraint = _merging_partitions(schema.DatabaseSchemaEditor.add_constraint)
+    remove_constraint = _merging_partitions(schema.DatabaseSchemaEditor.remove_constraint)
+    alter_unique_together = _merging_partitions(schema.DatabaseSchemaEditor.alter_unique_together)
+    alter_index_together = _merging_partitions(schema.DatabaseSchemaEditor.alter_index_together)
+    # Also rebuilds the tables of the fields related to an altered primary key
+    _remake_table = _merging_partitions(schema.DatabaseSchemaEditor._remake_table)
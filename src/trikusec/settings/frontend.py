@@ -25,6 +25,14 @@ MIDDLEWARE = [
     'api.middleware.AuditLoggingMiddleware',
 ]
 
+# With a read replica, sessions that just wrote read from the primary for a while
+# (after SessionMiddleware, so the session is saved with the response)
+if 'replica' in DATABASES:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware') + 1,
+        'api.middleware.ReplicaStickinessMiddleware',
+    )
+
 ROOT_URLCONF = 'trikusec.urls_frontend'
 
 # SSL configuration (development)
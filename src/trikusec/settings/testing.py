@@ -6,17 +6,31 @@ These settings are used when DJANGO_ENV=testing.
 from .development import *  # noqa
 
 # Testing-specific settings
-# Use in-memory SQLite for faster tests
+# Use in-memory SQLite for faster tests, with the backend of the tuned SQLite profile
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'trikusec.db.sqlite3',
         'NAME': ':memory:',
+        'OPTIONS': sqlite_tuned_options(),
     }
 }
 
 # Disable rate limiting in tests
 RATELIMIT_ENABLE = False
 
+# Run compliance recompute jobs inside the request (no background threads)
+COMPLIANCE_JOBS_INLINE = True
+
+# Rule statistics are only written by tests that flush them explicitly
+RULE_STATS_FLUSH_INTERVAL = 24 * 3600
+
+# Fragment caching is only enabled by the tests that cover it
+VIEW_CACHE_TTL = 0
+CACHES['views'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'view-cache',
+}
+
 # Simpler password hashing for faster tests
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.MD5PasswordHasher',
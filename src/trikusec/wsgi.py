@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trikusec.settings')
 
 application = get_wsgi_application()
+
+from api.warmup import warm_up_worker  # noqa: E402
+warm_up_worker(resume_compliance_jobs=True)